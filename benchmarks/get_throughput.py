@@ -0,0 +1,110 @@
+'''
+Benchmark the GET throughput of a node with the log store,
+comparing /local_get (json) and /local_get_raw (mmap) for 1 KB and 1 MB values.
+
+Usage: python benchmarks/get_throughput.py [-s SECONDS] [-c CONCURRENCY]
+'''
+import argparse
+import concurrent.futures
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+import requests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import myserver.mychord.constants as ct
+import myserver.mychord.handler as handler
+import myserver.mychord.node as node
+import myserver.mychord.shared_values as sv
+
+SIZES = [('1KB', 1024), ('1MB', 1024 * 1024)]
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class QuietHandler(handler.ChordServerHandler):
+    def log_message(self, format, *args):
+        pass
+
+def _start_server(data_dir):
+    '''
+    Start a single node with the log store on a free port.
+
+    Args:
+        data_dir:   The directory of the log store.
+
+    Returns:
+        The http server.
+
+    Raises:
+        OSError
+    '''
+    ct.STORAGE_BACKEND = 'log'
+    ct.DATA_DIR = data_dir
+    sv.g_node = node.Node('0')
+    httpd = ThreadingServer(('127.0.0.1', 0), QuietHandler)
+    t = threading.Thread(target=httpd.serve_forever)
+    t.daemon = True
+    t.start()
+    return httpd
+
+def _run(url, key, seconds, concurrency):
+    '''
+    Get the key repeatedly from many threads.
+
+    Args:
+        url:            The endpoint url.
+        key:            The key to get.
+        seconds:        The duration of the run.
+        concurrency:    The number of threads.
+
+    Returns:
+        A tuple (requests per second, bytes per second).
+
+    Raises:
+        requests.ConnectionError
+    '''
+    deadline = time.time() + seconds
+    def worker():
+        session = requests.Session()
+        count = 0
+        size = 0
+        while time.time() < deadline:
+            r = session.post(url, json={'key': key})
+            assert r.status_code == 200
+            count += 1
+            size += len(r.content)
+        return (count, size)
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda _: worker(), range(0, concurrency)))
+    elapsed = time.time() - start
+    return (sum(r[0] for r in results) / elapsed, sum(r[1] for r in results) / elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description='GET throughput of the log store')
+    parser.add_argument('-s', '--seconds', type=float, default=3, help='seconds per run')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='number of clients')
+    args = parser.parse_args()
+    data_dir = tempfile.mkdtemp()
+    httpd = _start_server(data_dir)
+    base = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    try:
+        for name, size in SIZES:
+            sv.g_node.local_put(name, 'x' * size)
+        print('{:<6}{:<16}{:>12}{:>12}'.format('size', 'endpoint', 'req/s', 'MB/s'))
+        for name, size in SIZES:
+            for path in ['/local_get', '/local_get_raw']:
+                rps, bps = _run(base + path, name, args.seconds, args.concurrency)
+                print('{:<6}{:<16}{:>12.1f}{:>12.1f}'.format(name, path, rps, bps / 2**20))
+    finally:
+        httpd.shutdown()
+        sv.g_node._data.close()
+        shutil.rmtree(data_dir)
+
+if __name__ == '__main__':
+    main()
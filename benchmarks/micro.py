@@ -0,0 +1,201 @@
+'''
+Micro-benchmarks of the routing hot paths, stdlib only: the _in_range_*
+checks, closest_preceding_finger, FingerTable construction, helper._hash,
+and find_successor end to end on a mock ring, at RING_SIZE_BIT 3, 32 and 160.
+The results are compared with a baseline file and the regressions flagged.
+
+Usage:
+    python benchmarks/micro.py                      compare with the baseline
+    python benchmarks/micro.py --save               save a new baseline
+    python benchmarks/micro.py -b FILE -k finger_table    compare some benchmarks only
+
+The baseline is the time per call on the machine it was saved on, so save
+one before changing the code and compare on the same machine.
+'''
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from unittest.mock import patch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import myserver.mychord.constants as ct
+import myserver.mychord.finger_table as ft
+import myserver.mychord.helper as hp
+from myserver.mychord.node import Node
+from myserver.tests.mock_server import MockServer
+
+SIZES = [3, 32, 160]
+RING_NODES = 16         # the number of nodes of the mock ring, fewer if the ring is smaller
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'micro.json')
+
+def _ids(count):
+    '''
+    Return count node ids spread evenly over the ring.
+    '''
+    return [hp._format(i * ct.TWO_EXP[ct.RING_SIZE_BIT] // count) for i in range(0, count)]
+
+def _ring():
+    '''
+    Build a stable mock ring, with requests.post patched to reach it.
+
+    Returns:
+        A tuple (nodes, patcher), stop the patcher when done.
+    '''
+    ms = MockServer()
+    patcher = patch('requests.post')
+    post_mock = patcher.start()
+    post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+    nodes = []
+    for identity in _ids(min(RING_NODES, ct.TWO_EXP[ct.RING_SIZE_BIT])):
+        node = Node(identity)
+        ms.add_node(identity, node)
+        node.join(nodes[-1]._id if nodes else None)
+        nodes.append(node)
+    for i in range(0, 3):
+        ms.period()
+    return (nodes, patcher)
+
+def _cases():
+    '''
+    Yield (name, function) of the benchmarks at the current ring size.
+    '''
+    nodes, patcher = _ring()
+    try:
+        node = nodes[0]
+        a, b, c = _ids(3)
+        keys = ['key{}'.format(i) for i in range(0, 100)]
+        targets = [hp._hash(key) for key in keys]
+        far = nodes[len(nodes) // 2 - 1]._id
+        yield ('in_range_ie', lambda: node._in_range_ie(b, a, c))
+        yield ('in_range_ei', lambda: node._in_range_ei(a, c, b))       # wraps around
+        yield ('in_range_ee', lambda: node._in_range_ee(c, b, a))
+        yield ('closest_preceding_finger', lambda: node.closest_preceding_finger(far))
+        yield ('finger_table', lambda: ft.FingerTable(a))
+        yield ('hash_100_keys', lambda: [hp._hash(key) for key in keys])
+        yield ('find_successor_100_ids', lambda: [node.find_successor(t) for t in targets])
+    finally:
+        patcher.stop()
+
+def measure(func, repeat=7, min_time=0.1):
+    '''
+    Measure the time per call of the function, the best of the repeats.
+    The number of calls per repeat is raised until it takes min_time.
+
+    Args:
+        func:       The function to call.
+        repeat:     The number of repeats.
+        min_time:   The min seconds of one repeat.
+
+    Returns:
+        The seconds per call.
+
+    Raises:
+        N/A
+    '''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(0, number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    best = elapsed / number
+    for i in range(1, repeat):
+        start = time.perf_counter()
+        for j in range(0, number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def run(only=None):
+    '''
+    Run the benchmarks at each ring size.
+
+    Args:
+        only:   A list of benchmark names to run. If None, run all.
+
+    Returns:
+        A dict from '<name>@<bits>' to microseconds per call.
+
+    Raises:
+        N/A
+    '''
+    default_size = ct.RING_SIZE_BIT
+    results = {}
+    try:
+        for bits in SIZES:
+            ct.RING_SIZE_BIT = bits
+            ct.init()
+            for name, func in _cases():
+                if only and name not in only:
+                    continue
+                results['{}@{}'.format(name, bits)] = measure(func) * 1e6
+    finally:
+        ct.RING_SIZE_BIT = default_size
+        ct.init()
+    return results
+
+def report(baseline, results, threshold):
+    '''
+    Print the results next to the baseline, and return the regressions.
+
+    Args:
+        baseline:   A dict from benchmark to microseconds, may be empty.
+        results:    A dict from benchmark to microseconds.
+        threshold:  The ratio of slowdown counted as a regression.
+
+    Returns:
+        A list of the regressed benchmarks.
+
+    Raises:
+        N/A
+    '''
+    regressed = []
+    print('{:<32}{:>14}{:>14}{:>10}'.format('benchmark', 'baseline us', 'current us', 'change'))
+    for name in sorted(results, key=lambda n: (n.split('@')[0], int(n.split('@')[1]))):
+        after = results[name]
+        before = baseline.get(name)
+        if before is None:
+            print('{:<32}{:>14}{:>14.3f}'.format(name, '-', after))
+            continue
+        change = (after - before) / before
+        mark = ''
+        if change > threshold:
+            mark = '  REGRESSION'
+            regressed.append(name)
+        elif change < -threshold:
+            mark = '  faster'
+        print('{:<32}{:>14.3f}{:>14.3f}{:>+9.1f}%{}'.format(name, before, after, change * 100, mark))
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='micro-benchmarks of the routing hot paths')
+    parser.add_argument('-b', '--baseline', default=BASELINE, help='the baseline file')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('-k', '--only', nargs='+', help='the benchmarks to run, e.g. hash_100_keys finger_table')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2, help='the slowdown counted as a regression')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)       # keep the node logs out of the timing
+    results = run(args.only)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressed = report(baseline, results, args.threshold)
+    if args.save:
+        baseline.update(results)        # keep the benchmarks not run
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({ 'python': sys.version.split()[0], 'results': baseline }, f,
+                    indent=2, sort_keys=True)
+        print('saved to', args.baseline)
+    elif regressed:
+        print('{} regressions over {:.0f}%'.format(len(regressed), args.threshold * 100))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+'''
+YCSB-style benchmark of a running ring through the put/get paths.
+The workload is a mix of reads and updates of `--records` keys, chosen
+with a Zipfian or uniform distribution, run by `--concurrency` clients
+for `--seconds`. It reports the throughput and the p50/p99/p999 latency
+of each operation, and writes them as json to compare runs later.
+
+Usage:
+    python benchmarks/ycsb.py -n NODE_ID [--addresses FILE] [-w a|b|c]
+        [--load] [-o results.json] [--compare baseline.json]
+
+e.g. on a local ring:
+    python helper.py --run_local 16
+    python benchmarks/ycsb.py -n <id> --addresses local_ring/addresses.json --load -w b
+'''
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import requests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import myserver.mychord.helper as hp
+from myserver.mychord.client import ChordClient
+
+# the read ratio of the core YCSB workloads
+WORKLOADS = {
+        'a': 0.5,       # update heavy
+        'b': 0.95,      # read mostly
+        'c': 1.0        # read only
+        }
+PERCENTILES = [('p50', 50), ('p99', 99), ('p999', 99.9)]
+
+class Zipfian(object):
+    '''
+    Zipfian choice of an item in [0, n), item 0 the most popular.
+    Reference: Quickly Generating Billion-Record Synthetic Databases,
+    by Jim Gray et al., as used by YCSB.
+    '''
+
+    def __init__(self, n, theta=0.99):
+        self._n = n
+        self._theta = theta
+        zetan = self._zeta(n, theta)
+        self._zeta2 = self._zeta(2, theta)
+        self._alpha = 1.0 / (1.0 - theta)
+        self._eta = (1 - math.pow(2.0 / n, 1 - theta)) / (1 - self._zeta2 / zetan)
+        self._zetan = zetan
+
+    def next(self, rand):
+        u = rand.random()
+        uz = u * self._zetan
+        if uz < 1.0:
+            return 0
+        if uz < 1.0 + math.pow(0.5, self._theta):
+            return 1
+        return min(int(self._n * math.pow(self._eta * u - self._eta + 1, self._alpha)), self._n - 1)
+
+    @staticmethod
+    def _zeta(n, theta):
+        return sum(1.0 / math.pow(i + 1, theta) for i in range(0, n))
+
+class ScrambledZipfian(Zipfian):
+    '''
+    Zipfian choice with the popular items spread over the key space,
+    so the hot keys are not all next to each other on the ring.
+    '''
+
+    def next(self, rand):
+        return _fnv(super(ScrambledZipfian, self).next(rand)) % self._n
+
+class Uniform(object):
+    '''
+    Uniform choice of an item in [0, n).
+    '''
+
+    def __init__(self, n):
+        self._n = n
+
+    def next(self, rand):
+        return rand.randrange(0, self._n)
+
+class Histogram(object):
+    '''
+    Latency histogram with log buckets, each 2% wider than the one below,
+    so a percentile is within 2% whatever the number of samples.
+    '''
+    _BASE = 1.02
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = max(seconds * 1e6, 1.0)
+        bucket = int(math.log(us, self._BASE))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        '''
+        Return the latency in seconds under which p percent of the samples are.
+        '''
+        target = self.count * p / 100.0
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return math.pow(self._BASE, bucket + 1) / 1e6
+        return self.max
+
+    def summary(self):
+        '''
+        Return the count, mean, max and percentiles in milliseconds.
+        '''
+        result = { 'count': self.count }
+        if self.count:
+            result['mean'] = self.total / self.count * 1000
+            result['max'] = self.max * 1000
+            for name, p in PERCENTILES:
+                result[name] = self.percentile(p) * 1000
+        return result
+
+def _fnv(value):
+    '''
+    FNV-1a hash of an integer, as used by YCSB to scramble the items.
+    '''
+    h = 0xcbf29ce484222325
+    for i in range(0, 8):
+        h ^= (value >> (i * 8)) & 0xff
+        h = (h * 0x100000001b3) & 0xffffffffffffffff
+    return h
+
+def _key(item):
+    return 'user{}'.format(item)
+
+def load(client, records, value, batch_size=500, concurrency=8):
+    '''
+    Insert the records with /mput, so the run reads existing keys.
+
+    Args:
+        client:         A ChordClient.
+        records:        The number of records.
+        value:          The value of each record.
+        batch_size:     The number of keys per /mput.
+        concurrency:    The max number of requests in flight.
+
+    Returns:
+        The number of keys which failed.
+
+    Raises:
+        N/A
+    '''
+    batches = [[[_key(i), value] for i in range(start, min(start + batch_size, records))]
+            for start in range(0, records, batch_size)]
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        for result in executor.map(client.mput, batches):
+            failed += sum(1 for acks in result.values() if acks == 0)
+    return failed
+
+def run(client, read_ratio, chooser, value, concurrency, seconds):
+    '''
+    Run the workload.
+
+    Args:
+        client:         A ChordClient.
+        read_ratio:     The ratio of reads, the rest are updates.
+        chooser:        A Zipfian or Uniform of the records.
+        value:          The value written by an update.
+        concurrency:    The number of client threads.
+        seconds:        The duration of the run.
+
+    Returns:
+        A dict of the histograms per operation, the ops done in each
+        second, the errors and the elapsed time.
+
+    Raises:
+        N/A
+    '''
+    start = time.time()
+    deadline = start + seconds
+    timeline = [0] * (int(math.ceil(seconds)) + 1)
+    lock = threading.Lock()
+    def worker(n):
+        rand = random.Random(n)
+        hists = { 'read': Histogram(), 'update': Histogram() }
+        errors = 0
+        seconds_ops = {}
+        now = time.time()
+        while now < deadline:
+            key = _key(chooser.next(rand))
+            op = 'read' if rand.random() < read_ratio else 'update'
+            try:
+                if op == 'read':
+                    client.get(key)
+                else:
+                    client.put(key, value)
+            except (requests.RequestException, AssertionError):
+                errors += 1
+                now = time.time()
+                continue
+            end = time.time()
+            hists[op].add(end - now)
+            second = int(end - start)
+            seconds_ops[second] = seconds_ops.get(second, 0) + 1
+            now = end
+        with lock:
+            for second, count in seconds_ops.items():
+                if second < len(timeline):
+                    timeline[second] += count
+        return (hists, errors)
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(worker, range(0, concurrency)))
+    elapsed = time.time() - start
+    hists = { 'read': Histogram(), 'update': Histogram() }
+    for worker_hists, _ in results:
+        for op, hist in worker_hists.items():
+            hists[op].merge(hist)
+    return {
+            'hists': hists,
+            'timeline': timeline[:int(elapsed)],      # the full seconds only
+            'errors': sum(r[1] for r in results),
+            'elapsed': elapsed
+            }
+
+def compare(baseline, current, threshold):
+    '''
+    Print the change of each metric from the baseline, and return
+    the metrics which regressed by more than the threshold.
+
+    Args:
+        baseline:   The results of the baseline run.
+        current:    The results of this run.
+        threshold:  The ratio of change counted as a regression.
+
+    Returns:
+        A list of the names of the regressed metrics.
+
+    Raises:
+        N/A
+    '''
+    rows = [('ops_per_sec', baseline['ops_per_sec'], current['ops_per_sec'], True)]
+    for op in ['read', 'update']:
+        for name, _ in PERCENTILES:
+            before = baseline['latency_ms'].get(op, {}).get(name)
+            after = current['latency_ms'].get(op, {}).get(name)
+            if before is not None and after is not None:
+                rows.append(('{} {} ms'.format(op, name), before, after, False))
+    regressed = []
+    print('{:<20}{:>12}{:>12}{:>10}'.format('metric', 'baseline', 'current', 'change'))
+    for name, before, after, higher_better in rows:
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_better else change
+        mark = ''
+        if worse > threshold:
+            mark = '  REGRESSION'
+            regressed.append(name)
+        print('{:<20}{:>12.2f}{:>12.2f}{:>+9.1f}%{}'.format(name, before, after, change * 100, mark))
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='YCSB-style benchmark of a chord ring')
+    parser.add_argument('-n', '--node', required=True, help='the node used for lookups')
+    parser.add_argument('--addresses', metavar='FILE', help='a json file mapping node ids to host:port, e.g. local_ring/addresses.json')
+    parser.add_argument('-w', '--workload', choices=sorted(WORKLOADS), default='a', help='a: 50%% reads, b: 95%% reads, c: 100%% reads')
+    parser.add_argument('-r', '--read_ratio', type=float, help='the ratio of reads, overrides --workload')
+    parser.add_argument('-d', '--distribution', choices=['zipfian', 'uniform'], default='zipfian', help='the distribution of the keys')
+    parser.add_argument('--theta', type=float, default=0.99, help='the skew of the zipfian distribution')
+    parser.add_argument('--records', type=int, default=10000, help='the number of keys')
+    parser.add_argument('--value_size', type=int, default=100, help='the bytes of a value')
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='the number of clients')
+    parser.add_argument('-s', '--seconds', type=float, default=30, help='the duration of the run')
+    parser.add_argument('--load', action='store_true', help='insert the records before the run')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write the results as json')
+    parser.add_argument('--compare', metavar='FILE', help='compare with the results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='the change counted as a regression by --compare')
+    args = parser.parse_args()
+    if args.addresses:
+        hp.load_addresses(args.addresses)
+    read_ratio = WORKLOADS[args.workload] if args.read_ratio is None else args.read_ratio
+    if args.distribution == 'zipfian':
+        chooser = ScrambledZipfian(args.records, args.theta)
+    else:
+        chooser = Uniform(args.records)
+    value = 'x' * args.value_size
+    client = ChordClient(args.node, pool_size=args.concurrency)
+    if args.load:
+        start = time.time()
+        failed = load(client, args.records, value)
+        print('loaded {} records in {:.2f} seconds, {} failed'
+                .format(args.records, time.time() - start, failed))
+    result = run(client, read_ratio, chooser, value, args.concurrency, args.seconds)
+    client.close()
+    ops = sum(hist.count for hist in result['hists'].values())
+    results = {
+            'config': {
+                'node': args.node,
+                'read_ratio': read_ratio,
+                'distribution': args.distribution,
+                'theta': args.theta,
+                'records': args.records,
+                'value_size': args.value_size,
+                'concurrency': args.concurrency,
+                'seconds': args.seconds
+                },
+            'ops': ops,
+            'ops_per_sec': ops / result['elapsed'],
+            'errors': result['errors'],
+            'latency_ms': { op: hist.summary() for op, hist in result['hists'].items() },
+            'timeline': result['timeline']
+            }
+    print('{} ops in {:.2f} seconds, {:.1f} ops/sec, {} errors'
+            .format(ops, result['elapsed'], results['ops_per_sec'], result['errors']))
+    print('{:<8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('op', 'count', 'mean', 'p50', 'p99', 'p999'))
+    for op, summary in sorted(results['latency_ms'].items()):
+        if summary['count']:
+            print('{:<8}{:>10}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(op,
+                summary['count'], summary['mean'], summary['p50'],
+                summary['p99'], summary['p999']))
+    print('ops per second:', ' '.join(str(n) for n in results['timeline']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
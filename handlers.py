@@ -1,17 +1,33 @@
+import collections
+import concurrent.futures
+import csv
 import hashlib
+import itertools
+import json
+import os
 import random
+import signal
 import time
 import subprocess as sp
+import sys
+import threading
 import logging
 import requests
 import tabulate
 import myserver.mychord.helper as hp
 import myserver.mychord.constants as ct
+import myserver.mychord.crawl as crawl
+from myserver.mychord.client import ChordClient
 
 logger = logging.getLogger(__name__)
 
 IMAGE_NAME = 'fengzhe_chord'
 NET_NAME = 'mynet'
+LOCAL_DIR = 'local_ring'     # the logs, data and addresses of run_local_ring()
+
+_addresses = None       # container name -> ip on NET_NAME, see _resolve()
+_clients = {}       # node id -> ChordClient, see _client()
+_clients_lock = threading.Lock()
 
 def _find_image_id():
     '''
@@ -119,6 +135,162 @@ def run_node(names):
     sp.run(cmd, shell=True, stdout=sp.PIPE, check=True)
     logger.info('Done')
 
+def run_local_ring(count, base_port=9000):
+    '''
+    Start a ring of node processes on this host, without docker.
+    Each node listens on its own port from base_port, and all of them
+    read the address file LOCAL_DIR/addresses.json to reach each other.
+    The first node creates the ring and the second joins it, then the
+    others are started together and join via the two. It returns when
+    all of them are serving.
+    The logs and data of the nodes are in LOCAL_DIR.
+    The nodes use the current RING_SIZE_BIT, so the ring holds at most
+    2^RING_SIZE_BIT nodes, e.g. 7 bits for a ring of 100 nodes.
+
+    Args:
+        count:      The number of nodes.
+        base_port:  The port of the first node.
+
+    Returns:
+        A list of the node ids.
+
+    Raises:
+        ValueError if the ring is too small for the nodes.
+        RuntimeError if a node fails to start.
+    '''
+    if count > ct.TWO_EXP[ct.RING_SIZE_BIT]:
+        raise ValueError('a ring of {} bits cannot hold {} nodes, use a larger --ring_bits'
+                .format(ct.RING_SIZE_BIT, count))
+    os.makedirs(LOCAL_DIR, exist_ok=True)
+    ids = set()
+    while len(ids) < count:
+        ids.add(hp._format(random.getrandbits(ct.RING_SIZE_BIT)))
+    ids = list(ids)
+    ports = { node_id: base_port + i for i, node_id in enumerate(ids) }
+    path = os.path.abspath(os.path.join(LOCAL_DIR, 'addresses.json'))
+    with open(path, 'w') as f:
+        json.dump({ node_id: '127.0.0.1:{}'.format(port)
+            for node_id, port in ports.items() }, f)
+    hp.load_addresses(path)
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'myserver', 'main.py')
+    def start(node_id, join_id=None):
+        cmd = [sys.executable, main, node_id]
+        if join_id is not None:
+            cmd.append(join_id)
+        cmd += ['--port', str(ports[node_id]), '--addresses', path,
+                '--ring_bits', str(ct.RING_SIZE_BIT)]
+        log = open(os.path.join(LOCAL_DIR, '{}.log'.format(node_id)), 'w')
+        return sp.Popen(cmd, cwd=LOCAL_DIR, stdout=log, stderr=sp.STDOUT)
+    logger.info('Starting {} nodes on ports {}-{}'
+            .format(count, base_port, base_port + count - 1))
+    # the first two nodes join alone, since a node joining a ring of one
+    # node makes itself the successor of that node before it is serving
+    procs = {}
+    seeds = ids[:2]
+    for i, node_id in enumerate(seeds):
+        procs[node_id] = start(node_id, ids[0] if i > 0 else None)
+        _wait_ready(node_id, procs[node_id])
+    for i, node_id in enumerate(ids[2:]):
+        procs[node_id] = start(node_id, seeds[i % len(seeds)])
+    with open(os.path.join(LOCAL_DIR, 'pids.json'), 'w') as f:
+        json.dump({ node_id: proc.pid for node_id, proc in procs.items() }, f)
+    with concurrent.futures.ThreadPoolExecutor(32) as executor:
+        list(executor.map(lambda node_id: _wait_ready(node_id, procs[node_id]), ids[2:]))
+    logger.info('Done, the addresses are in {}'.format(path))
+    return ids
+
+def stop_local_ring():
+    '''
+    Stop the node processes started by run_local_ring().
+    Each node leaves the ring gracefully on SIGTERM.
+
+    Args:
+        N/A
+
+    Returns:
+        N/A
+
+    Raises:
+        OSError
+    '''
+    path = os.path.join(LOCAL_DIR, 'pids.json')
+    if not os.path.exists(path):
+        logger.info('No local ring found')
+        return
+    with open(path) as f:
+        pids = json.load(f)
+    for node_id, pid in pids.items():
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    logger.info('Stopped {} nodes'.format(len(pids)))
+    os.remove(path)
+
+def _wait_ready(node_id, proc, timeout=30):
+    '''
+    Wait until the node process answers requests.
+
+    Args:
+        node_id:    The node id.
+        proc:       The Popen of the node.
+        timeout:    The max seconds to wait.
+
+    Returns:
+        N/A
+
+    Raises:
+        RuntimeError if the node exits or does not answer in time.
+    '''
+    url = 'http://{}/get_successor'.format(hp._gen_address(node_id))
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('node {} exited, see {}.log in {}'
+                    .format(node_id, node_id, LOCAL_DIR))
+        try:
+            if requests.post(url, json={}, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError('node {} is not ready in {} seconds'.format(node_id, timeout))
+
+def leave_node(node_id):
+    '''
+    Ask the node to leave the ring gracefully.
+    It returns after the node has handed off its keys.
+
+    Args:
+        node_id:    The node id.
+
+    Returns:
+        N/A
+
+    Raises:
+        requests.RequestException
+        AssertionError
+    '''
+    logger.info('Asking node {} to leave'.format(hp._gen_net_id(node_id)))
+    _client(node_id).leave(node_id)
+    logger.info('Done')
+
+def local_leave():
+    '''
+    Ask the local node to leave the ring.
+
+    Args:
+        N/A
+
+    Returns:
+        N/A
+
+    Raises:
+        N/A
+    '''
+    r = _requests_post('http://localhost:8000/leave', {}, timeout=60)
+    assert(r.status_code==200)
+
 def clean_up(rm_img):
     '''
     clean up all the containers
@@ -182,10 +354,10 @@ def display_finger_table(node_id=None):
         # display backup successor info
         _display_backup_succ()
     else:
-        cname = hp._gen_net_id(node_id)
-        cmd = 'docker exec {} pipenv run python helper.py -f'\
-                .format(cname)
-        sp.run(cmd, shell=True)
+        ft = _client(node_id).finger_table(node_id)
+        tbody = [[i, ft[i]] for i in range(0,len(ft))]
+        print(tabulate.tabulate(tbody, headers=['Index', 'Node']))
+        print('backup successors are', _client(node_id).backup_successors(node_id))
 
 def display_data(node_id=None):
     '''
@@ -204,25 +376,43 @@ def display_data(node_id=None):
     if node_id == None:
         r = _requests_post('http://localhost:8000/display_data', {})
         assert(r.status_code==200)
-        # format the output
         data = r.json()['result']
-        tbody = [[key, data[key]] for key in data]
-        print(tabulate.tabulate(tbody, headers=['key', 'value']))
     else:
-        cname = hp._gen_net_id(node_id)
-        cmd = 'docker exec {} pipenv run python helper.py -d'\
-                .format(cname)
-        sp.run(cmd, shell=True)
+        data = _client(node_id).data(node_id)
+    # format the output
+    tbody = [[key, data[key]] for key in data]
+    print(tabulate.tabulate(tbody, headers=['key', 'value']))
 
-def remote_put(node_id, key, value):
+def remote_put(node_id, key, value, ttl=None):
     '''
-    Store the key-value pair in to ring via node_id. It will 
-    put into multiple nodes for replication.
+    Store the key-value pair in to ring via node_id. The owner of
+    the key will put it into multiple nodes for replication.
 
     Args:
         node_id:    The node id.
         key:        The key of key-value pair.
         value:      The value of key-value pair.
+        ttl:        The seconds before the key expires. None for no expiry.
+
+    Returns:
+        N/A
+
+    Raises:
+        requests.RequestException
+        AssertionError
+    '''
+    logger.info('hash({}) -> {}'.format(key, hp._hash(key)))
+    acks = _client(node_id).put(key, value, ttl)
+    print('{} replicas confirmed'.format(acks))
+
+def local_ring_put(key, value, ttl=None):
+    '''
+    Ask local node to store the (key, value) into the ring.
+
+    Args:
+        key:        The key of key-value pair.
+        value:      The value of key-value pair.
+        ttl:        The seconds before the key expires. None for no expiry.
 
     Returns:
         N/A
@@ -230,23 +420,340 @@ def remote_put(node_id, key, value):
     Raises:
         N/A
     '''
-    cname = hp._gen_net_id(node_id)
-    key_id = hp._hash(key)
-    logger.info('hash({}) -> {}'.format(key, key_id))
-    succ = key_id
-    for i in range(0, ct.BACKUP_SUCC_NUM + 1):  # put into successors and backups
-        # find successor
-        cmd = 'docker exec {} pipenv run python helper.py --local_find_successor {}'\
-                .format(cname, succ)
-        proc = sp.run(cmd, shell=True, stdout=sp.PIPE, check=True)
-        succ = proc.stdout.splitlines()[0]
-        logger.info('{}th successor is {}'.format(i, succ))
-        # put value
-        cmd = 'docker exec {} pipenv run python helper.py --local_put {} {}'\
-                .format(hp._gen_net_id(succ), key, value)
-        sp.run(cmd, shell=True, stdout=sp.PIPE, check=True)
-        # next succ
-        succ = hp._add(succ, 1)
+    payload = { 'key': key, 'value': value, 'ttl': ttl }
+    r = _requests_post('http://localhost:8000/put', payload, timeout=30)
+    assert(r.status_code==200)
+    print('{} replicas confirmed'.format(r.json()['acks']))
+
+def ring_get(node_id, key):
+    '''
+    Get the value for the key from the ring via node_id.
+
+    Args:
+        node_id:    The node id.
+        key:        The key of key-value pair.
+
+    Returns:
+        N/A
+
+    Raises:
+        requests.RequestException
+        AssertionError
+    '''
+    print(key, '->', _client(node_id).get(key))
+
+def local_ring_get(key):
+    '''
+    Ask local node to get the value for key from the ring.
+
+    Args:
+        key:        The key of key-value pair.
+
+    Returns:
+        N/A
+
+    Raises:
+        N/A
+    '''
+    payload = { 'key': key }
+    r = _requests_post('http://localhost:8000/get', payload, timeout=30)
+    assert(r.status_code==200)
+    value = r.json()['value']
+    print(key, '->', value)
+
+def remote_mput(node_id, pairs, ttl=None):
+    '''
+    Store many key-value pairs into the ring via node_id, in one
+    request per owner node.
+
+    Args:
+        node_id:    The node id.
+        pairs:      A list of [key, value].
+        ttl:        The seconds before the keys expire. None for no expiry.
+
+    Returns:
+        N/A
+
+    Raises:
+        requests.RequestException
+        AssertionError
+    '''
+    result = _client(node_id).mput(pairs, ttl)
+    print(tabulate.tabulate([[key, result[key]] for key, _ in pairs],
+        headers=['key', 'acks']))
+
+def local_ring_mput(pairs, ttl=None):
+    '''
+    Ask local node to store many key-value pairs into the ring.
+
+    Args:
+        pairs:      A list of [key, value].
+        ttl:        The seconds before the keys expire. None for no expiry.
+
+    Returns:
+        N/A
+
+    Raises:
+        N/A
+    '''
+    payload = { 'items': pairs, 'ttl': ttl }
+    r = _requests_post('http://localhost:8000/mput', payload, timeout=30)
+    assert(r.status_code==200)
+    result = r.json()['result']
+    print(tabulate.tabulate([[key, result[key]] for key, _ in pairs],
+        headers=['key', 'acks']))
+
+def ring_mget(node_id, keys):
+    '''
+    Get the values for many keys from the ring via node_id.
+
+    Args:
+        node_id:    The node id.
+        keys:       A list of keys.
+
+    Returns:
+        N/A
+
+    Raises:
+        requests.RequestException
+        AssertionError
+    '''
+    result = _client(node_id).mget(keys)
+    print(tabulate.tabulate([[key, result[key]] for key in keys],
+        headers=['key', 'value']))
+
+def local_ring_mget(keys):
+    '''
+    Ask local node to get the values for many keys from the ring.
+
+    Args:
+        keys:       A list of keys.
+
+    Returns:
+        N/A
+
+    Raises:
+        N/A
+    '''
+    payload = { 'keys': keys }
+    r = _requests_post('http://localhost:8000/mget', payload, timeout=30)
+    assert(r.status_code==200)
+    result = r.json()['result']
+    print(tabulate.tabulate([[key, result[key]] for key in keys],
+        headers=['key', 'value']))
+
+def crawl_ring(node_id, concurrency=32, as_json=False):
+    '''
+    Crawl the ring from node_id, collecting the routing state and key
+    count of every node concurrently, and print one report of the nodes
+    and the inconsistencies found.
+
+    Args:
+        node_id:        The node to start from.
+        concurrency:    The max number of requests in flight.
+        as_json:        If True, print the report as json.
+
+    Returns:
+        The report, see crawl.check().
+
+    Raises:
+        N/A
+    '''
+    report = crawl.crawl(_client(node_id), node_id, concurrency)
+    if as_json:
+        print(json.dumps(report, indent=2))
+        return report
+    tbody = [[n['id'], n['predecessor'], n['successor'], ' '.join(n['backup_succ']),
+        n['keys'], n['stale_fingers']] for n in report['nodes']]
+    print(tabulate.tabulate(tbody, headers=['Node', 'Predecessor', 'Successor',
+        'Backup successors', 'Keys', 'Stale fingers']))
+    print()
+    print('{} nodes, {} unreachable, {} keys with replicas, crawled in {:.2f} seconds'
+            .format(len(report['nodes']), len(report['unreachable']),
+                report['keys'], report['elapsed']))
+    if report['unreachable']:
+        print('unreachable:', ' '.join(report['unreachable']))
+    for issue in report['issues']:
+        print('issue:', issue)
+    if not report['issues']:
+        print('no inconsistency found')
+    return report
+
+def trace_lookup(node_id, key=None, trace_id=None, as_json=False):
+    '''
+    Look up the owner of the key via node_id with tracing, or use the
+    trace of an earlier lookup, and print the path of the lookup hop by
+    hop, reassembled from the spans recorded on the nodes.
+
+    Args:
+        node_id:    The node the lookup starts on.
+        key:        The key to look up. Ignored if trace_id is given.
+        trace_id:   The trace id of an earlier lookup via node_id.
+        as_json:    If True, print the path as json.
+
+    Returns:
+        The path, see crawl.trace().
+
+    Raises:
+        N/A
+    '''
+    client = _client(node_id)
+    if trace_id is None:
+        succ, trace_id = client.trace_find_successor(hp._hash(key))
+        print('the successor of {} is {}'.format(key, succ))
+    path = crawl.trace(client, node_id, trace_id)
+    if as_json:
+        print(json.dumps(path, indent=2))
+        return path
+    tbody = [[h['hop'], h['node'], h['peer'], h['op'], h['result'], '{:.2f}'.format(h['ms']),
+        '-' if h['server_ms'] is None else '{:.2f}'.format(h['server_ms']), h['outcome']]
+        for h in path['hops']]
+    print(tabulate.tabulate(tbody, headers=['Hop', 'From', 'To', 'Operation', 'Result',
+        'ms', 'ms on peer', 'Outcome']))
+    print()
+    print('trace {}, {} hops{}'.format(trace_id, len(path['hops']),
+        '' if path['ms'] is None else ', {:.2f} ms'.format(path['ms'])))
+    if path['unreachable']:
+        print('unreachable:', ' '.join(path['unreachable']))
+    return path
+
+def profile_node(node_id, seconds):
+    '''
+    Profile the node for the seconds and print the stacks in the
+    collapsed stack format, e.g. for flamegraph.pl.
+
+    Args:
+        node_id:    The node to profile.
+        seconds:    The duration of the profile.
+
+    Returns:
+        The stacks.
+
+    Raises:
+        N/A
+    '''
+    stacks = _client(node_id).profile(node_id, seconds)
+    print(stacks, end='')
+    return stacks
+
+def dump_threads(node_id):
+    '''
+    Print the stacks of the threads of the node.
+    '''
+    text = _client(node_id).threads(node_id)
+    print(text, end='')
+    return text
+
+def bulk_load(node_id, path, fmt=None, batch_size=1000, concurrency=8, ttl=None):
+    '''
+    Load the key-value pairs of a file into the ring.
+    The file is streamed in batches. For each batch the keys are hashed,
+    their owners are found by one /find_successor_batch request to node_id,
+    and each owner gets its keys in one /mput request, sent straight to it.
+    Up to `concurrency` requests are in flight, so the next batches are
+    read and resolved while the earlier ones are still being written.
+
+    Args:
+        node_id:        The node used for the lookups.
+        path:           The file, JSON lines of {"key": .., "value": ..}
+                        or CSV rows of key,value.
+        fmt:            'jsonl' or 'csv'. If None, guessed from the file name.
+        batch_size:     The number of keys hashed and resolved together.
+        concurrency:    The max number of requests in flight.
+        ttl:            The seconds before the keys expire. None for no expiry.
+
+    Returns:
+        A list of the keys which failed to load.
+
+    Raises:
+        OSError
+        ValueError
+    '''
+    if fmt is None:
+        fmt = 'csv' if path.endswith('.csv') else 'jsonl'
+    client = ChordClient(node_id, _resolve, pool_size=concurrency)
+    failed = []
+    loaded = 0
+    start = time.time()
+    def send(owner, items):
+        return client.mput(items, ttl, node=owner, forwarded=True)
+    with client, concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        pending = {}
+        def collect(block):
+            nonlocal loaded
+            done, _ = concurrent.futures.wait(pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED if block
+                    else concurrent.futures.ALL_COMPLETED)
+            for f in done:
+                keys = pending.pop(f)
+                if f.exception() is not None:
+                    logger.info('batch of {} keys failed: {}'.format(len(keys), f.exception()))
+                    failed.extend(keys)
+                    continue
+                for key, acks in f.result().items():
+                    if acks > 0:
+                        loaded += 1
+                    else:
+                        failed.append(key)
+        records = _read_records(path, fmt)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            items = { key: value for key, value in batch }      # the last one wins
+            ids = { key: hp._hash(key) for key in items }
+            try:
+                owners = client.find_successor_batch(list(set(ids.values())))
+            except (requests.ConnectionError, requests.Timeout, AssertionError) as e:
+                logger.info('lookup of {} keys failed: {}'.format(len(items), e))
+                failed.extend(items)
+                continue
+            groups = collections.defaultdict(list)
+            for key, value in items.items():
+                groups[owners[ids[key]]].append([key, value])
+            for owner, group in groups.items():
+                while len(pending) >= concurrency:      # keep the pipeline bounded
+                    collect(True)
+                f = executor.submit(send, owner, group)
+                pending[f] = [item[0] for item in group]
+            logger.info('{} keys loaded, {:.1f} keys/sec'
+                    .format(loaded, loaded / max(time.time() - start, 1e-6)))
+        collect(False)
+    elapsed = time.time() - start
+    print('{} keys loaded in {:.2f} seconds, {:.1f} keys/sec, {} failed'
+            .format(loaded, elapsed, loaded / max(elapsed, 1e-6), len(failed)))
+    for key in failed:
+        print('failed:', key)
+    return failed
+
+def _read_records(path, fmt):
+    '''
+    Read the key-value pairs of a file one by one.
+
+    Args:
+        path:   The file.
+        fmt:    'jsonl' for JSON lines of {"key": .., "value": ..},
+                'csv' for rows of key,value.
+
+    Returns:
+        A generator of (key, value).
+
+    Raises:
+        OSError
+        ValueError
+    '''
+    with open(path, newline='') as f:
+        if fmt == 'csv':
+            for row in csv.reader(f):
+                if row:
+                    yield (row[0], row[1])
+        elif fmt == 'jsonl':
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield (str(record['key']), record['value'])
+        else:
+            raise ValueError('unknown format {}'.format(fmt))
 
 def local_put(key, value):
     '''
@@ -278,12 +785,12 @@ def remote_get(node_id, key):
         The value for the key.
 
     Raises:
-        N/A
+        requests.RequestException
+        AssertionError
     '''
-    cname = hp._gen_net_id(node_id)
-    cmd = 'docker exec {} pipenv run python helper.py --local_get {}'\
-            .format(cname, key)
-    sp.run(cmd, shell=True)
+    value, _, _ = _client(node_id).local_get(node_id, key)
+    print(key, '->', value)
+    return value
 
 def local_get(key):
     '''
@@ -304,6 +811,59 @@ def local_get(key):
     value = r.json()['value']
     print(key, '->', value)
 
+def _client(node_id):
+    '''
+    Return the ChordClient with node_id as the seed, talking to the
+    containers by their addresses on the docker network.
+    The clients are kept for the life of the process, so the commands
+    of a shell session reuse their connections and ownership caches.
+
+    Args:
+        node_id:    The node used for lookups.
+
+    Returns:
+        A ChordClient.
+
+    Raises:
+        N/A
+    '''
+    with _clients_lock:
+        if node_id not in _clients:
+            _clients[node_id] = ChordClient(node_id, _resolve)
+        return _clients[node_id]
+
+def _resolve(node_id):
+    '''
+    Return the address of the node. A node in the loaded address file
+    is used as is. Otherwise the container addresses are found once by
+    `docker network inspect`, the container name is used if it is not
+    found, e.g. when running inside the network.
+
+    Args:
+        node_id:    The node id.
+
+    Returns:
+        A string 'host:port'.
+
+    Raises:
+        N/A
+    '''
+    global _addresses
+    address = hp._lookup_address(node_id)
+    if address is not None:     # e.g. a ring of run_local_ring()
+        return address
+    if _addresses is None:
+        _addresses = {}
+        cmd = 'docker network inspect {}'.format(NET_NAME)
+        proc = sp.run(cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
+        if proc.returncode == 0:
+            for network in json.loads(proc.stdout.decode('utf-8')):
+                for container in network.get('Containers', {}).values():
+                    ip = container['IPv4Address'].split('/')[0]
+                    _addresses[container['Name']] = ip
+    cname = hp._gen_net_id(node_id)
+    return '{}:{}'.format(_addresses.get(cname, cname), ct.NODE_PORT)
+
 def _requests_post(url, payload, timeout=2):
     correct = False
     r = None
@@ -1,14 +1,30 @@
 import argparse
 import logging
 import handlers
+import myserver.mychord.constants as ct
+import myserver.mychord.helper as hp
+import shell
 
 logging.basicConfig(level=logging.INFO)
 
-def main():
+def _pairs(args):
+    '''
+    Turn [KEY VALUE KEY VALUE ...] into [[KEY, VALUE], ...].
+    '''
+    if len(args) % 2 != 0:
+        raise SystemExit('keys and values must come in pairs')
+    return [[args[i], args[i+1]] for i in range(0, len(args), 2)]
+
+def _parser():
+    '''
+    Build the parser of the command line, also used for each shell command.
+    '''
     # define arguments
     parser = argparse.ArgumentParser(description='helper script for management nodes')
     ex_group = parser.add_mutually_exclusive_group()
     ex_group.add_argument('-r', '--run_node', metavar='NODE_ID [JOIN_BY_NODE_ID]', nargs='+', help='run the chord node with the name(no hash)')
+    ex_group.add_argument('-L', '--run_local', metavar='COUNT', type=int, help='run a ring of COUNT node processes on this host without docker, on ports from --base_port. The ring holds at most 2^RING_SIZE_BIT nodes, pass --ring_bits for a larger one. The following commands need --addresses local_ring/addresses.json and the same --ring_bits.')
+    ex_group.add_argument('--stop_local', action='store_true', help='stop the nodes started by --run_local')
     ex_group.add_argument('-b', '--build_image', action='store_true', help='build the chord image')
     ex_group.add_argument('-c', '--clean_up', metavar='REMOVE_IMAGE', nargs='?', type=bool, const=False, help='clean up and arg is to remove image or not')
     ex_group.add_argument('-n', '--create_network', action='store_true', help='create network')
@@ -16,15 +32,53 @@ def main():
     ex_group.add_argument('-d', '--display_data', metavar='NODE_ID', nargs='?', type=str, const='-1', help='display the key value data, if no NODE_ID, it returns the finger table of the local node.')
     ex_group.add_argument('-p', '--remote_put', metavar='NODE_ID KEY VALUE', nargs=3, type=str, help='store key-value pair into the ring via the node. This is application layer put function, so it will put the data into multiple nodes for replication.')
     ex_group.add_argument('-g', '--remote_get', metavar='NODE_ID KEY', nargs=2, type=str, help='get value for the key from the the node, not the ring.')
+    ex_group.add_argument('-G', '--ring_get', metavar='NODE_ID KEY', nargs=2, type=str, help='get value for the key from the ring via the node.')
+    ex_group.add_argument('-P', '--remote_mput', metavar='NODE_ID KEY VALUE [KEY VALUE ...]', nargs='+', type=str, help='store many key-value pairs into the ring via the node, in one request per owner node.')
+    ex_group.add_argument('-M', '--ring_mget', metavar='NODE_ID KEY [KEY ...]', nargs='+', type=str, help='get the values for many keys from the ring via the node.')
+    ex_group.add_argument('-B', '--bulk_load', metavar='NODE_ID FILE', nargs=2, type=str, help='load the key-value pairs of a JSON lines or CSV file into the ring, with lookups via the node.')
+    ex_group.add_argument('-C', '--crawl', metavar='NODE_ID', nargs=1, type=str, help='crawl the ring from the node, collect the state of every node concurrently and report the inconsistencies.')
+    ex_group.add_argument('-T', '--trace', metavar='NODE_ID KEY', nargs=2, type=str, help='look up the owner of the key via the node with tracing, and print the path of the lookup hop by hop.')
+    ex_group.add_argument('--show_trace', metavar='NODE_ID TRACE_ID', nargs=2, type=str, help='print the path of an earlier lookup via the node, by the trace id returned by /find_successor.')
+    ex_group.add_argument('--profile', metavar='NODE_ID SECONDS', nargs=2, type=str, help='sample the stacks of the threads of the node for the seconds, and print them in the collapsed stack format.')
+    ex_group.add_argument('--threads', metavar='NODE_ID', nargs=1, type=str, help='print the stacks of the threads of the node.')
+    ex_group.add_argument('-l', '--leave', metavar='NODE_ID', nargs=1, type=str, help='ask the node to leave the ring gracefully, its keys are handed off to its successor.')
+    ex_group.add_argument('-i', '--shell', metavar='SCRIPT', nargs='?', const='-', help='run the commands of the script, one per line, or read them from stdin if no SCRIPT. A command ending with & runs in the background, wait waits for them.')
     ex_group.add_argument('-s', '--sha1', metavar='key', nargs=1, type=str, help='calculate the sha1 hash based on ring size')
     # followings are used internally
     ex_group.add_argument('--local_put', metavar='KEY VALUE', nargs=2, help='store key-value pair into the local node')
     ex_group.add_argument('--local_get', metavar='KEY', nargs=1, type=str, help='get value for the key from the local node')
+    ex_group.add_argument('--local_ring_put', metavar='KEY VALUE', nargs=2, help='store key-value pair into the ring via the local node')
+    ex_group.add_argument('--local_ring_mput', metavar='KEY VALUE [KEY VALUE ...]', nargs='+', help='store many key-value pairs into the ring via the local node')
+    ex_group.add_argument('--local_ring_mget', metavar='KEY', nargs='+', type=str, help='get the values for many keys from the ring via the local node')
+    ex_group.add_argument('--local_ring_get', metavar='KEY', nargs=1, type=str, help='get value for the key from the ring via the local node')
+    ex_group.add_argument('--local_leave', action='store_true', help='ask the local node to leave the ring')
     ex_group.add_argument('--local_find_successor', metavar='ID', nargs=1, type=str, help='find the successor of the identity')
+    parser.add_argument('--addresses', metavar='FILE', help='a json file mapping node ids to host:port, e.g. the one written by --run_local')
+    parser.add_argument('--ring_bits', type=int, help='the ring size in bits, for --run_local and the commands to its nodes. Default is RING_SIZE_BIT')
+    parser.add_argument('--base_port', type=int, default=9000, help='the port of the first node for --run_local')
+    parser.add_argument('--ttl', metavar='SECONDS', type=float, help='expire the key after the seconds, used with --remote_put, --remote_mput and --bulk_load')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='the file format for --bulk_load, guessed from the file name by default')
+    parser.add_argument('--batch_size', type=int, default=1000, help='the number of keys resolved together by --bulk_load')
+    parser.add_argument('--concurrency', type=int, default=8, help='the max number of requests in flight for --bulk_load and --crawl')
+    parser.add_argument('--json', action='store_true', help='print the report of --crawl, --trace or --show_trace as json')
+    return parser
+
+def _dispatch(parser, args):
+    '''
+    Run the command of the parsed arguments.
+    '''
+    if args.ring_bits:
+        ct.RING_SIZE_BIT = args.ring_bits
+        ct.init()
+    if args.addresses:
+        hp.load_addresses(args.addresses)
     # behave according to the arguments
-    args = parser.parse_args()
     if args.build_image:
         handlers.build_image()
+    elif args.run_local:
+        print(' '.join(sorted(handlers.run_local_ring(args.run_local, args.base_port))))
+    elif args.stop_local:
+        handlers.stop_local_ring()
     elif args.run_node:
         handlers.run_node(args.run_node)
     elif args.clean_up != None:     # could be False
@@ -45,7 +99,7 @@ def main():
         node_id = args.remote_put[0]
         key = args.remote_put[1]
         value = args.remote_put[2]
-        handlers.remote_put(node_id, key, value)
+        handlers.remote_put(node_id, key, value, args.ttl)
     elif args.local_put:
         key = args.local_put[0]
         value = args.local_put[1]
@@ -60,10 +114,53 @@ def main():
     elif args.local_find_successor:
         identity = args.local_find_successor[0]
         handlers.local_find_successor(identity)
+    elif args.ring_get:
+        node_id = args.ring_get[0]
+        key = args.ring_get[1]
+        handlers.ring_get(node_id, key)
+    elif args.local_ring_put:
+        key = args.local_ring_put[0]
+        value = args.local_ring_put[1]
+        handlers.local_ring_put(key, value, args.ttl)
+    elif args.remote_mput:
+        node_id = args.remote_mput[0]
+        pairs = _pairs(args.remote_mput[1:])
+        handlers.remote_mput(node_id, pairs, args.ttl)
+    elif args.local_ring_mput:
+        handlers.local_ring_mput(_pairs(args.local_ring_mput), args.ttl)
+    elif args.ring_mget:
+        handlers.ring_mget(args.ring_mget[0], args.ring_mget[1:])
+    elif args.local_ring_mget:
+        handlers.local_ring_mget(args.local_ring_mget)
+    elif args.local_ring_get:
+        handlers.local_ring_get(args.local_ring_get[0])
+    elif args.bulk_load:
+        handlers.bulk_load(args.bulk_load[0], args.bulk_load[1], args.format,
+                args.batch_size, args.concurrency, args.ttl)
+    elif args.crawl:
+        handlers.crawl_ring(args.crawl[0], args.concurrency, args.json)
+    elif args.trace:
+        handlers.trace_lookup(args.trace[0], key=args.trace[1], as_json=args.json)
+    elif args.show_trace:
+        handlers.trace_lookup(args.show_trace[0], trace_id=args.show_trace[1], as_json=args.json)
+    elif args.profile:
+        handlers.profile_node(args.profile[0], float(args.profile[1]))
+    elif args.threads:
+        handlers.dump_threads(args.threads[0])
+    elif args.leave:
+        handlers.leave_node(args.leave[0])
+    elif args.local_leave:
+        handlers.local_leave()
     elif args.sha1:
         handlers.display_hash(args.sha1[0])
+    elif args.shell:
+        shell.run(_parser, _dispatch, args.shell)
     else:
         parser.print_help()
 
+def main():
+    parser = _parser()
+    _dispatch(parser, parser.parse_args())
+
 if __name__ == '__main__':
     main()
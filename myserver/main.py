@@ -1,34 +1,62 @@
 '''
 Main file for running a node server
 '''
+import argparse
 import sys
+import signal
 import logging
 from http.server import HTTPServer
 from socketserver import ThreadingMixIn
+import mychord.constants as ct
+import mychord.events as events
 import mychord.handler as handler
+import mychord.helper as helper
 import mychord.shared_values as sv
 
-logging.basicConfig(level=logging.DEBUG)
-
 class ThreadingServer(ThreadingMixIn, HTTPServer):
     pass
 
-def run(server_class=ThreadingServer, handler_class=handler.ChordServerHandler):
-    server_address = ('', 8000)
+def leave(signum, frame):
+    '''
+    Leave the ring gracefully when the container is stopped.
+    '''
+    print('Received signal {}, leaving the ring...'.format(signum))
+    if not sv.g_node.has_left():
+        sv.g_node.leave()
+    sys.exit(0)
+
+def run(server_class=ThreadingServer, handler_class=handler.ChordServerHandler,
+        port=ct.NODE_PORT):
+    server_address = ('', port)
     httpd = server_class(server_address, handler_class)
     httpd.serve_forever()
 
 if __name__ == '__main__':
-    if len(sys.argv)<=1:
-        print('Usage: server.py SELF_ID [JOIN_NODE_ID]')
+    parser = argparse.ArgumentParser(description='run a chord node')
+    parser.add_argument('self_id', metavar='SELF_ID', help='the identity of this node')
+    parser.add_argument('join_id', metavar='JOIN_NODE_ID', nargs='?', help='the node to join the ring via')
+    parser.add_argument('--port', type=int, default=ct.NODE_PORT, help='the port to listen on')
+    parser.add_argument('--addresses', metavar='FILE', help='a json file mapping node ids to host:port, for nodes not addressed by container name')
+    parser.add_argument('--log_level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='the level of the logs printed, DEBUG also prints the debug events')
+    parser.add_argument('--ring_bits', type=int, default=ct.RING_SIZE_BIT, help='the ring size in bits, it must be the same on every node of the ring')
+    parser.add_argument('--event_level', default=ct.EVENT_LEVEL, choices=['DEBUG', 'INFO'], help='the level of the events kept for /debug/events, INFO turns the debug events off')
+    args = parser.parse_args()
+    ct.RING_SIZE_BIT = args.ring_bits
+    ct.init()
+    logging.basicConfig(level=args.log_level)
+    events.set_level(args.event_level)
+    print('self id is: {}'.format(args.self_id))
+    if args.addresses:
+        helper.load_addresses(args.addresses)
+    # init node
+    if args.join_id is None:
+        sv.init(args.self_id)
     else:
-        print('self id is: {}'.format(sys.argv[1]))
-        # init node
-        if len(sys.argv)==2:
-            sv.init(sys.argv[1])
-        else:
-            print('join the ring via: node {}'.format(sys.argv[2]))
-            sv.init(sys.argv[1], sys.argv[2])
-        # listen to requests
-        print('Start listening...')
-        run()
+        print('join the ring via: node {}'.format(args.join_id))
+        sv.init(args.self_id, args.join_id)
+    # leave the ring on docker stop or ctrl-c
+    signal.signal(signal.SIGTERM, leave)
+    signal.signal(signal.SIGINT, leave)
+    # listen to requests
+    print('Start listening on port {}...'.format(args.port))
+    run(port=args.port)
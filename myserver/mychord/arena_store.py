@@ -0,0 +1,392 @@
+'''
+This file contains code for the compact in-memory key-value store of a node.
+'''
+import collections
+import json
+import logging
+import os
+import sys
+from . import constants as ct
+from . import store as store
+
+logger = logging.getLogger(__name__)
+
+_SPILLED = -1       # the arena of a value spilled to disk
+# flags
+_JSON = 1       # the value is not a string, saved in json
+
+class ArenaStore(store.KeyStore):
+    '''
+    Key-value store packing the values as bytes in large arena buffers,
+    instead of one Python object per value. Keys are interned.
+    The bytes of the values in memory are counted, and when they exceed
+    the memory cap, the least recently used values are spilled to a file.
+    A spilled value is brought back to memory when it is read.
+    '''
+
+    def __init__(self, spill_path, cap=None):
+        '''
+        Initialize the store.
+
+        self._arenas:   A list of bytearrays. A freed arena is None.
+        self._live:     A list of the live bytes in each arena.
+        self._current:  The index of the arena taking new values.
+        self._lru:      An ordered set of the keys in memory, the least
+                        recently used first.
+        self._spill_path:   The path of the spill file.
+        self._spill_fd:     The file descriptor of the spill file, opened
+                            on the first spill.
+
+        Args:
+            spill_path: The path of the spill file. It is only scratch
+                        space, and truncated when opened.
+            cap:        The max bytes of values in memory.
+                        If None, use MEMORY_CAP.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        super(ArenaStore, self).__init__()
+        self._cap = ct.MEMORY_CAP if cap is None else cap
+        self._arenas = [bytearray()]
+        self._live = [0]
+        self._current = 0
+        self._free = []     # the indices of freed arenas
+        self._lru = collections.OrderedDict()
+        self._mem_bytes = 0     # the live bytes in memory
+        self._spill_path = spill_path
+        self._spill_fd = None
+        self._spill_size = 0
+        self._spill_live = 0
+        self._spilled = 0       # the number of keys spilled
+        self._spill_count = 0       # the number of spills so far
+
+    def put(self, key, value, version=0, expire_at=None):
+        '''
+        Store the key-value pair if the version is not older,
+        then spill the cold values if over the memory cap.
+
+        Args:
+            key:        The key of the key-value pair.
+            value:      The value of the key-value pair.
+            version:    The version of the value.
+            expire_at:  The time when the key expires, not saved as
+                        the values do not survive a restart.
+
+        Returns:
+            True if stored. False if there is a newer version.
+
+        Raises:
+            OSError
+        '''
+        stored = super(ArenaStore, self).put(sys.intern(key), value, version, expire_at)
+        if stored:
+            self._evict()
+        return stored
+
+    def get(self, key, default=None):
+        '''
+        Get the value for the key, and mark it recently used.
+
+        Args:
+            key:        The key of the key-value pair.
+            default:    The value returned if there is no such key.
+
+        Returns:
+            The value of the key-value pair.
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            self._touch(key)
+            return super(ArenaStore, self).get(key, default)
+
+    def get_version(self, key):
+        '''
+        Get the value and its version for the key, and mark it recently used.
+
+        Args:
+            key:    The key of the key-value pair.
+
+        Returns:
+            A tuple (value, version). If there is no such key, (None, 0).
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            self._touch(key)
+            return super(ArenaStore, self).get_version(key)
+
+    def to_dict(self):
+        '''
+        Return all the key-value pairs as a dict.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict representing key-value pairs.
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            return super(ArenaStore, self).to_dict()
+
+    def compact(self):
+        '''
+        Move the values out of arenas which are mostly dead, so the arenas
+        can be freed, and rewrite the spill file if it is mostly dead.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            sparse = set(i for i, arena in enumerate(self._arenas)
+                    if arena is not None and i != self._current and
+                    self._live[i] < len(arena) * ct.ARENA_COMPACT_RATIO)
+            if sparse:
+                logger.debug('compacting {} arenas'.format(len(sparse)))
+                for key, entry in list(self._values.items()):
+                    slot = entry[1]
+                    if slot[0] in sparse:
+                        raw = self._read(slot)
+                        self._release(slot)
+                        self._values[key] = (entry[0], self._write(raw, slot[3]), entry[2])
+                for i in sparse:
+                    if self._arenas[i] is not None and self._live[i] == 0:
+                        self._arenas[i] = None
+                        self._free.append(i)
+            if self._spill_fd is not None and \
+                    self._spill_live < self._spill_size * ct.ARENA_COMPACT_RATIO:
+                self._compact_spill()
+
+    def close(self):
+        '''
+        Remove the spill file.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            if self._spill_fd is not None:
+                os.close(self._spill_fd)
+                self._spill_fd = None
+                os.remove(self._spill_path)
+
+    def memory_usage(self):
+        '''
+        Return the memory used by the store.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the key/value/index bytes in memory, the bytes
+            allocated by arenas and the spilled keys and bytes.
+
+        Raises:
+            N/A
+        '''
+        usage = super(ArenaStore, self).memory_usage()
+        arenas = [a for a in self._arenas if a is not None]
+        usage.update({
+                'cap': self._cap,
+                'arenas': len(arenas),
+                'arena_bytes': sum(len(a) for a in arenas),
+                'spilled_keys': self._spilled,
+                'spilled_bytes': self._spill_live,
+                'spill_file_bytes': self._spill_size,
+                'spills': self._spill_count
+                })
+        return usage
+
+    def _save(self, key, value, version, expire_at=None):
+        '''
+        Pack the value in the current arena.
+        '''
+        if isinstance(value, str):
+            raw, flags = value.encode('utf-8'), 0
+        else:
+            raw, flags = json.dumps(value).encode('utf-8'), _JSON
+        old = self._values.get(key)
+        if old is not None:
+            self._release(old[1])
+        self._lru[key] = None
+        self._lru.move_to_end(key)
+        return self._write(raw, flags)
+
+    def _load(self, slot):
+        '''
+        Unpack the value from its arena or the spill file.
+        '''
+        raw = self._read(slot)
+        if slot[3] & _JSON:
+            return json.loads(raw.decode('utf-8'))
+        return raw.decode('utf-8')
+
+    def _drop(self, key, entry):
+        '''
+        Free the bytes of a deleted key.
+        '''
+        self._release(entry[1])
+        self._lru.pop(key, None)
+
+    def _slot_bytes(self, slot):
+        '''
+        Return the bytes of the value in memory.
+        '''
+        return 0 if slot[0] == _SPILLED else slot[2]
+
+    def _write(self, raw, flags):
+        '''
+        Append the bytes to the current arena, or a new one if it is full.
+        It is called with the write lock held.
+
+        Args:
+            raw:    The value in bytes.
+            flags:  The flags of the value.
+
+        Returns:
+            The slot (arena, offset, length, flags) of the value.
+
+        Raises:
+            N/A
+        '''
+        arena = self._arenas[self._current]
+        if len(arena) + len(raw) > ct.ARENA_SIZE and len(arena) > 0:
+            if self._free:
+                self._current = self._free.pop()
+                self._arenas[self._current] = bytearray()
+                self._live[self._current] = 0
+            else:
+                self._current = len(self._arenas)
+                self._arenas.append(bytearray())
+                self._live.append(0)
+            arena = self._arenas[self._current]
+        offset = len(arena)
+        arena += raw
+        self._live[self._current] += len(raw)
+        self._mem_bytes += len(raw)
+        return (self._current, offset, len(raw), flags)
+
+    def _read(self, slot):
+        '''
+        Read the bytes of the slot. It is a copy, since an arena
+        cannot be resized while a view of it is alive.
+        '''
+        index, offset, length, _ = slot
+        if index == _SPILLED:
+            return os.pread(self._spill_fd, length, offset)
+        return self._arenas[index][offset:offset+length]
+
+    def _release(self, slot):
+        '''
+        Count the bytes of the slot as dead, and free its arena
+        when nothing in it is alive. It is called with the write lock held.
+        '''
+        index, _, length, _ = slot
+        if index == _SPILLED:
+            self._spill_live -= length
+            self._spilled -= 1
+            return
+        self._live[index] -= length
+        self._mem_bytes -= length
+        if self._live[index] == 0 and index != self._current:
+            self._arenas[index] = None
+            self._free.append(index)
+
+    def _touch(self, key):
+        '''
+        Mark the key recently used. A spilled value is brought back
+        to memory, which may spill other values.
+        '''
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return
+            if entry[1][0] != _SPILLED:
+                self._lru.move_to_end(key)
+                return
+            slot = entry[1]
+            raw = self._read(slot)
+            self._release(slot)
+            self._values[key] = (entry[0], self._write(raw, slot[3]), entry[2])
+            self._lru[key] = None
+        self._evict()
+
+    def _evict(self):
+        '''
+        Spill the least recently used values to the spill file
+        until the bytes in memory are under the cap.
+        '''
+        with self._lock:
+            while self._mem_bytes > self._cap and len(self._lru) > 1:
+                key, _ = self._lru.popitem(last=False)
+                entry = self._values[key]
+                slot = entry[1]
+                raw = self._read(slot)
+                self._release(slot)
+                self._values[key] = (entry[0], self._spill(raw, slot[3]), entry[2])
+                self._spill_count += 1
+
+    def _spill(self, raw, flags):
+        '''
+        Append the bytes to the spill file.
+
+        Args:
+            raw:    The value in bytes.
+            flags:  The flags of the value.
+
+        Returns:
+            The slot (_SPILLED, offset, length, flags) of the value.
+
+        Raises:
+            OSError
+        '''
+        if self._spill_fd is None:
+            dirname = os.path.dirname(self._spill_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            self._spill_fd = os.open(self._spill_path,
+                    os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        offset = self._spill_size
+        os.pwrite(self._spill_fd, raw, offset)
+        self._spill_size += len(raw)
+        self._spill_live += len(raw)
+        self._spilled += 1
+        return (_SPILLED, offset, len(raw), flags)
+
+    def _compact_spill(self):
+        '''
+        Rewrite the live values of the spill file to a new one.
+        It is called with the write lock held.
+        '''
+        spilled = [(key, entry) for key, entry in self._values.items()
+                if entry[1][0] == _SPILLED]
+        values = [(key, entry, self._read(entry[1])) for key, entry in spilled]
+        os.close(self._spill_fd)
+        os.remove(self._spill_path)
+        self._spill_fd = None
+        self._spill_size = 0
+        self._spill_live = 0
+        self._spilled = 0
+        for key, entry, raw in values:
+            self._values[key] = (entry[0], self._spill(raw, entry[1][3]), entry[2])
@@ -0,0 +1,489 @@
+'''
+This file contains the client of the chord ring, used by applications
+and helper.py to talk to the nodes directly.
+'''
+import asyncio
+import bisect
+import concurrent.futures
+import logging
+import threading
+import requests
+from . import helper as helper
+from . import trace as trace
+
+logger = logging.getLogger(__name__)
+
+def default_resolver(node_id):
+    '''
+    Return the address of the node, see helper._gen_address().
+
+    Args:
+        node_id:    The identity of the node.
+
+    Returns:
+        A string 'host:port'.
+
+    Raises:
+        N/A
+    '''
+    return helper._gen_address(node_id)
+
+class ChordClient(object):
+    '''
+    Client of the chord ring.
+    It keeps pooled connections to the nodes, so a request does not pay
+    for a new connection, and caches the key range owned by each node it
+    has found, so a put or get of a cached range goes straight to its owner.
+    The requests are sent without 'forwarded', so a stale cache only costs
+    a routing hop on the node, never a misplaced key.
+    '''
+
+    def __init__(self, seed, resolver=None, timeout=30, pool_size=10):
+        '''
+        Initialize the client.
+
+        self._owners:   The cached ranges, a sorted list of
+                        (owner identity int, owner identity, predecessor int).
+                        The owner keeps the keys in (predecessor, owner].
+
+        Args:
+            seed:       The identity of the node used for lookups.
+            resolver:   A function from node identity to 'host:port'.
+                        If None, use default_resolver().
+            timeout:    The timeout of a request in seconds.
+            pool_size:  The max number of connections kept per node.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._seed = seed
+        self._resolver = resolver or default_resolver
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._owners = []
+        self._lock = threading.Lock()
+
+    def close(self):
+        '''
+        Close the pooled connections.
+        '''
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def put(self, key, value, ttl=None, w=None):
+        '''
+        Put the key-value pair into the ring.
+
+        Args:
+            key:    The key of the key-value pair.
+            value:  The value of the key-value pair.
+            ttl:    The seconds before the key expires. None for no expiry.
+            w:      The number of replicas to confirm the write.
+                    If None, the node uses WRITE_QUORUM.
+
+        Returns:
+            The number of replicas which confirmed the write.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        payload = { 'key': key, 'value': value, 'w': w, 'ttl': ttl }
+        return self._to_owner(key, '/put', payload)['acks']
+
+    def get(self, key, r=None):
+        '''
+        Get the value for the key from the ring.
+
+        Args:
+            key:    The key of the key-value pair.
+            r:      The number of replicas to read.
+                    If None, the node uses READ_QUORUM.
+
+        Returns:
+            The value, None if there is no such key.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        return self._to_owner(key, '/get', { 'key': key, 'r': r })['value']
+
+    def mput(self, items, ttl=None, w=None, node=None, forwarded=False):
+        '''
+        Put many key-value pairs into the ring in one request.
+
+        Args:
+            items:  A list of [key, value].
+            ttl:    The seconds before the keys expire. None for no expiry.
+            w:      The number of replicas to confirm the writes.
+            node:   The node to send the request to. If None, the seed.
+            forwarded:  If True, the node owns all the keys.
+
+        Returns:
+            A dict from key to the number of replicas which confirmed it.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        payload = { 'items': items, 'ttl': ttl, 'w': w, 'forwarded': forwarded }
+        return self._post(node or self._seed, '/mput', payload)['result']
+
+    def mget(self, keys, r=None, node=None):
+        '''
+        Get the values for many keys from the ring in one request.
+
+        Args:
+            keys:   A list of keys.
+            r:      The number of replicas to read.
+            node:   The node to send the request to. If None, the seed.
+
+        Returns:
+            A dict from key to value.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        payload = { 'keys': keys, 'r': r }
+        return self._post(node or self._seed, '/mget', payload)['result']
+
+    def find_successor(self, identity):
+        '''
+        Find the successor of the identity via the seed.
+
+        Args:
+            identity:   The identity in hex.
+
+        Returns:
+            The identity of the successor.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        return self._post(self._seed, '/find_successor', { 'id': identity })['id']
+
+    def trace_find_successor(self, identity, trace_id=None):
+        '''
+        Find the successor of the identity via the seed, traced.
+
+        Args:
+            identity:   The identity in hex.
+            trace_id:   The trace id. If None, a new one is made.
+
+        Returns:
+            A tuple (successor, trace id), see trace() for the spans.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        if trace_id is None:
+            trace_id = trace.new_id()
+        result = self._post(self._seed, '/find_successor',
+                { 'id': identity, 'trace': trace_id })
+        return (result['id'], trace_id)
+
+    def find_successor_batch(self, identities):
+        '''
+        Find the successors of many identities via the seed.
+
+        Args:
+            identities: A list of identities in hex.
+
+        Returns:
+            A dict from identity to the identity of its successor.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        return self._post(self._seed, '/find_successor_batch',
+                { 'ids': identities })['result']
+
+    def owner(self, key):
+        '''
+        Return the node owning the key, from the cache if possible.
+
+        Args:
+            key:    The key.
+
+        Returns:
+            The identity of the owner.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        identity = helper._hash(key)
+        owner = self._cached_owner(int(identity, 16))
+        if owner is None:
+            owner = self.find_successor(identity)
+            pred = self._post(owner, '/get_predecessor', {})['id']
+            self._cache(owner, pred)
+        return owner
+
+    def local_get(self, node, key):
+        '''
+        Get the value of the key stored on the node.
+
+        Args:
+            node:   The identity of the node.
+            key:    The key.
+
+        Returns:
+            A tuple (value, version, expire_at).
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        r = self._post(node, '/local_get', { 'key': key })
+        return (r['value'], r['version'], r.get('expire_at'))
+
+    def finger_table(self, node):
+        '''
+        Get the finger table of the node.
+
+        Args:
+            node:   The identity of the node.
+
+        Returns:
+            A list of [predecessor, finger 1, finger 2, ...].
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        return self._post(node, '/display_finger_table', {})['result']
+
+    def backup_successors(self, node):
+        '''
+        Get the backup successors of the node.
+        '''
+        return self._post(node, '/display_backup_succ', {})['result']
+
+    def node_info(self, node):
+        '''
+        Get the routing state and key count of the node, see Node.node_info().
+        '''
+        return self._post(node, '/node_info', {})['result']
+
+    def trace(self, node, trace_id):
+        '''
+        Get the spans of the trace recorded by the node, see trace.TraceBuffer.
+        '''
+        return self._get(node, '/trace/{}'.format(trace_id)).json()['result']
+
+    def profile(self, node, seconds):
+        '''
+        Profile the node for the seconds, see profiler.profile().
+
+        Args:
+            node:       The identity of the node.
+            seconds:    The duration of the profile.
+
+        Returns:
+            The stacks in the collapsed stack format.
+
+        Raises:
+            requests.RequestException
+            AssertionError if another profile is running on the node.
+        '''
+        return self._get(node, '/debug/profile?seconds={}'.format(seconds),
+                self._timeout + seconds).text
+
+    def threads(self, node):
+        '''
+        Get the stacks of the threads of the node, see profiler.threads().
+        '''
+        return self._get(node, '/debug/threads').text
+
+    def data(self, node):
+        '''
+        Get the key-value pairs stored on the node.
+
+        Args:
+            node:   The identity of the node.
+
+        Returns:
+            A dict of the key-value pairs.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        return self._post(node, '/display_data', {})['result']
+
+    def leave(self, node):
+        '''
+        Ask the node to leave the ring. It returns after the node
+        has handed off its keys.
+
+        Args:
+            node:   The identity of the node.
+
+        Returns:
+            N/A
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        self._post(node, '/leave', {}, timeout=max(self._timeout, 60))
+        self.invalidate()
+
+    def invalidate(self):
+        '''
+        Drop the cached ranges, e.g. after the ring has changed.
+        '''
+        with self._lock:
+            self._owners = []
+
+    def _to_owner(self, key, path, payload):
+        '''
+        Send the request to the owner of the key. If the owner cannot be
+        reached, drop the cache and send it to the seed, which routes it.
+        '''
+        try:
+            return self._post(self.owner(key), path, payload)
+        except requests.ConnectionError:
+            logger.info('owner of key {} unreachable, routing via {}'
+                    .format(key, self._seed))
+            self.invalidate()
+            return self._post(self._seed, path, payload)
+
+    def _post(self, node, path, payload, timeout=None):
+        '''
+        Post the payload to the node.
+
+        Args:
+            node:       The identity of the node.
+            path:       The endpoint, e.g. '/put'.
+            payload:    The json payload.
+            timeout:    The timeout. If None, use the client timeout.
+
+        Returns:
+            The json response.
+
+        Raises:
+            requests.RequestException
+            AssertionError
+        '''
+        url = 'http://{}{}'.format(self._resolver(node), path)
+        r = self._session.post(url, json=payload, timeout=timeout or self._timeout)
+        assert(r.status_code==200)
+        return r.json()
+
+    def _get(self, node, path, timeout=None):
+        '''
+        Get the path of the node, and return the response.
+        '''
+        url = 'http://{}{}'.format(self._resolver(node), path)
+        r = self._session.get(url, timeout=timeout or self._timeout)
+        assert(r.status_code==200)
+        return r
+
+    def _cached_owner(self, id_int):
+        '''
+        Find the owner of the identity in the cache.
+
+        Args:
+            id_int:     The identity as an integer.
+
+        Returns:
+            The owner identity, None if not cached.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            if not self._owners:
+                return None
+            pos = bisect.bisect_left(self._owners, (id_int,))
+            if pos == len(self._owners):        # wrap around
+                pos = 0
+            owner_int, owner, pred_int = self._owners[pos]
+        if pred_int == owner_int:       # the only node
+            return owner
+        if pred_int < owner_int:
+            return owner if pred_int < id_int <= owner_int else None
+        return owner if id_int > pred_int or id_int <= owner_int else None
+
+    def _cache(self, owner, pred):
+        '''
+        Cache the range (pred, owner] of the owner.
+        '''
+        if pred is None:
+            return
+        entry = (int(owner, 16), owner, int(pred, 16))
+        with self._lock:
+            self._owners = [e for e in self._owners if e[1] != owner]
+            bisect.insort(self._owners, entry)
+
+class AsyncChordClient(object):
+    '''
+    The asyncio version of ChordClient. The requests run on a thread pool,
+    so many of them can be awaited together, e.g. by asyncio.gather().
+    '''
+
+    def __init__(self, seed, resolver=None, timeout=30, pool_size=10):
+        '''
+        Initialize the client, the arguments are the same as ChordClient.
+        '''
+        self._client = ChordClient(seed, resolver, timeout, pool_size)
+        self._executor = concurrent.futures.ThreadPoolExecutor(pool_size)
+
+    def close(self):
+        '''
+        Close the pooled connections and the threads.
+        '''
+        self._executor.shutdown()
+        self._client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    async def put(self, key, value, ttl=None, w=None):
+        return await self._run(self._client.put, key, value, ttl, w)
+
+    async def get(self, key, r=None):
+        return await self._run(self._client.get, key, r)
+
+    async def mput(self, items, ttl=None, w=None, node=None, forwarded=False):
+        return await self._run(self._client.mput, items, ttl, w, node, forwarded)
+
+    async def mget(self, keys, r=None, node=None):
+        return await self._run(self._client.mget, keys, r, node)
+
+    async def find_successor(self, identity):
+        return await self._run(self._client.find_successor, identity)
+
+    async def find_successor_batch(self, identities):
+        return await self._run(self._client.find_successor_batch, identities)
+
+    async def local_get(self, node, key):
+        return await self._run(self._client.local_get, node, key)
+
+    async def _run(self, func, *args):
+        '''
+        Run the blocking call on the thread pool.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
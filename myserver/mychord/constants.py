@@ -3,9 +3,40 @@ Constants for the project.
 '''
 
 CONTAINER_PREFIX = 'cr_'
+NODE_PORT = 8000       # the port of a node server, unless its address is mapped
 RING_SIZE_BIT = 5       # the ring size in bits
 BACKUP_SUCC_NUM = 2    # the number of back up successors
 CONN_RETRY = 3      # the retry times
+WRITE_QUORUM = 2       # the number of replicas to confirm a ring-level put
+READ_QUORUM = 2     # the number of replicas to read for a ring-level get
+REPLICA_TIMEOUT = 0.5      # the timeout of a replica write, it is hinted on failure
+HINT_LOG_SIZE = 10000       # the max number of hints kept for unreachable replicas
+RPC_WORKERS = 8     # the number of threads for parallel requests
+MERKLE_DEPTH = 6       # the depth of merkle trees, 2^depth leaves
+ANTI_ENTROPY_ROUNDS = 5     # run anti-entropy once every this many periodic rounds
+MIGRATION_BATCH_SIZE = 100      # the number of keys per migration request
+MIGRATION_BATCH_INTERVAL = 0.1      # the seconds to sleep between migration batches
+MIGRATION_BANDWIDTH = 1024 * 1024      # the max bytes per second of migration traffic
+MIGRATION_WAIT = 1      # the max seconds the migration thread waits for a task before checking the node left
+STORAGE_BACKEND = 'memory'       # where a node keeps its values, 'memory', 'arena' or 'log'
+DATA_DIR = 'data'       # the directory of the log store, one sub directory per node
+LOG_SEGMENT_SIZE = 64 * 1024 * 1024     # the max bytes of a log segment before it is sealed
+LOG_FSYNC = 'group'     # 'always' syncs every write, 'group' syncs writes together, 'none' never
+LOG_SYNC_INTERVAL = 0.005       # the seconds a group sync waits to gather writes
+LOG_COMPACT_RATIO = 0.5     # compact a sealed segment when this ratio of its bytes is dead
+LOG_MMAP_THRESHOLD = 64 * 1024      # values of at least this many bytes are read by mmap
+MEMORY_CAP = 256 * 1024 * 1024      # the max bytes of values in memory for the arena store
+ARENA_SIZE = 1024 * 1024        # the bytes of an arena packing values
+ARENA_COMPACT_RATIO = 0.5       # compact an arena or the spill file when less than this ratio is alive
+TTL_TICK = 0.1      # the seconds of a slot in the lowest timer wheel
+TTL_WHEEL_SLOTS = 64        # the number of slots of each timer wheel
+TTL_WHEEL_LEVELS = 4        # the number of timer wheels, covering 64^4 ticks
+TRACE_BUFFER_SIZE = 4096      # the max number of lookup spans kept by a node for /trace
+EVENT_LEVEL = 'DEBUG'       # the level of the events kept for /debug/events, 'INFO' turns the debug events off
+EVENT_BUFFER_SIZE = 10000       # the max number of events kept for /debug/events
+EVENT_SAMPLE_EVERY = 100        # keep one of every this many events on the hot paths
+PROFILE_INTERVAL = 0.01        # the seconds between the samples of /debug/profile
+PROFILE_MAX_SECONDS = 60        # the max duration of /debug/profile
 TWO_EXP = []  # the 2^i table, to speed up
 
 def init():
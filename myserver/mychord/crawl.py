@@ -0,0 +1,240 @@
+'''
+This file contains the ring crawl, which collects the routing state of
+every node and checks it against the ring of the nodes found, and the
+trace crawl, which reassembles the path of a traced lookup.
+'''
+import bisect
+import concurrent.futures
+import logging
+import time
+import requests
+from . import constants as ct
+from . import helper as helper
+
+logger = logging.getLogger(__name__)
+
+def crawl(client, seed, concurrency=32):
+    '''
+    Crawl the ring from the seed. The node info of each node is fetched
+    concurrently, and every node it points to (predecessor, successor,
+    fingers and backup successors) is fetched in turn, so the ring is
+    covered in about log(N) rounds instead of N successor hops.
+
+    Args:
+        client:         A ChordClient.
+        seed:           The node to start from.
+        concurrency:    The max number of requests in flight.
+
+    Returns:
+        A report dict, see check().
+
+    Raises:
+        N/A
+    '''
+    start = time.time()
+    infos = {}
+    unreachable = set()
+    seen = set([seed])
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        pending = { executor.submit(client.node_info, seed): seed }
+        while pending:
+            done, _ = concurrent.futures.wait(pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                node = pending.pop(f)
+                try:
+                    info = f.result()
+                except (requests.RequestException, AssertionError) as e:
+                    logger.debug('node {} is unreachable: {}'.format(node, e))
+                    unreachable.add(node)
+                    continue
+                infos[node] = info
+                for peer in _peers(info):
+                    if peer not in seen:
+                        seen.add(peer)
+                        pending[executor.submit(client.node_info, peer)] = peer
+    report = check(infos, unreachable, seed)
+    report['elapsed'] = time.time() - start
+    return report
+
+def check(infos, unreachable, seed):
+    '''
+    Check the routing state of the nodes against the ring they form.
+    A node should have the next node as successor, the previous node as
+    predecessor, the following nodes as backup successors and the
+    successor of (id + 2^(i-1)) as finger i.
+
+    Args:
+        infos:          A dict from node id to its node info.
+        unreachable:    A set of the node ids which did not answer.
+        seed:           The node the successor walk starts from.
+
+    Returns:
+        A dict with
+            'nodes':        A list of dicts, one per node in ring order, with
+                            'id', 'predecessor', 'successor', 'backup_succ',
+                            'keys' and 'stale_fingers'.
+            'unreachable':  A sorted list of the nodes which did not answer.
+            'issues':       A list of strings describing the inconsistencies.
+            'keys':         The total number of keys, replicas included.
+
+    Raises:
+        N/A
+    '''
+    ring = sorted(infos)
+    ring_ints = [int(node, 16) for node in ring]
+    issues = []
+    nodes = []
+    for i, node in enumerate(ring):
+        info = infos[node]
+        succ = ring[(i + 1) % len(ring)]
+        pred = ring[i - 1]
+        if info['successor'] != succ:
+            issues.append('{}: successor is {}{}, expected {}'.format(node,
+                info['successor'], _dead(info['successor'], unreachable), succ))
+        if info['predecessor'] is None and len(ring) > 1:
+            issues.append('{}: no predecessor'.format(node))
+        elif info['predecessor'] != pred and len(ring) > 1:
+            if _between(info['predecessor'], pred, node):
+                issues.append('{}: predecessor is {}{}, expected {}, range ({}, {}] has no owner'
+                        .format(node, info['predecessor'], _dead(info['predecessor'], unreachable),
+                            pred, pred, info['predecessor']))
+            else:
+                issues.append('{}: predecessor is {}{}, expected {}, range overlaps with {}'
+                        .format(node, info['predecessor'], _dead(info['predecessor'], unreachable),
+                            pred, pred))
+        backups = [ring[(i + j) % len(ring)] for j in range(2, len(info['backup_succ']) + 2)]
+        if len(ring) > 2 and info['backup_succ'] != backups:
+            issues.append('{}: backup successors are {}, expected {}'
+                    .format(node, info['backup_succ'], backups))
+        stale = 0
+        for j, finger in enumerate(info['fingers']):
+            start = int(helper._add(node, ct.TWO_EXP[j]), 16)
+            pos = bisect.bisect_left(ring_ints, start) % len(ring)
+            if finger != ring[pos]:
+                stale += 1
+        if stale:
+            issues.append('{}: {} of {} fingers are stale'.format(node, stale, len(info['fingers'])))
+        nodes.append({
+            'id': node,
+            'predecessor': info['predecessor'],
+            'successor': info['successor'],
+            'backup_succ': info['backup_succ'],
+            'keys': info['keys'],
+            'stale_fingers': stale
+            })
+    issues.extend(_walk(infos, seed))
+    return {
+            'nodes': nodes,
+            'unreachable': sorted(unreachable),
+            'issues': issues,
+            'keys': sum(info['keys'] for info in infos.values())
+            }
+
+def trace(client, seed, trace_id):
+    '''
+    Reassemble the path of a traced lookup. The spans are fetched from
+    the seed, then from every node a span was sent to, until no new
+    node is found. Each sent span is matched with the span its peer
+    recorded when serving it, so the time on the wire and the time on
+    the peer can be told apart.
+
+    Args:
+        client:     A ChordClient.
+        seed:       The node the lookup started on.
+        trace_id:   The trace id.
+
+    Returns:
+        A dict with
+            'hops':         A list of the sent spans ordered by hop, each
+                            with 'server_ms', the ms on the peer, None
+                            if the peer did not record it.
+            'lookups':      A list of the find_successor spans served.
+            'unreachable':  A sorted list of the nodes which did not answer.
+            'ms':           The ms of the whole lookup, None if unknown.
+
+    Raises:
+        N/A
+    '''
+    spans = []
+    unreachable = set()
+    pending = [seed]
+    seen = set(pending)
+    while pending:
+        node = pending.pop()
+        try:
+            found = client.trace(node, trace_id)
+        except (requests.RequestException, AssertionError) as e:
+            logger.debug('node {} is unreachable: {}'.format(node, e))
+            unreachable.add(node)
+            continue
+        spans.extend(found)
+        for span in found:
+            if span['peer'] is not None and span['peer'] not in seen:
+                seen.add(span['peer'])
+                pending.append(span['peer'])
+    served = dict(((span['node'], span['hop'], span['op']), span)
+            for span in spans if span['peer'] is None)
+    hops = []
+    for span in sorted(spans, key=lambda s: (s['hop'], s['start'])):
+        if span['peer'] is None:
+            continue
+        hop = dict(span)
+        match = served.get((span['peer'], span['hop'], span['op']))
+        hop['server_ms'] = match['ms'] if match else None
+        hops.append(hop)
+    lookups = sorted((span for span in spans
+        if span['peer'] is None and span['op'] == 'find_successor'),
+        key=lambda s: s['hop'])
+    return {
+            'hops': hops,
+            'lookups': lookups,
+            'unreachable': sorted(unreachable),
+            'ms': lookups[0]['ms'] if lookups and lookups[0]['node'] == seed else None
+            }
+
+def _peers(info):
+    '''
+    Return the nodes the node points to.
+    '''
+    peers = [info['predecessor'], info['successor']] + info['fingers'] + info['backup_succ']
+    return [peer for peer in peers if peer is not None]
+
+def _walk(infos, seed):
+    '''
+    Follow the successor pointers from the seed, and report
+    where the walk breaks or which nodes it misses.
+    '''
+    if seed not in infos:
+        return ['{}: the seed is unreachable'.format(seed)]
+    visited = set([seed])
+    node = infos[seed]['successor']
+    while node != seed:
+        if node not in infos:
+            return ['the successor walk from {} breaks at {} after {} nodes'
+                    .format(seed, node, len(visited))]
+        if node in visited:
+            return ['the successor walk from {} loops at {} without returning to it'
+                    .format(seed, node)]
+        visited.add(node)
+        node = infos[node]['successor']
+    if len(visited) < len(infos):
+        missed = sorted(set(infos) - visited)
+        return ['the successor walk from {} skips {} nodes: {}'
+                .format(seed, len(missed), ' '.join(missed))]
+    return []
+
+def _between(node, start, end):
+    '''
+    Check whether the node is in (start, end) on the ring.
+    '''
+    node, start, end = int(node, 16), int(start, 16), int(end, 16)
+    if start < end:
+        return start < node < end
+    return node > start or node < end
+
+def _dead(node, unreachable):
+    '''
+    Return a mark for an unreachable node.
+    '''
+    return ' (unreachable)' if node in unreachable else ''
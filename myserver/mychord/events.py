@@ -0,0 +1,134 @@
+'''
+This file contains the debug events of a node. An event is a message
+template with named fields, e.g.
+    log.debug('found successor of {identity} -> {succ}', identity=x, succ=y)
+The message is only formatted when it is read, so an event costs a level
+check when debug events are off, and a tuple in a bounded ring buffer
+when they are on. The buffer is returned by /debug/events, and the events
+also go to the logging logger if it is enabled for DEBUG. The events on
+the lookup and read/write paths are sampled, see EventLog.hot().
+'''
+import collections
+import logging
+import threading
+import time
+from . import constants as ct
+
+_level = logging.getLevelName(ct.EVENT_LEVEL)     # the events under the level are dropped
+_buffer = collections.deque(maxlen=ct.EVENT_BUFFER_SIZE)
+_lock = threading.Lock()
+
+class EventLog(object):
+    '''
+    The events of a node, written to the shared ring buffer.
+    '''
+
+    def __init__(self, name, node):
+        '''
+        Initialize the event log.
+
+        Args:
+            name:   The name of the logging logger, e.g. __name__.
+            node:   The identity of the node the events are about.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._logger = logging.getLogger(name)
+        self._node = node
+        self._counts = {}       # the number of calls of each hot event
+
+    def debug(self, msg, **fields):
+        '''
+        Record a debug event.
+
+        Args:
+            msg:        The message template, formatted with the fields.
+            fields:     The fields of the event.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        if _level > logging.DEBUG:
+            return
+        self._emit(logging.DEBUG, msg, fields)
+
+    def hot(self, msg, **fields):
+        '''
+        Record a debug event on a hot path, only one of every
+        EVENT_SAMPLE_EVERY calls with the same template is kept.
+        '''
+        if _level > logging.DEBUG:
+            return
+        count = self._counts.get(msg, 0) + 1        # racy but only for sampling
+        self._counts[msg] = count
+        if ct.EVENT_SAMPLE_EVERY > 1 and count % ct.EVENT_SAMPLE_EVERY != 1:
+            return
+        self._emit(logging.DEBUG, msg, fields)
+
+    def _emit(self, level, msg, fields):
+        with _lock:
+            _buffer.append((time.time(), level, self._node, msg, fields))
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, '(%s) %s', self._node, _Message(msg, fields))
+
+class _Message(object):
+    '''
+    Format the message only when it is printed.
+    '''
+
+    def __init__(self, msg, fields):
+        self._msg = msg
+        self._fields = fields
+
+    def __str__(self):
+        return self._msg.format(**self._fields)
+
+def set_level(level):
+    '''
+    Set the level under which the events are dropped, e.g. 'INFO'
+    or logging.INFO to turn the debug events off.
+    '''
+    global _level
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    _level = level
+
+def recent(limit=None, node=None):
+    '''
+    Return the recent events, the oldest first.
+
+    Args:
+        limit:  The max number of events, the newest kept. If None, all.
+        node:   Only return the events of the node. If None, all.
+
+    Returns:
+        A list of dicts with 'time', 'level', 'node', 'event' (the
+        template), 'message' and 'fields'.
+
+    Raises:
+        N/A
+    '''
+    with _lock:
+        events = list(_buffer)
+    if node is not None:
+        events = [e for e in events if e[2] == node]
+    if limit is not None:
+        events = events[-limit:] if limit > 0 else []
+    return [{ 'time': at, 'level': logging.getLevelName(level), 'node': who,
+        'event': msg, 'message': msg.format(**fields),
+        'fields': dict((k, _jsonable(v)) for k, v in fields.items()) }
+        for at, level, who, msg, fields in events]
+
+def _jsonable(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return str(value)
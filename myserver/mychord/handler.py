@@ -1,10 +1,76 @@
 import json
+import threading
+import time
+import urllib.parse
+from . import events as events
+from . import metrics as metrics
+from . import profiler as profiler
+from . import ttl as ttl
 from http.server import BaseHTTPRequestHandler
 from . import shared_values as sv
 
 class ChordServerHandler(BaseHTTPRequestHandler):
 
     def do_POST(self):
+        self._observe(self._do_post)
+
+    def do_GET(self):
+        self._observe(self._do_get)
+
+    def send_response(self, code, message=None):
+        self._code = code
+        super(ChordServerHandler, self).send_response(code, message)
+
+    def _observe(self, serve):
+        '''
+        Serve the request, counting it and its latency by endpoint.
+        '''
+        start = time.time()
+        self._code = None
+        try:
+            serve()
+        finally:
+            code = self._code or 500
+            path = self.path.split('?')[0] if code != 400 else 'unknown'
+            if path.startswith('/trace/'):
+                path = '/trace'
+            metrics.REQUESTS.inc(path, code)
+            metrics.REQUEST_SECONDS.observe(time.time() - start, path)
+
+    def _do_get(self):
+        path, _, query = self.path.partition('?')
+        params = urllib.parse.parse_qs(query)
+        if path == '/metrics':
+            self._response_text(200, metrics.REGISTRY.render(),
+                    'text/plain; version=0.0.4')
+        elif path.startswith('/trace/'):
+            spans = sv.g_node.get_trace(path[len('/trace/'):])
+            self._response(200, { 'result': spans })
+        elif path == '/debug/events':
+            try:
+                limit = int(params['limit'][0]) if 'limit' in params else None
+            except ValueError:
+                self._response(400, {})
+                return
+            node = params['node'][0] if 'node' in params else None
+            self._response(200, { 'result': events.recent(limit, node) })
+        elif path == '/debug/profile':
+            try:
+                seconds = float(params['seconds'][0]) if 'seconds' in params else 10
+            except ValueError:
+                self._response(400, {})
+                return
+            stacks = profiler.profile(seconds)
+            if stacks is None:      # another profile is running
+                self._response(409, {})
+            else:
+                self._response_text(200, stacks)
+        elif path == '/debug/threads':
+            self._response_text(200, profiler.threads())
+        else:
+            self._response(400, {})
+
+    def _do_post(self):
         # parse request
         ct_len = int(self.headers['Content-Length'])
         data = json.loads(self.rfile.read(ct_len).decode('utf-8'))
@@ -20,16 +86,23 @@ class ChordServerHandler(BaseHTTPRequestHandler):
             sv.g_node.set_predecessor(data['id'])
             self._response(200, {})
         elif path == '/find_successor':
-            succ = sv.g_node.find_successor(data['id'])
-            self._response(200, { 'id': succ })
+            lookup = _trace(data)       # only traced if the caller asks
+            succ = sv.g_node.find_successor(data['id'], lookup)
+            if lookup is None:
+                self._response(200, { 'id': succ })
+            else:
+                self._response(200, { 'id': succ, 'trace': lookup[0] })
+        elif path == '/find_successor_batch':
+            result = sv.g_node.find_successor_batch(data['ids'])
+            self._response(200, { 'result': result })
         elif path == '/get_successor':
-            succ = sv.g_node.get_successor()
+            succ = sv.g_node.get_successor(_trace(data))
             self._response(200, { 'id': succ})
         elif path == '/set_successor':
             sv.g_node.set_successor(data['id'])
             self._response(200, {})
         elif path == '/closest_preceding_finger':
-            cpf = sv.g_node.closest_preceding_finger(data['id'])
+            cpf = sv.g_node.closest_preceding_finger(data['id'], _trace(data))
             self._response(200, { 'id': cpf })
         elif path == '/notify':
             sv.g_node.notify(data['id'])
@@ -38,17 +111,83 @@ class ChordServerHandler(BaseHTTPRequestHandler):
             ft = sv.g_node.display_finger_table()
             self._response(200, { 'result': ft})
         elif path == '/local_put':
-            sv.g_node.local_put(data['key'], data['value'])
+            sv.g_node.local_put(data['key'], data['value'], data.get('version'),
+                    data.get('expire_at'))
             self._response(200, {})
         elif path == '/local_get':
-            value = sv.g_node.local_get(data['key'])
+            value, version, expire_at = sv.g_node.local_get_version(data['key'])
+            self._response(200, {'value': value, 'version': version,
+                'expire_at': expire_at})
+        elif path == '/local_get_raw':
+            raw, is_json, version = sv.g_node.local_get_raw(data['key'])
+            if raw is None:
+                self._response(404, {})
+            else:
+                self._response_raw(raw, is_json, version)
+        elif path == '/put':
+            expire_at = data.get('expire_at') or ttl.expire_at(data.get('ttl'))
+            acks = sv.g_node.put(data['key'], data['value'], data.get('w'),
+                    data.get('forwarded', False), expire_at)
+            self._response(200, {'acks': acks})
+        elif path == '/get':
+            value = sv.g_node.get(data['key'], data.get('r'),
+                    data.get('forwarded', False))
             self._response(200, {'value': value})
+        elif path == '/mput':
+            items = data['items']
+            if data.get('ttl'):
+                at = ttl.expire_at(data['ttl'])
+                items = [item[:2] + [at] for item in items]
+            result = sv.g_node.mput(items, data.get('w'), data.get('forwarded', False))
+            self._response(200, {'result': result})
+        elif path == '/mget':
+            result = sv.g_node.mget(data['keys'], data.get('r'),
+                    data.get('forwarded', False))
+            self._response(200, {'result': result})
+        elif path == '/local_mget':
+            result = sv.g_node.local_mget(data['keys'])
+            self._response(200, {'result': result})
+        elif path == '/local_put_batch':
+            sv.g_node.local_put_batch(data['items'])
+            self._response(200, {})
+        elif path == '/splice_out':
+            sv.g_node.splice_out(data['id'], data['predecessor'], data['successor'])
+            self._response(200, {})
+        elif path == '/leave':
+            sv.g_node.leave()       # returns after the handoff
+            self._response(200, {})
+            # stop serving, shutdown() blocks so call it in another thread
+            threading.Thread(target=self.server.shutdown).start()
         elif path == '/display_data':
             kv = sv.g_node.display_data()
             self._response(200, { 'result': kv})
+        elif path == '/range_scan':
+            limit = data.get('limit', 100)
+            if not isinstance(limit, int) or limit < 1:
+                self._response(400, {})
+                return
+            items, cursor = sv.g_node.range_scan(data['start'], data['end'],
+                    data.get('cursor'), limit)
+            self._response(200, { 'result': items, 'cursor': cursor })
+        elif path == '/merkle':
+            hashes = sv.g_node.merkle_hashes(data['start'], data['end'],
+                    data['level'], data['indices'])
+            self._response(200, { 'result': hashes })
+        elif path == '/display_memory':
+            usage = sv.g_node.display_memory()
+            self._response(200, { 'result': usage})
+        elif path == '/display_migration':
+            stats = sv.g_node.display_migration()
+            self._response(200, { 'result': stats})
+        elif path == '/display_hints':
+            stats = sv.g_node.display_hints()
+            self._response(200, { 'result': stats})
         elif path == '/display_backup_succ':
             bp_succ = sv.g_node.display_backup_succ()
             self._response(200, { 'result': bp_succ})
+        elif path == '/node_info':
+            info = sv.g_node.node_info()
+            self._response(200, { 'result': info})
         else:
             self._response(400, {})
 
@@ -57,3 +196,34 @@ class ChordServerHandler(BaseHTTPRequestHandler):
         self.send_header('content-type', 'application/json')
         self.end_headers()
         self.wfile.write(json.dumps(data).encode('utf-8'))
+
+    def _response_text(self, code, text, content_type='text/plain'):
+        body = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _response_raw(self, raw, is_json, version):
+        '''
+        Send the value bytes as the body. A memoryview is written to
+        the socket directly, without being copied.
+        '''
+        self.send_response(200)
+        if is_json:
+            self.send_header('content-type', 'application/json')
+        else:
+            self.send_header('content-type', 'application/octet-stream')
+        self.send_header('content-length', str(len(raw)))
+        self.send_header('x-version', str(version))
+        self.end_headers()
+        self.wfile.write(raw)
+
+def _trace(data):
+    '''
+    Return the (trace id, hop index) passed in the payload, None if not traced.
+    '''
+    if 'trace' not in data:
+        return None
+    return (data['trace'], data.get('hop', 0))
@@ -1,6 +1,55 @@
 import hashlib
+import json
+import os
 from . import constants as ct
 
+_addresses = {}     # node id -> 'host:port', see load_addresses()
+_address_file = None
+_address_mtime = None
+_resolver = None        # see set_resolver()
+
+def load_addresses(path):
+    '''
+    Load the addresses of the nodes from a json file of
+    {"<node id>": "host:port", ...}. The file is read again when
+    a node is not found in it and the file has changed.
+
+    Args:
+        path:   The path of the file.
+
+    Returns:
+        N/A
+
+    Raises:
+        OSError
+        ValueError
+    '''
+    global _addresses, _address_file, _address_mtime
+    mtime = os.path.getmtime(path)
+    with open(path) as f:
+        addresses = json.load(f)
+    _addresses = { _format(int(node_id, 16)): addr
+            for node_id, addr in addresses.items() }
+    _address_file = path
+    _address_mtime = mtime
+
+def set_resolver(resolver):
+    '''
+    Set the function mapping node ids to addresses.
+
+    Args:
+        resolver:   A function from the node id to 'host:port'.
+                    If None, use the loaded addresses and the default.
+
+    Returns:
+        N/A
+
+    Raises:
+        N/A
+    '''
+    global _resolver
+    _resolver = resolver
+
 def _format(value):
     '''
     Format the integer into fixed sized hex string.
@@ -56,6 +105,51 @@ def _gen_net_id(node_id):
     fname = _format(int(node_id, 16))
     return ct.CONTAINER_PREFIX + fname
 
+def _gen_address(node_id):
+    '''
+    Generate the network address for the node. It is given by the resolver
+    if set, or by the loaded addresses, or the container name and NODE_PORT.
+
+    Args:
+        node_id:   The identity of the node in hex.
+
+    Returns:
+        A string 'host:port'.
+
+    Raises:
+        N/A
+    '''
+    if _resolver is not None:
+        return _resolver(node_id)
+    address = _lookup_address(node_id)
+    if address is None:
+        address = '{}:{}'.format(_gen_net_id(node_id), ct.NODE_PORT)
+    return address
+
+def _lookup_address(node_id):
+    '''
+    Find the node in the loaded addresses.
+
+    Args:
+        node_id:   The identity of the node in hex.
+
+    Returns:
+        A string 'host:port', None if not found.
+
+    Raises:
+        N/A
+    '''
+    fname = _format(int(node_id, 16))
+    address = _addresses.get(fname)
+    if address is None and _address_file is not None:
+        try:
+            if os.path.getmtime(_address_file) != _address_mtime:
+                load_addresses(_address_file)
+                address = _addresses.get(fname)
+        except (OSError, ValueError):
+            pass
+    return address
+
 def _hash(name):
     '''
     Calculate the identity of the name on the ring, by hashing.
@@ -0,0 +1,141 @@
+'''
+This file contains code for hinted handoff.
+'''
+import collections
+import threading
+from . import constants as ct
+
+class HintLog(object):
+    '''
+    A bounded log of the writes which could not reach their replicas.
+    Each hint is kept until the replica is alive again and the write is
+    replayed. Only the newest write of a key is kept for a replica.
+    When the log is full, the oldest hint is dropped, and the replica
+    will be repaired by anti-entropy instead.
+    '''
+
+    def __init__(self, size=None):
+        '''
+        Initialize the hint log.
+
+        self._hints:    An ordered map from (target, key) to
+                        (value, version, expire_at), the oldest first.
+        self._size:     The max number of hints.
+
+        Args:
+            size:   The max number of hints. If None, use HINT_LOG_SIZE.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._hints = collections.OrderedDict()
+        self._size = ct.HINT_LOG_SIZE if size is None else size
+        self._lock = threading.Lock()
+        self._added = 0
+        self._replayed = 0
+        self._dropped = 0
+
+    def add(self, target, key, value, version, expire_at=None):
+        '''
+        Add a hint for the write to the target.
+
+        Args:
+            target:     The identity of the replica missing the write.
+            key:        The key of the key-value pair.
+            value:      The value of the key-value pair.
+            version:    The version of the value.
+            expire_at:  The time when the key expires. None for no expiry.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            old = self._hints.pop((target, key), None)
+            if old and old[1] > version:
+                value, version, expire_at = old
+            self._hints[(target, key)] = (value, version, expire_at)
+            self._added += 1
+            while len(self._hints) > self._size:
+                self._hints.popitem(last=False)
+                self._dropped += 1
+
+    def targets(self):
+        '''
+        Return the replicas having hints.
+
+        Args:
+            N/A
+
+        Returns:
+            A list of node identities.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            return list(set(target for target, _ in self._hints))
+
+    def take(self, target):
+        '''
+        Remove and return the hints of the target. If the replay fails,
+        they should be added back.
+
+        Args:
+            target:     The identity of the replica.
+
+        Returns:
+            A list of [key, value, version, expire_at].
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            keys = [k for k in self._hints if k[0] == target]
+            items = []
+            for k in keys:
+                value, version, expire_at = self._hints.pop(k)
+                items.append([k[1], value, version, expire_at])
+            return items
+
+    def count_replayed(self, count):
+        '''
+        Count the hints replayed successfully.
+
+        Args:
+            count:  The number of hints replayed.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            self._replayed += count
+
+    def stats(self):
+        '''
+        Return the statistics of the hint log.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the number of pending, added, replayed and dropped hints.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            return {
+                    'pending': len(self._hints),
+                    'added': self._added,
+                    'replayed': self._replayed,
+                    'dropped': self._dropped
+                    }
@@ -0,0 +1,573 @@
+'''
+This file contains code for the durable key-value store of a node.
+Reference:
+[1] Bitcask: A Log-Structured Hash Table for Fast Key/Value Data
+'''
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from . import constants as ct
+from . import helper as helper
+from . import store as store
+
+logger = logging.getLogger(__name__)
+
+# record: crc, flags, version, key length, value length, key, [expire_at], value
+_RECORD = struct.Struct('>IBQII')
+# hint: flags, version, key length, value offset, value length, key, [expire_at]
+_HINT = struct.Struct('>BQIQI')
+# the expiry time after the key, if the _TTL flag is set
+_EXPIRE = struct.Struct('>d')
+# flags
+_DELETED = 1        # tombstone of a deleted key
+_JSON = 2       # the value is not a string, saved in json
+_TTL = 4        # the key expires, the time is saved after the key
+
+class LogStore(store.KeyStore):
+    '''
+    Key-value store saving the values in append-only segment files.
+    Only the (segment, offset, length) of each value is kept in memory.
+    Writes are appended to the active segment, which is sealed when it
+    reaches LOG_SEGMENT_SIZE. A sealed segment has a hint file listing its
+    records without values, so the index is rebuilt quickly on start.
+    Sealed segments with many dead records are compacted by compact().
+    Values of at least LOG_MMAP_THRESHOLD bytes are read from memory-mapped
+    segments, so get_raw() can return them without copying.
+    '''
+
+    def __init__(self, path):
+        '''
+        Open the store, and rebuild the index from the segment files.
+
+        self._path:     The directory of the segment files.
+        self._segments: A map from segment id to its statistics,
+                        {'size': xx, 'dead': xx, 'tombstones': set of keys}.
+        self._readers:  A map from segment id to the file descriptor for reads.
+        self._maps:     A map from segment id to its mmap, created on the first
+                        large read. The map of the active segment is replaced
+                        when the segment grows past it.
+        self._active:   The id of the active segment.
+        self._writer:   The file object of the active segment.
+        self._records:  The records appended to the active segment,
+                        written as the hint file when sealed.
+        self._expires:  A map from key to the time it expires,
+                        for the keys with a TTL.
+
+        Args:
+            path:   The directory of the segment files.
+
+        Returns:
+            N/A
+
+        Raises:
+            OSError
+        '''
+        super(LogStore, self).__init__()
+        self._path = path
+        self._segments = {}
+        self._readers = {}
+        self._maps = {}
+        self._records = []
+        self._expires = {}
+        self._written = 0       # the sequence of the last write
+        self._synced = 0        # the sequence of the last write synced
+        self._sync_cond = threading.Condition()
+        self._closed = False
+        os.makedirs(path, exist_ok=True)
+        ids = sorted(int(name[:-4]) for name in os.listdir(path)
+                if name.endswith('.log'))
+        for seg in ids:
+            self._load_segment(seg, seg == ids[-1])
+        self._index = sorted((entry[0], key) for key, entry in self._values.items())
+        self._active = ids[-1] if ids else 0
+        self._open_active()
+        if ct.LOG_FSYNC == 'group':
+            t = threading.Thread(target=self._sync_loop)
+            t.daemon = True
+            t.start()
+
+    def compact(self):
+        '''
+        Compact the sealed segments whose dead bytes are more than
+        LOG_COMPACT_RATIO of their size. The live records are appended
+        to the active segment, then the old segment files are removed.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            OSError
+        '''
+        # the writers add segments and change their stats, so pick under the lock
+        with self._lock:
+            candidates = [(seg, stat['dead'], stat['size'])
+                    for seg, stat in sorted(self._segments.items())
+                    if seg != self._active and
+                    stat['dead'] >= stat['size'] * ct.LOG_COMPACT_RATIO]
+        for seg, dead, size in candidates:
+            logger.info('compacting segment {}, {} of {} bytes are dead'
+                    .format(seg, dead, size))
+            with self._lock:
+                stat = self._segments.get(seg)
+                if stat is None:        # compacted by another call meanwhile
+                    continue
+                for key, entry in list(self._values.items()):
+                    slot = entry[1]
+                    if slot[0] == seg:
+                        raw = self._read(slot)
+                        new = self._append(slot[3], entry[2], key, raw,
+                                self._expires.get(key))
+                        self._values[key] = (entry[0], new, entry[2])
+                # keep tombstones while older segments may have the key
+                if any(old < seg for old in self._segments):
+                    for key in stat['tombstones']:
+                        if key not in self._values:
+                            self._append(_DELETED, 0, key, b'')
+                # the sync thread needs the lock, so sync here
+                os.fsync(self._writer.fileno())
+                os.close(self._readers.pop(seg))
+                self._unmap(seg)
+                del self._segments[seg]
+                for ext in ('.log', '.hint'):
+                    name = self._file(seg, ext)
+                    if os.path.exists(name):
+                        os.remove(name)
+
+    def close(self):
+        '''
+        Sync and close the segment files.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers = {}
+            for seg in list(self._maps):
+                self._unmap(seg)
+        with self._sync_cond:
+            self._closed = True
+            self._synced = self._written
+            self._sync_cond.notify_all()
+
+    def expiries(self):
+        '''
+        Return the expiry times saved with the values.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict from key to the time it expires, for the keys with a TTL.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            return dict(self._expires)
+
+    def stats(self):
+        '''
+        Return the statistics of the segments.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the number of segments, total and dead bytes.
+
+        Raises:
+            N/A
+        '''
+        return {
+                'segments': len(self._segments),
+                'bytes': sum(s['size'] for s in self._segments.values()),
+                'dead_bytes': sum(s['dead'] for s in self._segments.values())
+                }
+
+    def _save(self, key, value, version, expire_at=None):
+        '''
+        Append the value and its expiry time to the active segment.
+        '''
+        flags = 0
+        if isinstance(value, str):
+            raw = value.encode('utf-8')
+        else:
+            raw = json.dumps(value).encode('utf-8')
+            flags |= _JSON
+        old = self._values.get(key)
+        if old is not None:
+            self._kill(key, old[1])
+        if expire_at is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = expire_at
+        return self._append(flags, version, key, raw, expire_at)
+
+    def get(self, key, default=None):
+        '''
+        Get the value for the key.
+        The lock keeps compaction from moving the value meanwhile.
+
+        Args:
+            key:        The key of the key-value pair.
+            default:    The value returned if there is no such key.
+
+        Returns:
+            The value of the key-value pair.
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            return super(LogStore, self).get(key, default)
+
+    def get_version(self, key):
+        '''
+        Get the value and its version for the key.
+        The lock keeps compaction from moving the value meanwhile.
+
+        Args:
+            key:    The key of the key-value pair.
+
+        Returns:
+            A tuple (value, version). If there is no such key, (None, 0).
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            return super(LogStore, self).get_version(key)
+
+    def to_dict(self):
+        '''
+        Return all the key-value pairs as a dict.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict representing key-value pairs.
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            return super(LogStore, self).to_dict()
+
+    def get_raw(self, key):
+        '''
+        Get the value for the key as bytes, without decoding it.
+        A large value is a memoryview of the mapped segment, so it can be
+        written to a socket without being copied.
+
+        Args:
+            key:    The key of the key-value pair.
+
+        Returns:
+            A tuple (data, is_json, version). The data is bytes or a memoryview.
+            If there is no such key, (None, False, 0).
+
+        Raises:
+            OSError
+        '''
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return (None, False, 0)
+            slot = entry[1]
+            return (self._read(slot), bool(slot[3] & _JSON), entry[2])
+
+    def _load(self, slot):
+        '''
+        Read the value from its segment.
+        '''
+        raw = self._read(slot)
+        if slot[3] & _JSON:
+            return json.loads(str(raw, 'utf-8'))
+        return str(raw, 'utf-8')
+
+    def _read(self, slot):
+        '''
+        Read the bytes of the slot. A value of at least LOG_MMAP_THRESHOLD
+        bytes is returned as a memoryview of the mapped segment.
+        The lock keeps compact() from closing the reader or the map meanwhile.
+        A view outlives the compaction, as the mmap keeps its own descriptor.
+        '''
+        seg, offset, length, _ = slot
+        with self._lock:
+            if length < ct.LOG_MMAP_THRESHOLD:
+                return os.pread(self._readers[seg], length, offset)
+            m = self._maps.get(seg)
+            if m is None or len(m) < offset + length:
+                self._unmap(seg)
+                m = mmap.mmap(self._readers[seg], 0, access=mmap.ACCESS_READ)
+                self._maps[seg] = m
+            return memoryview(m)[offset:offset+length]
+
+    def _unmap(self, seg):
+        '''
+        Forget the mmap of the segment. If a memoryview of it is still
+        in use, it is unmapped when the last view is released.
+        '''
+        m = self._maps.pop(seg, None)
+        if m is not None:
+            try:
+                m.close()
+            except BufferError:
+                pass
+
+    def _drop(self, key, entry):
+        '''
+        Append a tombstone for the deleted key.
+        '''
+        self._kill(key, entry[1])
+        self._expires.pop(key, None)
+        self._append(_DELETED, entry[2], key, b'')
+
+    def _slot_bytes(self, slot):
+        '''
+        The values are on disk, only the slot tuple is in memory.
+        '''
+        return 0
+
+    def _kill(self, key, slot):
+        '''
+        Count the record of the key in the slot as dead.
+        '''
+        seg, _, length, flags = slot
+        if seg in self._segments:
+            self._segments[seg]['dead'] += _RECORD.size + len(key.encode('utf-8')) + \
+                    (_EXPIRE.size if flags & _TTL else 0) + length
+
+    def _append(self, flags, version, key, raw, expire_at=None):
+        '''
+        Append a record to the active segment, and seal it if it is full.
+        It is called with the write lock held.
+
+        Args:
+            flags:      The flags of the record, _TTL is set by expire_at.
+            version:    The version of the value.
+            key:        The key.
+            raw:        The value in bytes.
+            expire_at:  The time when the key expires. None for no expiry.
+
+        Returns:
+            The slot (segment, offset, length, flags) of the value.
+
+        Raises:
+            OSError
+        '''
+        if self._segments[self._active]['size'] >= ct.LOG_SEGMENT_SIZE:
+            self._seal()
+        bkey = key.encode('utf-8')
+        flags &= ~_TTL
+        if expire_at is not None:
+            flags |= _TTL
+            bkey_ttl = bkey + _EXPIRE.pack(expire_at)
+        else:
+            bkey_ttl = bkey
+        body = _RECORD.pack(0, flags, version, len(bkey), len(raw))[4:] + bkey_ttl + raw
+        record = struct.pack('>I', zlib.crc32(body)) + body
+        stat = self._segments[self._active]
+        offset = stat['size'] + _RECORD.size + len(bkey_ttl)
+        self._writer.write(record)
+        self._writer.flush()        # so readers can pread it
+        stat['size'] += len(record)
+        if flags & _DELETED:
+            stat['tombstones'].add(key)
+        self._records.append((flags, version, key, offset, len(raw), expire_at))
+        self._written += 1
+        return (self._active, offset, len(raw), flags)
+
+    def _sync(self):
+        '''
+        Make the writes durable according to LOG_FSYNC.
+        'always' syncs every write. 'group' waits for the sync thread,
+        which syncs the writes of many threads together with one fsync.
+        'none' leaves it to the operating system.
+        '''
+        if ct.LOG_FSYNC == 'always':
+            with self._lock:
+                os.fsync(self._writer.fileno())
+                self._synced = self._written
+        elif ct.LOG_FSYNC == 'group':
+            self._wait_sync(self._written)
+
+    def _wait_sync(self, seq):
+        '''
+        Wait until the writes up to seq are synced.
+        '''
+        with self._sync_cond:
+            self._sync_cond.notify_all()
+            while self._synced < seq and not self._closed:
+                self._sync_cond.wait()
+
+    def _sync_loop(self):
+        '''
+        The group commit thread. It waits LOG_SYNC_INTERVAL to gather
+        the writes, then syncs them with one fsync.
+        '''
+        while True:
+            with self._sync_cond:
+                while self._synced >= self._written and not self._closed:
+                    self._sync_cond.wait()
+                if self._closed:
+                    return
+                self._sync_cond.wait(ct.LOG_SYNC_INTERVAL)
+            # a sealed segment is synced when sealed, so only sync the active one
+            seq = self._written
+            with self._lock:
+                if not self._writer.closed:
+                    os.fsync(self._writer.fileno())
+            with self._sync_cond:
+                self._synced = max(self._synced, seq)
+                self._sync_cond.notify_all()
+
+    def _seal(self):
+        '''
+        Sync and close the active segment, write its hint file,
+        and start a new active segment.
+        '''
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        with open(self._file(self._active, '.hint.tmp'), 'wb') as f:
+            for flags, version, key, offset, length, expire_at in self._records:
+                bkey = key.encode('utf-8')
+                f.write(_HINT.pack(flags, version, len(bkey), offset, length) + bkey)
+                if flags & _TTL:
+                    f.write(_EXPIRE.pack(expire_at))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(self._file(self._active, '.hint.tmp'),
+                self._file(self._active, '.hint'))
+        self._active += 1
+        self._records = []
+        self._open_active()
+
+    def _open_active(self):
+        '''
+        Open the active segment for appending.
+        '''
+        name = self._file(self._active, '.log')
+        self._writer = open(name, 'ab')
+        if self._active not in self._segments:
+            self._segments[self._active] = { 'size': 0, 'dead': 0, 'tombstones': set() }
+        if self._active not in self._readers:
+            self._readers[self._active] = os.open(name, os.O_RDONLY)
+
+    def _load_segment(self, seg, last):
+        '''
+        Apply the records of the segment to the index.
+        The hint file is used if exists, otherwise the segment is scanned,
+        and a torn record at the end of the last segment is truncated.
+
+        Args:
+            seg:    The segment id.
+            last:   Whether it is the last segment.
+
+        Returns:
+            N/A
+
+        Raises:
+            OSError
+        '''
+        name = self._file(seg, '.log')
+        stat = { 'size': os.path.getsize(name), 'dead': 0, 'tombstones': set() }
+        self._segments[seg] = stat
+        self._readers[seg] = os.open(name, os.O_RDONLY)
+        if os.path.exists(self._file(seg, '.hint')) and not last:
+            records = self._read_hint(seg)
+        else:
+            records = self._scan_segment(seg)
+            if last:        # appended records go to the hint file when sealed
+                self._records = list(records)
+        for flags, version, key, offset, length, expire_at in records:
+            old = self._values.get(key)
+            if old is not None:
+                self._kill(key, old[1])
+            if expire_at is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = expire_at
+            if flags & _DELETED:
+                stat['tombstones'].add(key)
+                self._values.pop(key, None)
+            else:
+                rid = old[0] if old else int(helper._hash(key), 16)
+                self._values[key] = (rid, (seg, offset, length, flags), version)
+
+    def _read_hint(self, seg):
+        '''
+        Read the records from the hint file of the segment.
+        '''
+        with open(self._file(seg, '.hint'), 'rb') as f:
+            data = f.read()
+        records = []
+        pos = 0
+        while pos < len(data):
+            flags, version, klen, offset, length = _HINT.unpack_from(data, pos)
+            pos += _HINT.size
+            key = data[pos:pos+klen].decode('utf-8')
+            pos += klen
+            expire_at = None
+            if flags & _TTL:
+                expire_at = _EXPIRE.unpack_from(data, pos)[0]
+                pos += _EXPIRE.size
+            records.append((flags, version, key, offset, length, expire_at))
+        return records
+
+    def _scan_segment(self, seg):
+        '''
+        Read the records from the segment file, and truncate it at
+        the first broken record.
+        '''
+        name = self._file(seg, '.log')
+        with open(name, 'rb') as f:
+            data = f.read()
+        records = []
+        pos = 0
+        while pos + _RECORD.size <= len(data):
+            crc, flags, version, klen, vlen = _RECORD.unpack_from(data, pos)
+            tlen = _EXPIRE.size if flags & _TTL else 0
+            end = pos + _RECORD.size + klen + tlen + vlen
+            if end > len(data) or zlib.crc32(data[pos+4:end]) != crc:
+                break
+            key = data[pos+_RECORD.size:pos+_RECORD.size+klen].decode('utf-8')
+            expire_at = None
+            if tlen:
+                expire_at = _EXPIRE.unpack_from(data, pos + _RECORD.size + klen)[0]
+            records.append((flags, version, key, pos + _RECORD.size + klen + tlen,
+                vlen, expire_at))
+            pos = end
+        if pos < len(data):
+            logger.info('segment {} has a broken record at {}, truncated'
+                    .format(seg, pos))
+            with open(name, 'r+b') as f:
+                f.truncate(pos)
+            self._segments[seg]['size'] = pos
+        return records
+
+    def _file(self, seg, ext):
+        '''
+        Return the path of the segment file.
+        '''
+        return os.path.join(self._path, '{:08d}{}'.format(seg, ext))
@@ -0,0 +1,107 @@
+'''
+This file contains code for the merkle tree used by anti-entropy.
+'''
+import hashlib
+from . import constants as ct
+from . import helper as helper
+
+class MerkleTree(object):
+    '''
+    Merkle tree over the keys in a range (start, end] of the ring.
+    The range is split by identity into 2^depth leaves. A leaf hashes
+    the (key, version) of its keys, an inner node hashes its two children.
+    Two replicas only need to compare the subtrees with different hashes.
+    '''
+
+    def __init__(self, start, end, entries, depth=None):
+        '''
+        Build the tree.
+
+        self._levels:   A list of levels. self._levels[0] is [root],
+                        self._levels[depth] is the leaves.
+
+        Args:
+            start:      The range start in hex, excluded.
+            end:        The range end in hex, included.
+            entries:    A list of (identity, key, version) in the range,
+                        ordered from start to end. The identity is an integer.
+            depth:      The depth of the tree. If None, use MERKLE_DEPTH.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._start = int(start, 16)
+        self._depth = ct.MERKLE_DEPTH if depth is None else depth
+        self._span = (int(end, 16) - self._start) % ct.TWO_EXP[ct.RING_SIZE_BIT]
+        leaves = [hashlib.sha1() for i in range(0, 2**self._depth)]
+        for rid, key, version in entries:
+            leaf = self._leaf_of(rid)
+            leaves[leaf].update('{}\0{}\0'.format(key, version).encode('utf-8'))
+        level = [m.hexdigest() for m in leaves]
+        self._levels = [level]
+        while len(level) > 1:
+            level = [hashlib.sha1((level[i] + level[i+1]).encode('utf-8')).hexdigest()
+                    for i in range(0, len(level), 2)]
+            self._levels.insert(0, level)
+
+    def depth(self):
+        '''
+        Return the depth of the tree.
+        '''
+        return self._depth
+
+    def get(self, level, index):
+        '''
+        Get the hash of a tree node.
+
+        Args:
+            level:  The level of the node, 0 is the root.
+            index:  The index of the node in the level.
+
+        Returns:
+            The hash in hex.
+
+        Raises:
+            IndexError
+        '''
+        return self._levels[level][index]
+
+    def leaf_range(self, index):
+        '''
+        Get the range of identities covered by a leaf.
+
+        Args:
+            index:  The index of the leaf.
+
+        Returns:
+            A tuple (start, end) in hex for the range (start, end].
+            start equals end if the leaf covers no identity.
+
+        Raises:
+            N/A
+        '''
+        leaves = 2**self._depth
+        lo = -(-index * self._span // leaves)        # ceil
+        hi = -(-(index + 1) * self._span // leaves)
+        size = ct.TWO_EXP[ct.RING_SIZE_BIT]
+        return (helper._format((self._start + lo) % size),
+                helper._format((self._start + hi) % size))
+
+    def _leaf_of(self, rid):
+        '''
+        Get the index of the leaf covering the identity.
+
+        Args:
+            rid:    The identity as an integer.
+
+        Returns:
+            The index of the leaf.
+
+        Raises:
+            N/A
+        '''
+        offset = (rid - self._start - 1) % ct.TWO_EXP[ct.RING_SIZE_BIT]
+        return offset * 2**self._depth // self._span
@@ -0,0 +1,249 @@
+'''
+This file contains the metrics of a node, exported by /metrics in the
+Prometheus text format.
+Reference:
+[1] https://prometheus.io/docs/instrumenting/exposition_formats/
+'''
+import bisect
+import itertools
+import threading
+import time
+
+_SHARDS = 8         # the number of lock stripes of a metric
+_stripes = itertools.count()        # hands out the stripes round robin
+_local = threading.local()      # the stripe of each thread
+
+# the latency buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+        0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HOP_BUCKETS = tuple(range(0, 11)) + (15, 20, 32)
+
+class _Metric(object):
+    '''
+    A metric family, one value per tuple of label values.
+    The values are split in shards, each with its own lock, and a thread
+    writes to its own stripe, handed out round robin when it first
+    writes. So the request threads rarely wait for each other, and a
+    scrape merges the shards.
+    '''
+
+    def __init__(self, name, doc, labels):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._shards = [({}, threading.Lock()) for i in range(0, _SHARDS)]
+
+    def _shard(self):
+        return self._shards[_stripe()]
+
+    def _label_text(self, values, extra=None):
+        '''
+        Format the labels as {a="x",b="y"}.
+        '''
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in pairs) + '}'
+
+class Counter(_Metric):
+    '''
+    A counter, which only goes up.
+    '''
+
+    def inc(self, *values, amount=1):
+        '''
+        Add the amount to the counter of the label values.
+        '''
+        data, lock = self._shard()
+        with lock:
+            data[values] = data.get(values, 0) + amount
+
+    def collect(self):
+        '''
+        Return a dict from label values to the total.
+        '''
+        result = {}
+        for data, lock in self._shards:
+            with lock:
+                for values, count in data.items():
+                    result[values] = result.get(values, 0) + count
+        return result
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                '# TYPE {} counter'.format(self.name)]
+        for values, count in sorted(self.collect().items()):
+            lines.append('{}{} {}'.format(self.name, self._label_text(values), count))
+        return lines
+
+class Histogram(_Metric):
+    '''
+    A histogram of observations with fixed bucket bounds.
+    '''
+
+    def __init__(self, name, doc, labels, buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *values):
+        '''
+        Count the value in the histogram of the label values.
+        '''
+        data, lock = self._shard()
+        index = bisect.bisect_left(self.buckets, value)
+        with lock:
+            entry = data.get(values)
+            if entry is None:
+                entry = data[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *values):
+        '''
+        Return a context manager observing the seconds it takes.
+        '''
+        return _Timer(self, values)
+
+    def collect(self):
+        '''
+        Return a dict from label values to (bucket counts, sum).
+        The last bucket counts the values over the largest bound.
+        '''
+        result = {}
+        for data, lock in self._shards:
+            with lock:
+                for values, (counts, total) in data.items():
+                    merged = result.get(values)
+                    if merged is None:
+                        result[values] = (list(counts), total)
+                    else:
+                        for i, count in enumerate(counts):
+                            merged[0][i] += count
+                        result[values] = (merged[0], merged[1] + total)
+        return result
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                '# TYPE {} histogram'.format(self.name)]
+        for values, (counts, total) in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name,
+                    self._label_text(values, ('le', bound)), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, self._label_text(values), total))
+            lines.append('{}_count{} {}'.format(self.name, self._label_text(values), cumulative))
+        return lines
+
+class Gauge(object):
+    '''
+    A gauge read by a function at scrape time, e.g. the keys in the store.
+    '''
+
+    def __init__(self, name, doc, labels, func):
+        '''
+        Args:
+            func:   A function returning a dict from label values to the value.
+        '''
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._func = func
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                '# TYPE {} gauge'.format(self.name)]
+        try:
+            values = self._func()
+        except Exception:       # e.g. no node yet
+            return lines
+        for label_values, value in sorted(values.items()):
+            labels = ','.join('{}="{}"'.format(k, _escape(v))
+                    for k, v in zip(self.labels, label_values))
+            lines.append('{}{} {}'.format(self.name, '{' + labels + '}' if labels else '', value))
+        return lines
+
+class _Timer(object):
+    '''
+    Observe the seconds of a with block.
+    '''
+
+    def __init__(self, histogram, values):
+        self._histogram = histogram
+        self._values = values
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(time.time() - self._start, *self._values)
+
+class Registry(object):
+    '''
+    The metrics of the process.
+    '''
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, doc, labels=()):
+        return self._add(Counter(name, doc, labels))
+
+    def histogram(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, doc, labels, buckets))
+
+    def gauge(self, name, doc, labels, func):
+        return self._add(Gauge(name, doc, labels, func))
+
+    def render(self):
+        '''
+        Return all the metrics in the Prometheus text format.
+        '''
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+def _stripe():
+    '''
+    Return the stripe of the current thread.
+    The thread ids are page aligned addresses on Linux, so they are not
+    used directly, as they would all fall in the same stripe.
+    '''
+    stripe = getattr(_local, 'stripe', None)
+    if stripe is None:
+        stripe = _local.stripe = next(_stripes) % _SHARDS
+    return stripe
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('chord_requests_total',
+        'Requests served, by endpoint and status code.', ['path', 'code'])
+REQUEST_SECONDS = REGISTRY.histogram('chord_request_seconds',
+        'Seconds to serve a request, by endpoint.', ['path'])
+RPC_SECONDS = REGISTRY.histogram('chord_rpc_seconds',
+        'Seconds of a request to another node, by peer and endpoint.', ['peer', 'path'])
+RPC_RETRIES = REGISTRY.counter('chord_rpc_retries_total',
+        'Requests to other nodes retried after a timeout, by peer.', ['peer'])
+RPC_TIMEOUTS = REGISTRY.counter('chord_rpc_timeouts_total',
+        'Requests to other nodes given up after CONN_RETRY timeouts, by peer.', ['peer'])
+RPC_ERRORS = REGISTRY.counter('chord_rpc_errors_total',
+        'Requests to other nodes failed to connect, by peer.', ['peer'])
+LOOKUP_HOPS = REGISTRY.histogram('chord_lookup_hops',
+        'Remote hops of a find_predecessor lookup started on this node.', (), HOP_BUCKETS)
+MAINTENANCE_SECONDS = REGISTRY.histogram('chord_maintenance_seconds',
+        'Seconds of a periodic maintenance task, by task.', ['task'])
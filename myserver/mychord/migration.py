@@ -0,0 +1,173 @@
+'''
+This file contains code for moving key ranges between nodes.
+'''
+import collections
+import json
+import logging
+import threading
+import time
+import requests
+from . import constants as ct
+from . import events as events
+
+logger = logging.getLogger(__name__)
+
+# the kinds of tasks
+MIGRATION = 'migration'     # a new owner joined
+REPLICATION = 'replication'     # a new replica in the successor list
+
+class Migrator(object):
+    '''
+    Migrator streams key ranges from its node to other nodes in batches.
+    Tasks are queued by notify() and the successor list changes, and run
+    by a thread of their own, so neither the request threads nor stabilize()
+    are blocked by the throttled transfer.
+    '''
+
+    def __init__(self, node):
+        '''
+        Initialize the migrator.
+
+        self._node:     The node owning the keys.
+        self._log:      The debug events of the node.
+        self._tasks:    A queue of pending tasks (kind, target, start, end).
+        self._cond:     The condition guarding the queue, notified when a task is queued.
+        self._keys:     A map from kind to the number of keys moved so far.
+        self._bytes:    A map from kind to the number of payload bytes moved so far.
+        self._done:     The number of finished tasks.
+        self._current:  The progress of the running task.
+
+        Args:
+            node:   The node which has this migrator.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._node = node
+        self._log = events.EventLog(__name__, node._id)
+        self._tasks = collections.deque()
+        self._cond = threading.Condition()
+        self._keys = { MIGRATION: 0, REPLICATION: 0 }
+        self._bytes = { MIGRATION: 0, REPLICATION: 0 }
+        self._done = 0
+        self._current = None
+
+    def add_task(self, target, start, end, kind=MIGRATION):
+        '''
+        Queue the transfer of keys in (start, end] to the target node.
+        The same pending task is only queued once.
+
+        Args:
+            target: The identity of the node receiving the keys.
+            start:  The range start, excluded.
+            end:    The range end, included.
+            kind:   MIGRATION or REPLICATION.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        task = (kind, target, start, end)
+        with self._cond:
+            if task in self._tasks:
+                return
+            self._log.debug('queue {kind} of ({start}, {end}] to {target}',
+                    kind=kind, start=start, end=end, target=target)
+            self._tasks.append(task)
+            self._cond.notify()
+
+    def wait(self, timeout=None):
+        '''
+        Wait until a task is queued.
+
+        Args:
+            timeout:    The max seconds to wait. If None, wait forever.
+
+        Returns:
+            True if there are pending tasks. False otherwise.
+
+        Raises:
+            N/A
+        '''
+        with self._cond:
+            if not self._tasks:
+                self._cond.wait(timeout)
+            return len(self._tasks) > 0
+
+    def run(self):
+        '''
+        Run all the pending tasks.
+        The keys are sent in batches of MIGRATION_BATCH_SIZE. Between batches
+        it sleeps at least MIGRATION_BATCH_INTERVAL, and long enough to keep
+        under MIGRATION_BANDWIDTH, so lookups are not starved.
+        A task whose target cannot be reached is dropped, since the range
+        falls back to this node when the target is dead.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        while True:
+            with self._cond:
+                if not self._tasks:
+                    return
+                kind, target, start, end = self._tasks.popleft()
+            items = self._node._items_in_range(start, end)
+            self._log.debug('{kind} of {keys} keys in ({start}, {end}] to {target}',
+                    kind=kind, keys=len(items), start=start, end=end, target=target)
+            self._current = { 'kind': kind, 'target': target, 'start': start,
+                    'end': end, 'sent': 0, 'total': len(items) }
+            try:
+                delay = 0
+                for i in range(0, len(items), ct.MIGRATION_BATCH_SIZE):
+                    time.sleep(delay)       # throttle
+                    batch = items[i:i+ct.MIGRATION_BATCH_SIZE]
+                    self._node.remote_local_put_batch(target, batch)
+                    size = len(json.dumps(batch))
+                    self._keys[kind] += len(batch)
+                    self._bytes[kind] += size
+                    self._current['sent'] += len(batch)
+                    self._log.hot('sent {keys} keys ({size} bytes) of {kind} to {target}',
+                            keys=len(batch), size=size, kind=kind, target=target)
+                    delay = max(ct.MIGRATION_BATCH_INTERVAL,
+                            size / ct.MIGRATION_BANDWIDTH)
+            except (requests.ConnectionError, AssertionError):
+                logger.info('({}) {} to {} failed, target is dead'
+                        .format(self._node._id, kind, target))
+            self._done += 1
+            self._current = None
+
+    def stats(self):
+        '''
+        Return the statistics of the transfers.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the keys/bytes moved in total and by kind,
+            the number of pending and finished tasks, and the progress
+            of the running task.
+
+        Raises:
+            N/A
+        '''
+        return {
+                'keys': sum(self._keys.values()),
+                'bytes': sum(self._bytes.values()),
+                'keys_by_kind': dict(self._keys),
+                'bytes_by_kind': dict(self._bytes),
+                'pending': len(self._tasks),
+                'done': self._done,
+                'current': dict(self._current) if self._current else None
+                }
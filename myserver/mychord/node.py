@@ -4,13 +4,27 @@ Reference:
 [1] https://en.wikipedia.org/wiki/Chord_(peer-to-peer)
 [2] paper by Ion Stoica*
 '''
+import collections
+import concurrent.futures
 import logging
+import os
 import random
+import threading
 import time
 import requests
 from . import finger_table as ft
 from . import constants as ct
 from . import helper as helper
+from . import migration as mg
+from . import store as store
+from . import log_store as log_store
+from . import arena_store as arena_store
+from . import merkle as merkle
+from . import metrics as metrics
+from . import hint as hint
+from . import ttl as ttl
+from . import trace as trace
+from . import events as events
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +41,18 @@ class Node(object):
         self._table:        The finger_table of this node.
                             Be aware that the successor is the finger[1].node.
         self._backup_succ:  A array of the backup successors.
+        self._data:         The key-value store, ordered by key identity.
+        self._left:         Whether this node has left the ring.
+        self._migrator:     The migrator moving keys to new owners.
+        self._executor:     The thread pool for parallel requests.
+        self._version:      The last version given to a value.
+        self._merkle:       The cached (start, end, changes, tree) of
+                            the last merkle tree built.
+        self._last_replicas:    The replicas when last checked, None before the first check.
+        self._hints:        The hinted writes for unreachable replicas.
+        self._ttl:          The timer wheel of the keys with a TTL.
+        self._traces:       The spans of the traced lookups, see /trace.
+        self._log:          The debug events of this node, see /debug/events.
 
         Args:
             identity:   The identity of this node.
@@ -38,18 +64,38 @@ class Node(object):
             N/A
         '''
         self._id = identity
+        self._log = events.EventLog(__name__, identity)
         self._predecessor = None
         self._table = ft.FingerTable(identity)      # finger table
         self._backup_succ = []      # the backup successor
-        self._data = {}     # key-value store
+        if ct.STORAGE_BACKEND == 'log':
+            self._data = log_store.LogStore(os.path.join(ct.DATA_DIR, identity))
+        elif ct.STORAGE_BACKEND == 'arena':
+            self._data = arena_store.ArenaStore(
+                    os.path.join(ct.DATA_DIR, '{}.spill'.format(identity)))
+        else:
+            self._data = store.KeyStore()     # key-value store
+        self._left = False      # set after leave()
+        self._migrator = mg.Migrator(self)
+        self._executor = concurrent.futures.ThreadPoolExecutor(ct.RPC_WORKERS)
+        self._version = 0
+        self._version_lock = threading.Lock()
+        self._merkle = None
+        self._last_replicas = None
+        self._hints = hint.HintLog()
+        self._ttl = ttl.TimerWheel()
+        self._traces = trace.TraceBuffer()
+        self._load_expiries()
 
     #-------------------------------------- start of local part --------------------------------------
-    def find_successor(self, identity):
+    def find_successor(self, identity, trace=None):
         '''
         Ask this node to find the successor of the identity.
 
         Args:
             identity:   The identity of the object.
+            trace:      A tuple (trace id, hop index) to record the spans
+                        of the lookup with, see /trace. None for no tracing.
 
         Returns:
             The identity of the successor in hex.
@@ -57,14 +103,72 @@ class Node(object):
         Raises:
             N/A
         '''
-        logger.debug('({}) finding successor of {}'
-                        .format(self._id, identity))
-        pred = self.find_predecessor(identity)
-        succ = self.remote_get_successor(pred)
-        logger.debug('({}) found successor of {} -> {}'
-                        .format(self._id, identity, succ))
+        if trace is not None:
+            return self._traces.record(trace[0], trace[1], self._id, None,
+                    'find_successor', identity, self._find_successor, identity,
+                    self._next_hop(trace))
+        return self._find_successor(identity)
+
+    def _find_successor(self, identity, trace=None):
+        '''
+        Find the successor of the identity, see find_successor().
+        '''
+        self._log.hot('finding successor of {identity}', identity=identity)
+        pred, trace = self._find_predecessor(identity, trace)
+        succ = self.remote_get_successor(pred, trace)
+        self._log.hot('found successor of {identity} -> {succ}', identity=identity, succ=succ)
         return succ
 
+    def find_successor_batch(self, identities):
+        '''
+        Find the successors of many identities at once.
+        The identities are sorted around the ring from this node. The ones
+        in (self, successor] are answered here, the others are grouped by
+        the closest preceding finger and each group is forwarded to its
+        finger in one request, the fingers in parallel. So the number of
+        requests grows with the number of owners, not identities.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            identities: A list of identities in hex.
+
+        Returns:
+            A dict from identity to the identity of its successor.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        me = int(self._id, 16)
+        size = ct.TWO_EXP[ct.RING_SIZE_BIT]
+        ids = sorted(set(identities), key=lambda x: (int(x, 16) - me - 1) % size)
+        succ = self.get_successor()
+        result = {}
+        hops = collections.OrderedDict()
+        for identity in ids:
+            if int(identity, 16) == me or self._is_owner(identity):
+                result[identity] = self._id
+            elif self._in_range_ei(identity, self._id, succ) or \
+                    int(identity, 16) == int(succ, 16):
+                result[identity] = succ
+            else:
+                cpf = self.closest_preceding_finger(identity)
+                if cpf == self._id:     # mine: no closer node, as find_predecessor
+                    result[identity] = succ
+                else:
+                    hops.setdefault(cpf, []).append(identity)
+        self._log.hot('finding successors of {ids} ids, forwarding to {nodes} nodes',
+                ids=len(ids), nodes=len(hops))
+        if len(hops) == 1:      # no need for another thread
+            for node, sub in hops.items():
+                result.update(self.remote_find_successor_batch(node, sub))
+        else:
+            futures = [self._executor.submit(self.remote_find_successor_batch, node, sub)
+                    for node, sub in hops.items()]
+            for f in futures:
+                result.update(f.result())
+        return result
+
     def find_predecessor(self, identity):
         '''
         Ask this node to find the predecessor of identity.
@@ -78,26 +182,39 @@ class Node(object):
         Raises:
             N/A
         '''
-        logger.debug('({}) finding predecessor of {}'
-                        .format(self._id, identity))
+        return self._find_predecessor(identity)[0]
+
+    def _find_predecessor(self, identity, trace=None):
+        '''
+        Find the predecessor of identity, and return it with the trace
+        of the next hop, see find_predecessor().
+        '''
+        self._log.hot('finding predecessor of {identity}', identity=identity)
         node = self._id
         succ = self._table.get_node(1)
+        hops = 0
         while not self._in_range_ei(identity, node, succ):
-            cpt = self.remote_closest_preceding_finger(node, identity)
+            cpt = self.remote_closest_preceding_finger(node, identity, trace)
+            trace = self._next_hop(trace)
+            hops += 1
             if cpt == node:     # mine: fix infinite loop issue
                 break
             node = cpt
-            succ = self.remote_get_successor(node)
-        logger.debug('({}) found predecessor of {} -> {}'
-                        .format(self._id, identity, node))
-        return node
+            succ = self.remote_get_successor(node, trace)
+            trace = self._next_hop(trace)
+        metrics.LOOKUP_HOPS.observe(hops)
+        self._log.hot('found predecessor of {identity} -> {node}',
+                identity=identity, node=node)
+        return (node, trace)
 
-    def closest_preceding_finger(self, identity):
+    def closest_preceding_finger(self, identity, trace=None):
         '''
         Return the closest finger preceding id
 
         Args:
             identity:   The identity of the object.
+            trace:      A tuple (trace id, hop index) to record the span
+                        with. None for no tracing.
 
         Returns:
             The identity of the closest finger preceding id.
@@ -105,15 +222,17 @@ class Node(object):
         Raises:
             N/A
         '''
-        logger.debug('({}) finding CPT of {}'.format(self._id, identity))
+        if trace is not None:
+            return self._traces.record(trace[0], trace[1], self._id, None,
+                    'closest_preceding_finger', identity, self.closest_preceding_finger, identity)
+        self._log.hot('finding CPT of {identity}', identity=identity)
         for i in range(ct.RING_SIZE_BIT, 0, -1):
             fnode = self._table.get_node(i)
             if self._in_range_ee(fnode, self._id, identity):
-                logger.debug('({}) finding CPT of {} -> {}'
-                        .format(self._id, identity, fnode))
+                self._log.hot('finding CPT of {identity} -> {fnode}',
+                        identity=identity, fnode=fnode)
                 return fnode
-        logger.debug('({}) finding CPT of {} -> failed, returning itself'
-                .format(self._id, identity))
+        self._log.hot('finding CPT of {identity} -> failed, returning itself', identity=identity)
         return self._id
 
     def join(self, remote_node=None):
@@ -132,8 +251,7 @@ class Node(object):
         '''
         succ = self._id
         if remote_node:        # join a ring via node
-            logger.debug('({}) join a ring via {}'
-                    .format(self._id, remote_node))
+            self._log.debug('join a ring via {remote_node}', remote_node=remote_node)
             self._predecessor = None
             succ = self.remote_find_successor(remote_node, self._id)
             self.set_successor(succ)
@@ -149,7 +267,7 @@ class Node(object):
                 self._backup_succ.append(temp_succ)
             # end of mine
         else:       # mine: the first one in the ring
-            logger.debug('({}) create a new ring'.format(self._id))
+            self._log.debug('create a new ring')
             self._predecessor = None        # be consistent
             for i in range(1, ct.RING_SIZE_BIT+1):
                 self._table.set_node(i, self._id)
@@ -158,6 +276,185 @@ class Node(object):
                 self._backup_succ.append(self._id)
             # end of mine
 
+    def leave(self):
+        '''
+        Leave the ring voluntarily.
+        Hand off all keys to the successor in bulk, then ask the successor
+        and predecessor to splice this node out. It only returns after the
+        handoff is done, so the data is never unreachable.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        self._log.debug('leaving the ring')
+        succ = self.get_successor()
+        if succ == self._id:      # the only node in the ring
+            self._log.debug('leaving the ring -> the only node, nothing to hand off')
+            self._left = True
+            return
+        # hand off keys
+        items = self._with_expiry(self._data.items())
+        self.remote_local_put_batch(succ, items)
+        self._log.debug('leaving the ring -> handed {keys} keys to {succ}',
+                keys=len(items), succ=succ)
+        # splice out
+        pred = self._predecessor
+        self.remote_splice_out(succ, self._id, pred, succ)
+        if pred and pred != succ:
+            self.remote_splice_out(pred, self._id, pred, succ)
+        self._data.clear()
+        self._data.close()
+        self._left = True
+        self._log.debug('leaving the ring -> Done')
+
+    def splice_out(self, identity, pred, succ):
+        '''
+        A neighbor is leaving, replace it by its predecessor and successor.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            identity:   The identity of the leaving node.
+            pred:       The predecessor of the leaving node.
+            succ:       The successor of the leaving node.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._log.debug('splicing out {identity}, its predecessor {pred} successor {succ}',
+                identity=identity, pred=pred, succ=succ)
+        if self._predecessor == identity:
+            # the leaving node may be the only other one
+            self._predecessor = None if pred == self._id else pred
+        for i in range(1, ct.RING_SIZE_BIT + 1):
+            if self._table.get_node(i) == identity:
+                self._table.set_node(i, succ)
+        for i in range(0, len(self._backup_succ)):
+            if self._backup_succ[i] == identity:
+                self._backup_succ[i] = succ
+        self._log.debug('splicing out {identity} -> Done', identity=identity)
+
+    def has_left(self):
+        '''
+        Check whether this node has left the ring.
+
+        Args:
+            N/A
+
+        Returns:
+            True if left. False otherwise.
+
+        Raises:
+            N/A
+        '''
+        return self._left
+
+    def expire(self, now=None):
+        '''
+        Delete the keys whose TTL has passed, found by the timer wheel.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            now:    The current time. If None, use time.time().
+
+        Returns:
+            The number of keys deleted.
+
+        Raises:
+            N/A
+        '''
+        expired = self._ttl.advance(now)
+        for key, _ in expired:
+            self._data.delete(key)
+        if expired:
+            self._log.debug('expired {keys} keys', keys=len(expired))
+        return len(expired)
+
+    def compact(self):
+        '''
+        Reclaim the space of overwritten and deleted values in the store.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            OSError
+        '''
+        self._data.compact()
+
+    def migrate(self, timeout=0):
+        '''
+        Move the keys queued by notify() and the successor list changes
+        to their new owners and replicas.
+        This runs on a thread of its own, as the transfer is throttled.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            timeout:    The max seconds to wait for a task if none is queued.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        if self._migrator.wait(timeout):
+            self._migrator.run()
+
+    def drop_stale(self):
+        '''
+        Delete the local keys which this node is no longer a replica of.
+        The keys copied to a new predecessor by notify() stay here as its
+        first replica, and they fall out of the replica set once more nodes
+        join in between. This node keeps the keys of itself and its
+        BACKUP_SUCC_NUM predecessors, so the keys outside
+        (the (BACKUP_SUCC_NUM+1)-th predecessor, self] are deleted.
+        Nothing is deleted unless every predecessor on the way is alive and
+        comes strictly before the last one, so an unstable ring keeps the keys.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            N/A
+
+        Returns:
+            The number of keys deleted.
+
+        Raises:
+            N/A
+        '''
+        if self._predecessor is None:
+            return 0
+        node = self._predecessor
+        try:
+            for i in range(0, ct.BACKUP_SUCC_NUM):
+                pred = self.remote_get_predecessor(node)
+                if not self._in_range_ee(pred, self._id, node):
+                    return 0        # too few nodes or not stable yet
+                node = pred
+        except (requests.ConnectionError, AssertionError):
+            return 0
+        for _, key, _ in self._data.range_versions(self._id, node):
+            self._ttl.remove(key)
+        count = self._data.delete_range(self._id, node)
+        if count:
+            self._log.debug('dropped {count} stale keys in ({start}, {end}]',
+                    count=count, start=self._id, end=node)
+        return count
+
     def stabilize(self):
         '''
         Periodically verify n’s immediate successor, and tell the successor about n
@@ -174,22 +471,19 @@ class Node(object):
         Raises:
             N/A
         '''
-        logger.debug('({}) stabilizing'.format(self._id))
+        self._log.debug('stabilizing')
         # # mine: check predecessor liveness
         if self._predecessor:
             try:
-                logger.debug('({}) checking predecessor livenetss'.format(self._id))
+                self._log.debug('checking predecessor livenetss')
                 self.remote_get_successor(self._predecessor)
-                logger.debug('({}) checking predecessor livenetss -> alive'\
-                        .format(self._id))
+                self._log.debug('checking predecessor livenetss -> alive')
             except requests.ConnectionError:
-                logger.debug('({}) checking predecessor livenetss -> dead'\
-                        .format(self._id))
+                self._log.debug('checking predecessor livenetss -> dead')
                 backup = self._get_alive_backup_succ()
                 self._predecessor = backup
-                logger.debug('({}) checking predecessor livenetss -> '\
-                        'set predecessor as backup {}'\
-                        .format(self._id, backup))
+                self._log.debug('checking predecessor livenetss -> set predecessor as backup {backup}',
+                        backup=backup)
         # end of mine
         flag = False
         while not flag:     # mine: try all backup successors
@@ -199,9 +493,8 @@ class Node(object):
                 flag = True
             except requests.ConnectionError:    # mine: add fault recovery
                 self._remove_dead(succ)
-                logger.debug('({}) successor {} is dead,'\
-                        'use backup {} instead'.format(
-                            self._id, succ, self.get_successor()))
+                self._log.debug('successor {succ} is dead, use backup {backup} instead',
+                        succ=succ, backup=self.get_successor())
         # mine: check successor's predecessor's liveness
         try:
             # for the init node, the predecessor is None
@@ -221,8 +514,12 @@ class Node(object):
             pass        # no need to do anything for a dead node
         # mine: update the backup successors
         self._update_backup_succ()
+        # mine: copy keys to new replicas in the successor list
+        self._check_replicas()
+        # mine: replay hinted writes to replicas alive again
+        self._replay_hints()
         # end of mine
-        logger.debug('({}) stabilizing -> Done'.format(self._id))
+        self._log.debug('stabilizing -> Done')
 
     def notify(self, remote_node):
         '''
@@ -238,23 +535,30 @@ class Node(object):
         Raises:
             N/A
         '''
-        logger.debug('({}) notified by {}'
-                .format(self._id, remote_node))
+        self._log.debug('notified by {remote_node}', remote_node=remote_node)
         if self._predecessor == None or \
                 self._in_range_ee(
                 remote_node, 
                 self._predecessor, 
                 self._id):
-            logger.debug('({0}) notified by {1} -> In range ({2},{0})'
-                    .format(self._id, remote_node, self._predecessor))
+            self._log.debug('notified by {remote_node} -> In range ({pred},{node})',
+                    remote_node=remote_node, pred=self._predecessor, node=self._id)
+            # mine: keys in (old predecessor, remote_node] now belong to remote_node.
+            # They are copied, not moved, as this node becomes their first replica.
+            # If there is no predecessor, this node owned every key.
+            old_pred = self._predecessor if self._predecessor else self._id
+            if remote_node != self._id:
+                self._migrator.add_task(remote_node, old_pred, remote_node,
+                        mg.MIGRATION)
+            # end of mine
             self._predecessor = remote_node
-            logger.debug('({0}) notified by {1} -> Done and changed predecesor to {1}'
-                    .format(self._id, remote_node))
+            self._log.debug('notified by {remote_node} -> Done and changed predecesor to {remote_node}',
+                    remote_node=remote_node)
         else:
-            logger.debug('({0}) notified by {1} -> Not in range ({2},{0})'
-                    .format(self._id, remote_node, self._predecessor))
-            logger.debug('({}) notified by {} -> Done but not changed'
-                    .format(self._id, remote_node))
+            self._log.debug('notified by {remote_node} -> Not in range ({pred},{node})',
+                    remote_node=remote_node, pred=self._predecessor, node=self._id)
+            self._log.debug('notified by {remote_node} -> Done but not changed',
+                    remote_node=remote_node)
 
     def fix_fingers(self, loop=False):
         '''
@@ -272,38 +576,117 @@ class Node(object):
         Raises:
             N/A
         '''
-        logger.debug('({}) fixing finger table'.format(self._id))
+        self._log.debug('fixing finger table')
         if loop:
             for i in range(1, ct.RING_SIZE_BIT+1):
                 try:
                     succ = self.find_successor(self._table.get_start(i))
                     self.remote_get_successor(succ)     # check liveness
                     self._table.set_node(i, succ)
-                    logger.debug('({}) set finger index {} with node {}'
-                            .format(self._id, i, succ))
+                    self._log.debug('set finger index {i} with node {succ}', i=i, succ=succ)
                 except requests.ConnectionError:
                     # mine: replace with backup
                     backup = self._get_alive_backup_succ()
                     self._table.set_node(i, backup)
-                    logger.debug('({}) set finger index {} \
-                            -> connection error, use backup {}'
-                            .format(self._id, i, succ, backup))
+                    self._log.debug('set finger index {i} -> connection error, use backup {backup}',
+                            i=i, backup=backup)
         else:
             i = random.randint(1, ct.RING_SIZE_BIT)
             try:
                 succ = self.find_successor(self._table.get_start(i))
                 self.remote_get_successor(succ)     # check liveness
                 self._table.set_node(i, succ)
-                logger.debug('({}) set finger index {} with node {}'
-                        .format(self._id, i, succ))
+                self._log.debug('set finger index {i} with node {succ}', i=i, succ=succ)
             except requests.ConnectionError:
                 # mine: replace with backup
                 backup = self._get_alive_backup_succ()
                 self._table.set_node(i, backup)
-                logger.debug('({}) set finger index {} \
-                        -> connection error, use backup {}'
-                        .format(self._id, i, succ, backup))
-        logger.debug('({}) fixing finger table -> Done'.format(self._id))
+                self._log.debug('set finger index {i} -> connection error, use backup {backup}',
+                        i=i, backup=backup)
+        self._log.debug('fixing finger table -> Done')
+
+    def anti_entropy(self):
+        '''
+        Periodically reconcile the keys this node owns, i.e. in
+        (predecessor, self], with the replicas on its successors.
+        The merkle trees are compared from the root, and only the leaves
+        with different hashes are exchanged, so the traffic depends on
+        the number of different keys rather than the size of the store.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            N/A
+
+        Returns:
+            The number of keys exchanged.
+
+        Raises:
+            N/A
+        '''
+        if self._predecessor is None:
+            return 0
+        start, end = self._predecessor, self._id
+        count = 0
+        for node in self._replicas():
+            try:
+                tree = self.merkle_tree(start, end)
+                diff = [0]
+                for level in range(0, tree.depth() + 1):
+                    hashes = self.remote_merkle(node, start, end, level, diff)
+                    diff = [i for i, h in zip(diff, hashes)
+                            if h != tree.get(level, i)]
+                    if level < tree.depth():      # go down to the children
+                        diff = [c for i in diff for c in (2*i, 2*i + 1)]
+                for i in diff:
+                    leaf_start, leaf_end = tree.leaf_range(i)
+                    count += self._sync_range(node, leaf_start, leaf_end)
+            except (requests.ConnectionError, AssertionError):
+                logger.info('({}) anti-entropy with {} failed'
+                        .format(self._id, node))
+        self._log.debug('anti-entropy -> {count} keys exchanged', count=count)
+        return count
+
+    def merkle_tree(self, start, end):
+        '''
+        Build the merkle tree of the local keys in (start, end].
+        The last tree is cached until the data changes.
+
+        Args:
+            start:  The range start, excluded.
+            end:    The range end, included.
+
+        Returns:
+            A MerkleTree.
+
+        Raises:
+            N/A
+        '''
+        cache = self._merkle
+        changes = self._data.changes()
+        if cache and cache[:3] == (start, end, changes):
+            return cache[3]
+        tree = merkle.MerkleTree(start, end, self._data.range_versions(start, end))
+        self._merkle = (start, end, changes, tree)
+        return tree
+
+    def merkle_hashes(self, start, end, level, indices):
+        '''
+        Return the hashes of the merkle tree nodes on the level.
+
+        Args:
+            start:      The range start, excluded.
+            end:        The range end, included.
+            level:      The level of the tree, 0 is the root.
+            indices:    The indices of the nodes on the level.
+
+        Returns:
+            A list of hashes in hex.
+
+        Raises:
+            N/A
+        '''
+        tree = self.merkle_tree(start, end)
+        return [tree.get(level, i) for i in indices]
 
     def get_predecessor(self):
         '''
@@ -335,12 +718,13 @@ class Node(object):
         '''
         self._predecessor = identity
 
-    def get_successor(self):
+    def get_successor(self, trace=None):
         '''
         Get the successor of this current node.
 
         Args:
-            N/A
+            trace:  A tuple (trace id, hop index) to record the span
+                    with. None for no tracing.
 
         Returns:
             The id of the sucsessor.
@@ -348,6 +732,9 @@ class Node(object):
         Raises:
             N/A
         '''
+        if trace is not None:
+            return self._traces.record(trace[0], trace[1], self._id, None,
+                    'get_successor', None, self.get_successor)
         return self._table.get_node(1)
 
     def set_successor(self, identity):
@@ -382,376 +769,1098 @@ class Node(object):
             result.append(self._table.get_node(i))
         return result
 
-    def local_put(self, key, value):
+    def put(self, key, value, w=None, forwarded=False, expire_at=None):
         '''
         Put the key-value into the ring.
-        Only put the key-value on the local node.
-        It is the application layer to decide which node to put.
+        The request is routed to the owner of the key, which gives the value
+        a new version, stores it and writes it to its successors in parallel.
+        It returns once w replicas (including the owner) have confirmed.
+        An unreachable replica is not retried, the write is kept as a hint
+        and replayed when the replica is alive again. A hinted write is not
+        counted as confirmed, so fewer than w acks tell the caller the
+        write quorum was not met.
 
         Args:
             key:    The key of the key-value pair.
             value:  The value of key-value pair.
+            w:      The number of replicas to confirm the write.
+                    If None, use WRITE_QUORUM.
+            forwarded:  If True, this node is the owner, do not route again.
+            expire_at:  The time in seconds since the epoch when the key
+                        expires on all the replicas. None for no expiry.
 
         Returns:
-            N/A
+            The number of replicas which confirmed the write.
 
         Raises:
-            N/A
+            requests.ConnectionError
+            AssertionError
         '''
-        logger.debug('({}) put key {} value {}'\
-                        .format(self._id, key, value))
-        self._data[key] = value
-        logger.debug('({}) put key {} value {} -> Done'\
-                        .format(self._id, key, value))
+        if not forwarded and not self._is_owner(helper._hash(key)):
+            owner = self.find_successor(helper._hash(key))
+            if owner != self._id:
+                return self.remote_put(owner, key, value, w, True, expire_at)
+        if w is None:
+            w = ct.WRITE_QUORUM
+        self._log.hot('coordinate put key {key} with w={w}', key=key, w=w)
+        version = self._new_version()
+        self.local_put(key, value, version, expire_at)
+        acks = 1
+        replicas = self._replicas()
+        w = min(w, len(replicas) + 1)
+        futures = [self._executor.submit(
+                    self._replica_put, node, key, value, version, expire_at)
+                for node in replicas]
+        # the rest keeps going in background once w replicas confirmed
+        pending = futures if acks < w else []
+        for f in concurrent.futures.as_completed(pending):
+            if f.exception() is None and f.result():        # not hinted
+                acks += 1
+            elif f.exception() is not None:
+                logger.info('({}) replica put of key {} failed: {}'\
+                        .format(self._id, key, f.exception()))
+            if acks >= w:
+                break
+        self._log.hot('coordinate put key {key} -> {acks} acks', key=key, acks=acks)
+        return acks
 
-    def local_get(self, key):
+    def get(self, key, r=None, forwarded=False):
         '''
         Get the value for key from the ring.
-        It will only check the local node data. It is
-        the application layer to decide which node to call get.
+        The request is routed to the owner of the key, which reads the key
+        from itself and its successors in parallel. It returns the newest
+        value among the first r replies, and repairs the replicas with
+        older versions in background once all of them replied.
 
         Args:
             key:    The key of the key-value pair.
+            r:      The number of replicas to read.
+                    If None, use READ_QUORUM.
+            forwarded:  If True, this node is the owner, do not route again.
 
         Returns:
             The value of the key-value pair.
             If there isn't, return None.
 
         Raises:
-            N/A
+            requests.ConnectionError
+            AssertionError
         '''
-        logger.debug('({}) get key {}'\
-                        .format(self._id, key))
-        value = self._data.get(key, None)
-        logger.debug('({}) get key {} -> {}'\
-                        .format(self._id, key, value))
+        if not forwarded and not self._is_owner(helper._hash(key)):
+            owner = self.find_successor(helper._hash(key))
+            if owner != self._id:
+                return self.remote_get(owner, key, r, True)
+        if r is None:
+            r = ct.READ_QUORUM
+        self._log.hot('coordinate get key {key} with r={r}', key=key, r=r)
+        nodes = [self._id] + self._replicas()
+        r = min(r, len(nodes))
+        futures = {}
+        for node in nodes:
+            f = self._executor.submit(self.remote_local_get_version, node, key)
+            futures[f] = node
+        self._read_repair(key, futures)
+        value, version, count = None, 0, 0
+        for f in concurrent.futures.as_completed(futures):
+            if f.exception() is None:
+                count += 1
+                if f.result()[1] > version:
+                    value, version = f.result()[:2]
+            if count >= r:
+                break
+        self._log.hot('coordinate get key {key} -> found {found} from {count} replicas',
+                key=key, found=value is not None, count=count)
         return value
 
-    def display_data(self):
+    def mput(self, items, w=None, forwarded=False):
         '''
-        Return the key-value data.
+        Put many key-value pairs into the ring.
+        The keys are grouped by their owners, found with one lookup per
+        owner, and each group is sent to its owner in one request, all the
+        owners in parallel. The owner stores the group, and writes it to
+        each replica in one request. This function is not mentioned in the
+        chord ring paper.
 
         Args:
-            N/A
+            items:  A list of [key, value, expire_at]. The expire_at
+                    is optional, None for no expiry.
+            w:      The number of replicas to confirm the writes.
+                    If None, use WRITE_QUORUM.
+            forwarded:  If True, this node owns all the keys, do not route again.
 
         Returns:
-            A dict representing key-value pairs.
+            A dict from key to the number of replicas which confirmed it.
+            It is 0 if the owner could not be reached.
 
         Raises:
             N/A
         '''
-        return self._data
+        if not forwarded:
+            groups = self._group_by_owner([item[0] for item in items])
+            by_key = { item[0]: item for item in items }
+            return self._fan_out(groups, 0, lambda owner, keys:
+                    self.remote_mput(owner, [by_key[key] for key in keys], w, True))
+        if w is None:
+            w = ct.WRITE_QUORUM
+        self._log.hot('coordinate put of {keys} keys with w={w}', keys=len(items), w=w)
+        batch = []
+        for item in items:
+            expire_at = item[2] if len(item) > 2 else None
+            batch.append([item[0], item[1], self._new_version(), expire_at])
+            self._put_item(batch[-1])
+        acks = 1
+        replicas = self._replicas()
+        w = min(w, len(replicas) + 1)
+        futures = [self._executor.submit(self._replica_put_batch, node, batch)
+                for node in replicas]
+        # the rest keeps going in background once w replicas confirmed
+        pending = futures if acks < w else []
+        for f in concurrent.futures.as_completed(pending):
+            if f.exception() is None and f.result():        # not hinted
+                acks += 1
+            if acks >= w:
+                break
+        return { item[0]: acks for item in items }
 
-    def display_backup_succ(self):
+    def mget(self, keys, r=None, forwarded=False):
         '''
-        Return the backup successors.
+        Get the values for many keys from the ring.
+        The keys are grouped by their owners as mput(), and each owner
+        reads its group from itself and its replicas, one request each.
+        This function is not mentioned in the chord ring paper.
 
         Args:
-            N/A
+            keys:   A list of keys.
+            r:      The number of replicas to read.
+                    If None, use READ_QUORUM.
+            forwarded:  If True, this node owns all the keys, do not route again.
 
         Returns:
-            An array of backup successors.
+            A dict from key to its value. The value is None if there is no
+            such key or the owner could not be reached.
 
         Raises:
             N/A
         '''
-        return self._backup_succ
-    #-------------------------------------- end of local part --------------------------------------
+        if not forwarded:
+            groups = self._group_by_owner(keys)
+            return self._fan_out(groups, None, lambda owner, keys:
+                    self.remote_mget(owner, keys, r, True))
+        if r is None:
+            r = ct.READ_QUORUM
+        self._log.hot('coordinate get of {keys} keys with r={r}', keys=len(keys), r=r)
+        nodes = [self._id] + self._replicas()
+        r = min(r, len(nodes))
+        futures = {}
+        for node in nodes:
+            f = self._executor.submit(self.remote_local_mget, node, keys)
+            futures[f] = node
+        self._read_repair_batch(keys, futures)
+        newest = [(None, 0)] * len(keys)
+        count = 0
+        for f in concurrent.futures.as_completed(futures):
+            if f.exception() is None:
+                count += 1
+                for i, res in enumerate(f.result()):
+                    if res[1] > newest[i][1]:
+                        newest[i] = (res[0], res[1])
+            if count >= r:
+                break
+        return { key: newest[i][0] for i, key in enumerate(keys) }
 
-    #-------------------------------------- start of remote part --------------------------------------
-    def remote_find_predecessor(self, remote_node, identity):
+    def local_put(self, key, value, version=None, expire_at=None):
         '''
-        Find the predecessor of the identity on remote node.
+        Put the key-value into the ring.
+        Only put the key-value on the local node.
+        It is the application layer to decide which node to put.
 
         Args:
-            remote_node:    The remote node id.
-            identity:       The identity to look up.
+            key:    The key of the key-value pair.
+            value:  The value of key-value pair.
+            version:    The version of the value. It is ignored if the
+                        local one is newer. If None, use a new version.
+            expire_at:  The time in seconds since the epoch when the key
+                        expires. None for no expiry.
 
         Returns:
-            The id of the predecessor.
+            N/A
 
         Raises:
-            requests.ConnectionError
-            AssertionError
-            KeyError
+            N/A
         '''
-        logger.debug('({}) ask {} to find predecessor of {}'\
-                .format(self._id, remote_node, identity))
-        if remote_node == self._id:     # if self, call self
-            return self.find_predecessor(identity)
-        url = 'http://{}:8000/find_predecessor'\
-                .format(helper._gen_net_id(remote_node))
-        payload = { 'id': identity }
-        r = self._requests_post(url, payload)
-        assert(r.status_code==200)
-        pred = r.json()['id']
-        logger.debug('({}) ask {} to find predecessor of {} -> {}'\
-                .format(self._id, remote_node, identity, pred))
-        return pred
+        self._log.hot('put key {key}', key=key)
+        self._put_item([key, value, version, expire_at])
+        self._log.hot('put key {key} -> Done', key=key)
 
-    def remote_get_predecessor(self, remote_node):
+    def local_get(self, key):
         '''
-        Get the predecessor of the remote node.
+        Get the value for key from the ring.
+        It will only check the local node data. It is
+        the application layer to decide which node to call get.
 
         Args:
-            remote_node:    The remote node id.
+            key:    The key of the key-value pair.
 
         Returns:
-            The id of the predecessor.
+            The value of the key-value pair.
+            If there isn't, return None.
 
         Raises:
-            requests.ConnectionError
-            AssertionError
-            KeyError
+            N/A
         '''
-        logger.debug('({}) ask {} for its own predecessor'
-                        .format(self._id, remote_node))
-        if remote_node == self._id:     # if self, call self
-            pred =  self.get_predecessor()
-        else:
-            url = 'http://{}:8000/get_predecessor'\
-                    .format(helper._gen_net_id(remote_node))
-            payload = {}
-            r = self._requests_post(url, payload)
-            pred = r.json()['id']
-            assert(r.status_code==200)
-        logger.debug('({}) ask {} for its own predecessor -> {}'
-                        .format(self._id, remote_node, pred))
-        return pred
+        self._log.hot('get key {key}', key=key)
+        self._check_expiry(key)
+        value = self._data.get(key)
+        self._log.hot('get key {key} -> found {found}', key=key, found=value is not None)
+        return value
 
-    def remote_set_predecessor(self, remote_node, identity):
+    def local_get_version(self, key):
         '''
-        Set the predecessor of the remote_node.
+        Get the value, its version and expiry time for key from the local node.
 
         Args:
-            remote_node:    The remote node id.
-            identity:       The new predecessor identity.
+            key:    The key of the key-value pair.
 
         Returns:
-            N/A
+            A tuple (value, version, expire_at).
+            If there isn't, return (None, 0, None).
 
         Raises:
-            requests.ConnectionError
-            AssertionError
+            N/A
         '''
-        logger.debug('({}) ask {} to set its predecessor as {}'
-                        .format(self._id, remote_node, identity))
-        if remote_node == self._id:     # if self, call self
-            self.set_predecessor(identity)
-        else:
-            url = 'http://{}:8000/set_predecessor'\
-                    .format(helper._gen_net_id(emote_node))
-            payload = { 'id': identity }
-            r = self._requests_post(url, payload)
-            assert(r.status_code==200)
-        logger.debug('({}) ask {} to set its predecessor as {} is done'
-                        .format(self._id, remote_node, identity))
-        return
-    
-    def remote_get_successor(self, remote_node):
+        self._check_expiry(key)
+        value, version = self._data.get_version(key)
+        return (value, version, self._ttl.get(key))
+
+    def local_get_raw(self, key):
         '''
-        Get the successor of the remote node.
+        Get the value for key from the local node as bytes.
+        A large value in the log store is a memoryview of the mapped
+        segment, so it can be sent without being copied.
 
         Args:
-            remote_node:    The remote node id.
+            key:    The key of the key-value pair.
 
         Returns:
-            The id of the successor.
+            A tuple (data, is_json, version).
+            If there isn't, return (None, False, 0).
 
         Raises:
-            requests.ConnectionError
-            AssertionError
-            KeyError
+            OSError
         '''
-        logger.debug('({}) ask {} for its own successor'
-                        .format(self._id, remote_node))
-        if remote_node == self._id:     # if self, call self
-            succ = self.get_successor()
-        else:
-            url = 'http://{}:8000/get_successor'\
-                    .format(helper._gen_net_id(remote_node))
-            payload = {}
-            r = self._requests_post(url, payload)
-            assert(r.status_code==200)
-            succ = r.json()['id']
-        logger.debug('({}) ask {} for its own successor -> {}'
-                        .format(self._id, remote_node, succ))
-        return succ
+        self._check_expiry(key)
+        return self._data.get_raw(key)
 
-    def remote_set_successor(self, remote_node, identity):
+    def local_mget(self, keys):
         '''
-        Set the successor of the remote_node.
+        Get the values, versions and expiry times of many keys
+        from the local node.
 
         Args:
-            remote_node:    The remote node id.
-            identity:       The new successor identity.
+            keys:   A list of keys.
 
         Returns:
-            N/A
+            A list of [value, version, expire_at], in the order of the keys.
+
+        Raises:
+            N/A
+        '''
+        return [list(self.local_get_version(key)) for key in keys]
+
+    def local_put_batch(self, items):
+        '''
+        Put many key-value pairs on the local node at once.
+        It is used for handing off keys between nodes.
+
+        Args:
+            items:  A list of [key, value, version, expire_at].
+                    If the version is missing, use a new version.
+                    If the expire_at is missing, the key does not expire.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._log.hot('put {keys} keys in batch', keys=len(items))
+        for item in items:
+            self._put_item(item)
+
+    def display_data(self):
+        '''
+        Return the key-value data.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict representing key-value pairs.
+
+        Raises:
+            N/A
+        '''
+        return self._data.to_dict()
+
+    def range_scan(self, start, end, cursor=None, limit=100):
+        '''
+        Scan the local key-value pairs whose key identity is in (start, end].
+
+        Args:
+            start:  The range start, excluded.
+            end:    The range end, included.
+            cursor: The cursor returned by the last scan.
+                    If None, scan from the start.
+            limit:  The max number of pairs returned, at least 1.
+
+        Returns:
+            A tuple (items, cursor). The items is a list of
+            [key, value, version, expire_at].
+            The cursor is used for the next scan, None if the scan is done.
+
+        Raises:
+            ValueError if the limit is less than 1.
+        '''
+        items, cursor = self._data.scan(start, end, cursor, limit)
+        return (self._with_expiry(items), cursor)
+
+    def display_memory(self):
+        '''
+        Return the memory used by the key-value store of this node.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the number of keys and the bytes used.
+            See memory_usage() of the store.
+
+        Raises:
+            N/A
+        '''
+        return self._data.memory_usage()
+
+    def display_migration(self):
+        '''
+        Return the statistics of key migration and re-replication.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the keys/bytes moved, the number of tasks
+            and the progress of the running task.
+
+        Raises:
+            N/A
+        '''
+        return self._migrator.stats()
+
+    def display_hints(self):
+        '''
+        Return the statistics of hinted handoff.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the number of pending, added, replayed and dropped hints.
+
+        Raises:
+            N/A
+        '''
+        return self._hints.stats()
+
+    def display_backup_succ(self):
+        '''
+        Return the backup successors.
+
+        Args:
+            N/A
+
+        Returns:
+            An array of backup successors.
+
+        Raises:
+            N/A
+        '''
+        return self._backup_succ
+
+    def node_info(self):
+        '''
+        Return the routing state and the key count of this node,
+        collected from every node by the ring crawl.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the id, predecessor, successor, fingers
+            (the nodes of finger 1 to m), backup successors and the
+            number of keys stored.
+
+        Raises:
+            N/A
+        '''
+        return {
+                'id': self._id,
+                'predecessor': self.get_predecessor(),
+                'successor': self.get_successor(),
+                'fingers': [self._table.get_node(i) for i in range(1, ct.RING_SIZE_BIT+1)],
+                'backup_succ': list(self._backup_succ),
+                'keys': self._data.memory_usage()['keys']
+                }
+
+    def get_trace(self, trace_id):
+        '''
+        Return the spans of a traced lookup recorded by this node.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            trace_id:   The trace id.
+
+        Returns:
+            A list of spans, see trace.TraceBuffer.
+
+        Raises:
+            N/A
+        '''
+        return self._traces.get(trace_id)
+    #-------------------------------------- end of local part --------------------------------------
+
+    #-------------------------------------- start of remote part --------------------------------------
+    def remote_find_predecessor(self, remote_node, identity):
+        '''
+        Find the predecessor of the identity on remote node.
+
+        Args:
+            remote_node:    The remote node id.
+            identity:       The identity to look up.
+
+        Returns:
+            The id of the predecessor.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+            KeyError
+        '''
+        self._log.hot('ask {remote_node} to find predecessor of {identity}',
+                remote_node=remote_node, identity=identity)
+        if remote_node == self._id:     # if self, call self
+            return self.find_predecessor(identity)
+        url = 'http://{}/find_predecessor'\
+                .format(helper._gen_address(remote_node))
+        payload = { 'id': identity }
+        r = self._requests_post(url, payload)
+        assert(r.status_code==200)
+        pred = r.json()['id']
+        self._log.hot('ask {remote_node} to find predecessor of {identity} -> {pred}',
+                remote_node=remote_node, identity=identity, pred=pred)
+        return pred
+
+    def remote_get_predecessor(self, remote_node):
+        '''
+        Get the predecessor of the remote node.
+
+        Args:
+            remote_node:    The remote node id.
+
+        Returns:
+            The id of the predecessor.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+            KeyError
+        '''
+        self._log.hot('ask {remote_node} for its own predecessor', remote_node=remote_node)
+        if remote_node == self._id:     # if self, call self
+            pred =  self.get_predecessor()
+        else:
+            url = 'http://{}/get_predecessor'\
+                    .format(helper._gen_address(remote_node))
+            payload = {}
+            r = self._requests_post(url, payload)
+            pred = r.json()['id']
+            assert(r.status_code==200)
+        self._log.hot('ask {remote_node} for its own predecessor -> {pred}',
+                remote_node=remote_node, pred=pred)
+        return pred
+
+    def remote_set_predecessor(self, remote_node, identity):
+        '''
+        Set the predecessor of the remote_node.
+
+        Args:
+            remote_node:    The remote node id.
+            identity:       The new predecessor identity.
+
+        Returns:
+            N/A
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        self._log.debug('ask {remote_node} to set its predecessor as {identity}',
+                remote_node=remote_node, identity=identity)
+        if remote_node == self._id:     # if self, call self
+            self.set_predecessor(identity)
+        else:
+            url = 'http://{}/set_predecessor'\
+                    .format(helper._gen_address(remote_node))
+            payload = { 'id': identity }
+            r = self._requests_post(url, payload)
+            assert(r.status_code==200)
+        self._log.debug('ask {remote_node} to set its predecessor as {identity} is done',
+                remote_node=remote_node, identity=identity)
+        return
+    
+    def remote_get_successor(self, remote_node, trace=None):
+        '''
+        Get the successor of the remote node.
+
+        Args:
+            remote_node:    The remote node id.
+            trace:          A tuple (trace id, hop index) to record the span
+                            with and pass on. None for no tracing.
+
+        Returns:
+            The id of the successor.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+            KeyError
+        '''
+        if trace is not None:
+            return self._traces.record(trace[0], trace[1], self._id, remote_node,
+                    'get_successor', None, self._remote_get_successor, remote_node, trace)
+        return self._remote_get_successor(remote_node)
+
+    def _remote_get_successor(self, remote_node, trace=None):
+        '''
+        Get the successor of the remote node, see remote_get_successor().
+        '''
+        self._log.hot('ask {remote_node} for its own successor', remote_node=remote_node)
+        if remote_node == self._id:     # if self, call self
+            succ = self.get_successor()
+        else:
+            url = 'http://{}/get_successor'\
+                    .format(helper._gen_address(remote_node))
+            payload = self._trace_payload({}, trace)
+            r = self._requests_post(url, payload)
+            assert(r.status_code==200)
+            succ = r.json()['id']
+        self._log.hot('ask {remote_node} for its own successor -> {succ}',
+                remote_node=remote_node, succ=succ)
+        return succ
+
+    def remote_set_successor(self, remote_node, identity):
+        '''
+        Set the successor of the remote_node.
+
+        Args:
+            remote_node:    The remote node id.
+            identity:       The new successor identity.
+
+        Returns:
+            N/A
 
         Raises:
             requests.ConnectionError
             AssertionError
         '''
-        logger.debug('({}) ask {} to set its successor as {}'
-                        .format(self._id, remote_node, identity))
+        self._log.debug('ask {remote_node} to set its successor as {identity}',
+                remote_node=remote_node, identity=identity)
         if remote_node == self._id:     # if self, call self
             self.set_successor(identity)
         else:
-            url = 'http://{}:8000/set_successor'\
-                    .format(helper._gen_net_id(remote_node))
+            url = 'http://{}/set_successor'\
+                    .format(helper._gen_address(remote_node))
             payload = { 'id': identity }
             r = self._requests_post(url, payload)
             assert(r.status_code==200)
-        logger.debug('({}) ask {} to set its successor as {} is done'
-                        .format(self._id, remote_node, identity))
+        self._log.debug('ask {remote_node} to set its successor as {identity} is done',
+                remote_node=remote_node, identity=identity)
         return
 
-    def remote_find_successor(self, remote_node, identity):
+    def remote_find_successor(self, remote_node, identity, trace=None):
         '''
         Ask the remote node to find the successor of identity
 
         Args:
             remote_node:    The remote node id.
             identity:       The identity to look up.
+            trace:          A tuple (trace id, hop index) to record the span
+                            with and pass on. None for no tracing.
+
+        Returns:
+            The id of the successor.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+            KeyError
+        '''
+        if trace is not None:
+            return self._traces.record(trace[0], trace[1], self._id, remote_node,
+                    'find_successor', identity, self._remote_find_successor,
+                    remote_node, identity, trace)
+        return self._remote_find_successor(remote_node, identity)
+
+    def _remote_find_successor(self, remote_node, identity, trace=None):
+        '''
+        Ask the remote node to find the successor of identity, see remote_find_successor().
+        '''
+        self._log.hot('ask {remote_node} to find successor of {identity}',
+                remote_node=remote_node, identity=identity)
+        if remote_node == self._id:     # if self, call self
+            succ = self.find_successor(identity, trace)
+        else:
+            url = 'http://{}/find_successor'\
+                    .format(helper._gen_address(remote_node))
+            payload = self._trace_payload({ 'id': identity }, trace)
+            r = self._requests_post(url, payload)
+            assert(r.status_code==200)
+            succ = r.json()['id']
+        self._log.hot('ask {remote_node} to find successor of {identity} -> {succ}',
+                remote_node=remote_node, identity=identity, succ=succ)
+        return succ
+
+    def remote_find_successor_batch(self, remote_node, identities):
+        '''
+        Ask the remote node to find the successors of many identities.
+
+        Args:
+            remote_node:    The remote node id.
+            identities:     A list of identities to look up.
+
+        Returns:
+            A dict from identity to the identity of its successor.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+            KeyError
+        '''
+        if remote_node == self._id:     # if self, call self
+            return self.find_successor_batch(identities)
+        url = 'http://{}/find_successor_batch'\
+                .format(helper._gen_address(remote_node))
+        payload = { 'ids': identities }
+        r = self._requests_post(url, payload)
+        assert(r.status_code==200)
+        return r.json()['result']
+
+    def remote_closest_preceding_finger(self, remote_node, identity, trace=None):
+        '''
+        Ask the remote node to return the closest finger preceding id.
+
+        Args:
+            remote_node:    The remote node identity.
+            identity:   The identity of the object.
+            trace:      A tuple (trace id, hop index) to record the span
+                        with and pass on. None for no tracing.
+
+        Returns:
+            The identity of the closest finger preceding id on remote node.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+            KeyError
+        '''
+        if trace is not None:
+            return self._traces.record(trace[0], trace[1], self._id, remote_node,
+                    'closest_preceding_finger', identity,
+                    self._remote_closest_preceding_finger, remote_node, identity, trace)
+        return self._remote_closest_preceding_finger(remote_node, identity)
+
+    def _remote_closest_preceding_finger(self, remote_node, identity, trace=None):
+        '''
+        Ask the remote node for the closest finger preceding id, see remote_closest_preceding_finger().
+        '''
+        self._log.hot('ask {remote_node} to find closest preceding finger of {identity}',
+                remote_node=remote_node, identity=identity)
+        if remote_node == self._id:     # if self, call self
+            cpt = self.closest_preceding_finger(identity)
+        else:
+            url = 'http://{}/closest_preceding_finger'\
+                    .format(helper._gen_address(remote_node))
+            payload = self._trace_payload({ 'id': identity }, trace)
+            r = self._requests_post(url, payload)
+            assert(r.status_code==200)
+            cpt = r.json()['id']
+        self._log.hot('ask {remote_node} to find closest preceding finger of {identity} -> {cpt}',
+                remote_node=remote_node, identity=identity, cpt=cpt)
+        return cpt
+
+    def remote_notify(self, remote_node, identity):
+        '''
+        Ask the remote node to run the notify with identity.
+        
+        Args:
+            remote_node:    The identity of the remote node.
+            identity:   The identity of the object.
+
+        Returns:
+            N/A
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        self._log.debug('notify {remote_node} with {identity}',
+                remote_node=remote_node, identity=identity)
+        if remote_node == self._id:     # mine: if self, impossible to be its self predecessor 
+            self._log.debug('notify {remote_node} -> Abort, it cannot be its own predecessor',
+                    remote_node=remote_node)
+        else:
+            url = 'http://{}/notify'\
+                    .format(helper._gen_address(remote_node))
+            payload = { 'id': identity }
+            r = self._requests_post(url, payload)
+            assert(r.status_code==200)
+            self._log.debug('notify {remote_node} -> Done!', remote_node=remote_node)
+
+    def remote_put(self, remote_node, key, value, w=None, forwarded=False,
+            expire_at=None):
+        '''
+        Ask the remote node to put the key into the ring.
+
+        Args:
+            remote_node:    The remote node identity.
+            key:    The key.
+            value:  The value.
+            w:      The number of replicas to confirm the write.
+                    If None, use WRITE_QUORUM.
+            forwarded:  If True, the remote node is the owner of the key
+                        and should not route it again.
+            expire_at:  The time when the key expires. None for no expiry.
+
+        Returns:
+            The number of replicas which confirmed the write.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        self._log.hot('ask {remote_node} to put key {key}', remote_node=remote_node, key=key)
+        if remote_node == self._id:     # if self, call self
+            acks = self.put(key, value, w, forwarded, expire_at)
+        else:
+            url = 'http://{}/put'\
+                    .format(helper._gen_address(remote_node))
+            payload = { 'key': key, 'value': value, 'w': w, 'forwarded': forwarded,
+                    'expire_at': expire_at }
+            r = self._requests_post(url, payload)
+            assert(r.status_code==200)
+            acks = r.json()['acks']
+        self._log.hot('ask {remote_node} to put key {key} -> Done',
+                remote_node=remote_node, key=key)
+        return acks
+
+    def remote_get(self, remote_node, key, r=None, forwarded=False):
+        '''
+        Ask the remote node to get the value for the key from the ring.
+        
+        Args:
+            remote_node:    The identity of the remote node.
+            key:    The key of the key-value pair.
+            r:      The number of replicas to read.
+                    If None, use READ_QUORUM.
+            forwarded:  If True, the remote node is the owner of the key
+                        and should not route it again.
+
+        Returns:
+            The value of the key-value pair.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        self._log.hot('ask {remote_node} to get key {key}', remote_node=remote_node, key=key)
+        if remote_node == self._id:     # if self, call self
+            value = self.get(key, r, forwarded)
+        else:
+            url = 'http://{}/get'.format(helper._gen_address(remote_node))
+            payload = { 'key': key, 'r': r, 'forwarded': forwarded }
+            rsp = self._requests_post(url, payload)
+            assert(rsp.status_code==200)
+            value = rsp.json()['value']
+        self._log.hot('ask {remote_node} to get key {key} -> found {found}',
+                remote_node=remote_node, key=key, found=value is not None)
+        return value
+
+    def remote_mput(self, remote_node, items, w=None, forwarded=False):
+        '''
+        Ask the remote node to put many keys into the ring.
+
+        Args:
+            remote_node:    The remote node identity.
+            items:  A list of [key, value, expire_at].
+            w:      The number of replicas to confirm the writes.
+                    If None, use WRITE_QUORUM.
+            forwarded:  If True, the remote node owns all the keys
+                        and should not route them again.
+
+        Returns:
+            A dict from key to the number of replicas which confirmed it.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        if remote_node == self._id:     # if self, call self
+            return self.mput(items, w, forwarded)
+        url = 'http://{}/mput'.format(helper._gen_address(remote_node))
+        payload = { 'items': items, 'w': w, 'forwarded': forwarded }
+        r = self._requests_post(url, payload)
+        assert(r.status_code==200)
+        return r.json()['result']
+
+    def remote_mget(self, remote_node, keys, r=None, forwarded=False):
+        '''
+        Ask the remote node to get the values for many keys from the ring.
+
+        Args:
+            remote_node:    The remote node identity.
+            keys:   A list of keys.
+            r:      The number of replicas to read.
+                    If None, use READ_QUORUM.
+            forwarded:  If True, the remote node owns all the keys
+                        and should not route them again.
+
+        Returns:
+            A dict from key to its value.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        if remote_node == self._id:     # if self, call self
+            return self.mget(keys, r, forwarded)
+        url = 'http://{}/mget'.format(helper._gen_address(remote_node))
+        payload = { 'keys': keys, 'r': r, 'forwarded': forwarded }
+        rsp = self._requests_post(url, payload)
+        assert(rsp.status_code==200)
+        return rsp.json()['result']
+
+    def remote_local_put(self, remote_node, key, value, version=None,
+            expire_at=None, timeout=2, retry=None):
+        '''
+        Ask the remote node to store the key-value pair locally.
+
+        Args:
+            remote_node:    The remote node identity.
+            key:    The key.
+            value:  The value.
+            version:    The version of the value.
+            expire_at:  The time when the key expires. None for no expiry.
+            timeout:    The timeout of the request. Default is 2.
+            retry:      The retry times on timeout. If None, use CONN_RETRY.
+
+        Returns:
+            N/A
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        self._log.hot('ask {remote_node} to local put key {key}', remote_node=remote_node, key=key)
+        if remote_node == self._id:     # if self, call self
+            self.local_put(key, value, version, expire_at)
+        else:
+            url = 'http://{}/local_put'\
+                    .format(helper._gen_address(remote_node))
+            payload = { 'key': key, 'value': value, 'version': version,
+                    'expire_at': expire_at }
+            r = self._requests_post(url, payload, timeout, retry)
+            assert(r.status_code==200)
+        self._log.hot('ask {remote_node} to local put key {key} -> Done',
+                remote_node=remote_node, key=key)
+
+    def remote_local_get_version(self, remote_node, key):
+        '''
+        Ask the remote node for the local value and version of the key.
+
+        Args:
+            remote_node:    The remote node identity.
+            key:    The key.
+
+        Returns:
+            A tuple (value, version, expire_at).
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+            KeyError
+        '''
+        if remote_node == self._id:     # if self, call self
+            return self.local_get_version(key)
+        url = 'http://{}/local_get'\
+                .format(helper._gen_address(remote_node))
+        payload = { 'key': key }
+        r = self._requests_post(url, payload)
+        assert(r.status_code==200)
+        return (r.json()['value'], r.json()['version'], r.json().get('expire_at'))
+
+    def remote_local_mget(self, remote_node, keys):
+        '''
+        Ask the remote node for the local values and versions of many keys.
+
+        Args:
+            remote_node:    The remote node identity.
+            keys:   A list of keys.
 
         Returns:
-            The id of the successor.
+            A list of [value, version, expire_at], in the order of the keys.
 
         Raises:
             requests.ConnectionError
             AssertionError
             KeyError
         '''
-        logger.debug('({}) ask {} to find successor of {}'
-                        .format(self._id, remote_node, identity))
         if remote_node == self._id:     # if self, call self
-            succ = self.find_successor(identity)
-        else:
-            url = 'http://{}:8000/find_successor'\
-                    .format(helper._gen_net_id(remote_node))
-            payload = { 'id': identity }
-            r = self._requests_post(url, payload)
-            assert(r.status_code==200)
-            succ = r.json()['id']
-        logger.debug('({}) ask {} to find successor of {} -> {}'
-                        .format(self._id, remote_node, identity, succ))
-        return succ
+            return self.local_mget(keys)
+        url = 'http://{}/local_mget'.format(helper._gen_address(remote_node))
+        payload = { 'keys': keys }
+        r = self._requests_post(url, payload)
+        assert(r.status_code==200)
+        return r.json()['result']
 
-    def remote_closest_preceding_finger(self, remote_node, identity):
+    def remote_merkle(self, remote_node, start, end, level, indices):
         '''
-        Ask the remote node to return the closest finger preceding id.
+        Ask the remote node for the hashes of its merkle tree nodes.
 
         Args:
             remote_node:    The remote node identity.
-            identity:   The identity of the object.
+            start:      The range start, excluded.
+            end:        The range end, included.
+            level:      The level of the tree, 0 is the root.
+            indices:    The indices of the nodes on the level.
 
         Returns:
-            The identity of the closest finger preceding id on remote node.
+            A list of hashes in hex.
 
         Raises:
             requests.ConnectionError
             AssertionError
             KeyError
         '''
-        logger.debug('({}) ask {} to find closest preceding finger of {}'
-                        .format(self._id, remote_node, identity))
         if remote_node == self._id:     # if self, call self
-            cpt = self.closest_preceding_finger(identity)
-        else:
-            url = 'http://{}:8000/closest_preceding_finger'\
-                    .format(helper._gen_net_id(remote_node))
-            payload = { 'id': identity }
-            r = self._requests_post(url, payload)
-            assert(r.status_code==200)
-            cpt = r.json()['id']
-        logger.debug('({}) ask {} to find closest preceding finger of {} -> {}'
-                        .format(self._id, remote_node, identity, cpt))
-        return cpt
+            return self.merkle_hashes(start, end, level, indices)
+        url = 'http://{}/merkle'.format(helper._gen_address(remote_node))
+        payload = { 'start': start, 'end': end, 'level': level, 'indices': indices }
+        r = self._requests_post(url, payload)
+        assert(r.status_code==200)
+        return r.json()['result']
 
-    def remote_notify(self, remote_node, identity):
+    def remote_range_scan(self, remote_node, start, end, cursor=None, limit=100):
         '''
-        Ask the remote node to run the notify with identity.
-        
+        Ask the remote node to scan its key-value pairs in (start, end].
+
         Args:
-            remote_node:    The identity of the remote node.
-            identity:   The identity of the object.
+            remote_node:    The remote node identity.
+            start:  The range start, excluded.
+            end:    The range end, included.
+            cursor: The cursor returned by the last scan.
+            limit:  The max number of pairs returned.
 
         Returns:
-            N/A
+            A tuple (items, cursor) as range_scan().
 
         Raises:
             requests.ConnectionError
             AssertionError
+            KeyError
         '''
-        logger.debug('({}) notify {} with {}'.format(self._id, remote_node, identity))
-        if remote_node == self._id:     # mine: if self, impossible to be its self predecessor 
-            logger.debug('({}) notify {} -> Abort, it cannot be its own predecessor'.format(self._id, remote_node))
-        else:
-            url = 'http://{}:8000/notify'\
-                    .format(helper._gen_net_id(remote_node))
-            payload = { 'id': identity }
-            r = self._requests_post(url, payload)
-            assert(r.status_code==200)
-            logger.debug('({}) notify {} -> Done!'.format(self._id, remote_node))
+        if remote_node == self._id:     # if self, call self
+            return self.range_scan(start, end, cursor, limit)
+        url = 'http://{}/range_scan'.format(helper._gen_address(remote_node))
+        payload = { 'start': start, 'end': end, 'cursor': cursor, 'limit': limit }
+        r = self._requests_post(url, payload)
+        assert(r.status_code==200)
+        return (r.json()['result'], r.json()['cursor'])
 
-    def remote_put(self, remote_node, key, value):
+    def remote_local_put_batch(self, remote_node, items, timeout=2, retry=None):
         '''
-        Ask the remote node to put the key.
+        Ask the remote node to store many key-value pairs locally.
 
         Args:
             remote_node:    The remote node identity.
-            key:    The key.
-            value:  The value.
+            items:  A list of [key, value, version, expire_at].
+            timeout:    The timeout of the request. Default is 2.
+            retry:      The retry times on timeout. If None, use CONN_RETRY.
 
         Returns:
             N/A
 
         Raises:
             requests.ConnectionError
+            AssertionError
         '''
-        logger.debug('({}) ask {} to put key {} value {}'\
-                .format(self._id, remote_node, key, value))
+        self._log.hot('ask {remote_node} to put {keys} keys in batch',
+                remote_node=remote_node, keys=len(items))
         if remote_node == self._id:     # if self, call self
-            self.put(key, value)
+            self.local_put_batch(items)
         else:
-            url = 'http://{}:8000/put'\
-                    .format(helper._gen_net_id(remote_node))
-            payload = { 'key': key, 'value': value }
-            r = self._requests_post(url, payload)
+            url = 'http://{}/local_put_batch'\
+                    .format(helper._gen_address(remote_node))
+            payload = { 'items': items }
+            r = self._requests_post(url, payload, timeout, retry)
             assert(r.status_code==200)
-        logger.debug('({}) ask {} to put key {} value {} -> Done'\
-                .format(self._id, remote_node, key, value))
+        self._log.hot('ask {remote_node} to put {keys} keys in batch -> Done',
+                remote_node=remote_node, keys=len(items))
 
-    def remote_get(self, remote_node, key):
+    def remote_splice_out(self, remote_node, identity, pred, succ):
         '''
-        Ask the remote node to get the value for the key.
-        
+        Tell the remote node that the node identity is leaving.
+
         Args:
-            remote_node:    The identity of the remote node.
-            key:    The key of the key-value pair.
+            remote_node:    The remote node identity.
+            identity:   The identity of the leaving node.
+            pred:       The predecessor of the leaving node.
+            succ:       The successor of the leaving node.
 
         Returns:
-            The value of the key-value pair.
+            N/A
 
         Raises:
             requests.ConnectionError
+            AssertionError
         '''
-        logger.debug('({}) ask {} to get key {}'\
-                .format(self._id, remote_node, key))
+        self._log.debug('tell {remote_node} to splice out {identity}',
+                remote_node=remote_node, identity=identity)
         if remote_node == self._id:     # if self, call self
-            value = self.get(key)
+            self.splice_out(identity, pred, succ)
         else:
-            url = 'http://{}:8000/get'.format(helper._gen_net_id(remote_node))
-            payload = { 'key': key }
+            url = 'http://{}/splice_out'\
+                    .format(helper._gen_address(remote_node))
+            payload = { 'id': identity, 'predecessor': pred, 'successor': succ }
             r = self._requests_post(url, payload)
             assert(r.status_code==200)
-            value = r.json()['value']
-        logger.debug('({}) ask {} to get key {} -> value {}'\
-                .format(self._id, remote_node, key, value))
-        return value
+        self._log.debug('tell {remote_node} to splice out {identity} -> Done',
+                remote_node=remote_node, identity=identity)
+
+    def _next_hop(self, trace):
+        '''
+        Return the trace of the next hop, None if not traced.
+        '''
+        return None if trace is None else (trace[0], trace[1] + 1)
+
+    def _trace_payload(self, payload, trace):
+        '''
+        Add the trace id and the hop index to the payload.
+        '''
+        if trace is not None:
+            payload['trace'] = trace[0]
+            payload['hop'] = trace[1]
+        return payload
 
-    def _requests_post(self, url, payload, timeout=2):
+    def _requests_post(self, url, payload, timeout=2, retry=None):
         '''
         Help function to send requests and retry 3 times.
 
@@ -759,6 +1868,7 @@ class Node(object):
             url:    The target url.
             payload:    The data in post.
             timeout:    The timeout of the request. Default is 2.
+            retry:      The max retry times. If None, use CONN_RETRY.
 
         Returns:
             The corresponding object returned by requests.
@@ -766,21 +1876,31 @@ class Node(object):
         Raises:
             requests.ConnectionError
         '''
+        if retry is None:
+            retry = ct.CONN_RETRY
+        peer, _, path = url[len('http://'):].partition('/')
         correct = False
         r = None
-        retry = 0
+        retried = 0
         while not correct:
+            start = time.time()
             try:
                 r = requests.post(url, json=payload, timeout=timeout)
                 correct = True
+                metrics.RPC_SECONDS.observe(time.time() - start, peer, '/' + path)
             except requests.exceptions.Timeout:
-                retry += 1
-                if retry > ct.CONN_RETRY:      # reached max retry times
+                retried += 1
+                if retried > retry:      # reached max retry times
+                    metrics.RPC_TIMEOUTS.inc(peer)
                     logger.info('max retry times reached. Abort.')
                     raise requests.ConnectionError()
+                metrics.RPC_RETRIES.inc(peer)
                 logger.info('request failed, try again soon.')
                 rand_t = random.randint(10,30) / 10
                 time.sleep(rand_t)
+            except requests.ConnectionError:
+                metrics.RPC_ERRORS.inc(peer)
+                raise
         return r
 
     #-------------------------------------- end of remote part --------------------------------------
@@ -870,6 +1990,466 @@ class Node(object):
             return False
         return s_int < n_int < e_int
 
+    def _items_in_range(self, start, end):
+        '''
+        Return the key-value pairs whose key identity is in (start, end].
+
+        Args:
+            start:  The range start, excluded.
+            end:    The range end, included.
+
+        Returns:
+            A list of [key, value, version, expire_at].
+
+        Raises:
+            N/A
+        '''
+        return self._with_expiry(self._data.range_items(start, end))
+
+    def _sync_range(self, remote_node, start, end):
+        '''
+        Exchange the keys in (start, end] with the remote node, so both
+        have the newest version of every key.
+
+        Args:
+            remote_node:    The remote node identity.
+            start:  The range start, excluded.
+            end:    The range end, included.
+
+        Returns:
+            The number of keys exchanged.
+
+        Raises:
+            requests.ConnectionError
+            AssertionError
+        '''
+        if start == end:        # empty leaf
+            return 0
+        remote = {}
+        cursor = None
+        while True:
+            items, cursor = self.remote_range_scan(remote_node, start, end, cursor)
+            for item in items:
+                remote[item[0]] = item
+            if not cursor:
+                break
+        push = []
+        for item in self._items_in_range(start, end):
+            if item[0] not in remote or remote[item[0]][2] < item[2]:
+                push.append(item)
+        pull = 0
+        for key, item in remote.items():
+            if self._data.get_version(key)[1] < item[2]:
+                self._put_item(item)
+                pull += 1
+        if push:
+            self.remote_local_put_batch(remote_node, push)
+        return len(push) + pull
+
+    def _replica_put(self, remote_node, key, value, version, expire_at=None):
+        '''
+        Write the key-value pair to a replica without retry.
+        If the replica is unreachable, keep the write as a hint.
+
+        Args:
+            remote_node:    The identity of the replica.
+            key:    The key.
+            value:  The value.
+            version:    The version of the value.
+            expire_at:  The time when the key expires. None for no expiry.
+
+        Returns:
+            True if written, False if hinted.
+
+        Raises:
+            N/A
+        '''
+        try:
+            self.remote_local_put(remote_node, key, value, version,
+                    expire_at, ct.REPLICA_TIMEOUT, 0)
+            return True
+        except (requests.ConnectionError, AssertionError):
+            logger.info('({}) replica {} is unreachable, hint key {}'\
+                    .format(self._id, remote_node, key))
+            self._hints.add(remote_node, key, value, version, expire_at)
+            return False
+
+    def _replica_put_batch(self, remote_node, items):
+        '''
+        Write many key-value pairs to a replica in one request without retry.
+        If the replica is unreachable, keep the writes as hints.
+
+        Args:
+            remote_node:    The identity of the replica.
+            items:  A list of [key, value, version, expire_at].
+
+        Returns:
+            True if written, False if hinted.
+
+        Raises:
+            N/A
+        '''
+        try:
+            self.remote_local_put_batch(remote_node, items,
+                    ct.REPLICA_TIMEOUT, 0)
+            return True
+        except (requests.ConnectionError, AssertionError):
+            logger.info('({}) replica {} is unreachable, hint {} keys'\
+                    .format(self._id, remote_node, len(items)))
+            for key, value, version, expire_at in items:
+                self._hints.add(remote_node, key, value, version, expire_at)
+            return False
+
+    def _replay_hints(self):
+        '''
+        Replay the hinted writes to the replicas which are alive again.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        for target in self._hints.targets():
+            try:
+                self.remote_get_successor(target)     # check liveness
+            except (requests.ConnectionError, AssertionError):
+                continue
+            items = self._hints.take(target)
+            try:
+                self.remote_local_put_batch(target, items)
+                self._hints.count_replayed(len(items))
+                self._log.debug('replayed {keys} hints to {target}', keys=len(items), target=target)
+            except (requests.ConnectionError, AssertionError):
+                for key, value, version, expire_at in items:     # try again next round
+                    self._hints.add(target, key, value, version, expire_at)
+
+    def _put_item(self, item):
+        '''
+        Store a [key, value, version, expire_at] on the local node,
+        and keep its expiry time in the timer wheel if it is stored.
+        A key which has already expired is not stored.
+
+        Args:
+            item:   A list of [key, value, version, expire_at]. If the
+                    version is missing or None, use a new version.
+                    If the expire_at is missing or None, no expiry.
+
+        Returns:
+            True if stored. False otherwise.
+
+        Raises:
+            N/A
+        '''
+        key, value = item[0], item[1]
+        version = item[2] if len(item) > 2 and item[2] is not None \
+                else self._new_version()
+        expire_at = item[3] if len(item) > 3 else None
+        if expire_at is not None and expire_at <= time.time():
+            if self._data.get_version(key)[1] <= version:
+                self._ttl.remove(key)
+                self._data.delete(key)
+            return False
+        if not self._data.put(key, value, version, expire_at):
+            return False
+        if expire_at is None:
+            self._ttl.remove(key)
+        else:
+            self._ttl.add(key, expire_at)
+        return True
+
+    def _load_expiries(self):
+        '''
+        Rebuild the timer wheel from the expiry times saved in the store,
+        e.g. by the log store before a restart, and delete the keys which
+        expired while the node was down.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        now = time.time()
+        for key, expire_at in self._data.expiries().items():
+            if expire_at <= now:
+                self._data.delete(key)
+            else:
+                self._ttl.add(key, expire_at)
+
+    def _check_expiry(self, key):
+        '''
+        Delete the key if it has expired, before the timer wheel does.
+
+        Args:
+            key:    The key of the key-value pair.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        if self._ttl.expired(key):
+            self._ttl.remove(key)
+            self._data.delete(key)
+
+    def _with_expiry(self, items):
+        '''
+        Append the expiry time to each [key, value, version].
+
+        Args:
+            items:  A list of [key, value, version].
+
+        Returns:
+            A list of [key, value, version, expire_at].
+
+        Raises:
+            N/A
+        '''
+        return [item[:3] + [self._ttl.get(item[0])] for item in items]
+
+    def _new_version(self):
+        '''
+        Generate a new version for a value.
+        It is the time in microseconds, and is increasing on this node.
+
+        Args:
+            N/A
+
+        Returns:
+            An integer version.
+
+        Raises:
+            N/A
+        '''
+        with self._version_lock:
+            self._version = max(int(time.time() * 1000000), self._version + 1)
+            return self._version
+
+    def _read_repair(self, key, futures):
+        '''
+        Once all the replicas replied, write the newest value to the
+        replicas with older versions. It does not block.
+
+        Args:
+            key:        The key of the key-value pair.
+            futures:    A map from the futures of remote_local_get_version
+                        to the node identities.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        results = {}
+        lock = threading.Lock()
+        def done(f):
+            with lock:
+                results[futures[f]] = f.result() if f.exception() is None else None
+                if len(results) < len(futures):
+                    return
+            alive = { node: res for node, res in results.items() if res }
+            if not alive:
+                return
+            value, version, expire_at = max(alive.values(), key=lambda res: res[1])
+            for node, res in alive.items():
+                if res[1] < version:
+                    logger.info('({}) repair key {} on {}'\
+                            .format(self._id, key, node))
+                    self._executor.submit(self.remote_local_put,
+                            node, key, value, version, expire_at)
+        for f in futures:
+            f.add_done_callback(done)
+
+    def _read_repair_batch(self, keys, futures):
+        '''
+        Once all the replicas replied to a batch read, write the newest
+        values to the replicas with older versions, one request per replica.
+        It does not block.
+
+        Args:
+            keys:       The list of keys read.
+            futures:    A map from the futures of remote_local_mget
+                        to the node identities.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        results = {}
+        lock = threading.Lock()
+        def done(f):
+            with lock:
+                results[futures[f]] = f.result() if f.exception() is None else None
+                if len(results) < len(futures):
+                    return
+            alive = { node: res for node, res in results.items() if res }
+            repairs = collections.defaultdict(list)
+            for i, key in enumerate(keys):
+                newest = max((res[i] for res in alive.values()), key=lambda v: v[1],
+                        default=None)
+                if newest is None or newest[1] == 0:
+                    continue
+                for node, res in alive.items():
+                    if res[i][1] < newest[1]:
+                        repairs[node].append([key, newest[0], newest[1], newest[2]])
+            for node, items in repairs.items():
+                logger.info('({}) repair {} keys on {}'\
+                        .format(self._id, len(items), node))
+                self._executor.submit(self.remote_local_put_batch, node, items)
+        for f in futures:
+            f.add_done_callback(done)
+
+    def _group_by_owner(self, keys):
+        '''
+        Group the keys by the nodes owning them.
+        The owners of all the distinct key identities are found by one
+        find_successor_batch(), which sends one request per next hop
+        instead of one lookup per identity. The groups are ordered around
+        the ring starting right after this node.
+
+        Args:
+            keys:   A list of keys.
+
+        Returns:
+            A dict from node identity to the list of keys it owns.
+            The keys are under None if the lookup failed.
+
+        Raises:
+            N/A
+        '''
+        me = int(self._id, 16)
+        size = ct.TWO_EXP[ct.RING_SIZE_BIT]
+        ids = sorted(((helper._hash(key), key) for key in keys),
+                key=lambda x: ((int(x[0], 16) - me - 1) % size, x[1]))
+        try:
+            owners = self.find_successor_batch([identity for identity, _ in ids])
+        except (requests.ConnectionError, AssertionError):
+            logger.info('({}) lookup of {} keys failed'.format(self._id, len(keys)))
+            owners = {}
+        groups = collections.OrderedDict()
+        for identity, key in ids:
+            groups.setdefault(owners.get(identity), []).append(key)
+        self._log.debug('{keys} keys are owned by {nodes} nodes', keys=len(keys), nodes=len(groups))
+        return groups
+
+    def _fan_out(self, groups, default, call):
+        '''
+        Send the key groups to their owners in parallel.
+        The group of this node is handled in the calling thread.
+
+        Args:
+            groups:     A dict from node identity to a list of keys,
+                        as _group_by_owner().
+            default:    The result of the keys whose owner cannot be reached.
+            call:       A function (owner, keys) returning a dict from key
+                        to result.
+
+        Returns:
+            A dict from key to result.
+
+        Raises:
+            N/A
+        '''
+        results = { key: default for key in groups.get(None, []) }
+        futures = {}
+        for owner, keys in groups.items():
+            if owner is not None and owner != self._id:
+                futures[self._executor.submit(call, owner, keys)] = keys
+        if self._id in groups:
+            results.update(call(self._id, groups[self._id]))
+        for f in concurrent.futures.as_completed(futures):
+            if f.exception() is None:
+                results.update(f.result())
+            else:
+                logger.info('({}) batch of {} keys failed: {}'\
+                        .format(self._id, len(futures[f]), f.exception()))
+                for key in futures[f]:
+                    results[key] = default
+        return results
+
+    def _is_owner(self, identity):
+        '''
+        Check whether this node owns the identity, i.e. the identity
+        is in (predecessor, self].
+
+        Args:
+            identity:   The identity of the object.
+
+        Returns:
+            True if owned. False otherwise.
+
+        Raises:
+            N/A
+        '''
+        if self._predecessor is None:
+            return self.get_successor() == self._id     # alone in the ring
+        return identity == self._id or \
+                self._in_range_ei(identity, self._predecessor, self._id)
+
+    def _replicas(self):
+        '''
+        Return the other nodes keeping replicas of this node's keys,
+        i.e. the first BACKUP_SUCC_NUM distinct nodes of the successor
+        and the backup successors.
+
+        Args:
+            N/A
+
+        Returns:
+            A list of node identities.
+
+        Raises:
+            N/A
+        '''
+        replicas = []
+        for node in [self.get_successor()] + self._backup_succ:
+            if node != self._id and node not in replicas:
+                replicas.append(node)
+        return replicas[:ct.BACKUP_SUCC_NUM]
+
+    def _check_replicas(self):
+        '''
+        Check whether the successor list has changed, e.g. a dead successor
+        is replaced by a backup. The keys this node owns are copied to the new
+        replicas in background, to restore the replication factor.
+        The first check after a start only records the replicas, since they
+        had the keys before this node (re)started, and anti-entropy repairs
+        any gap. Otherwise every restart would copy the whole range again.
+        This function is not mentioned in the chord ring paper.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        if self._predecessor is None:       # the owned range is unknown
+            return
+        replicas = self._replicas()
+        if self._last_replicas is None:     # the first check
+            self._last_replicas = replicas
+            return
+        for node in replicas:
+            if node not in self._last_replicas:
+                self._log.debug('new replica {node}', node=node)
+                self._migrator.add_task(node, self._predecessor, self._id,
+                        mg.REPLICATION)
+        self._last_replicas = replicas
+
     def _update_backup_succ(self):
         '''
         Update the backup successors.
@@ -0,0 +1,79 @@
+'''
+This file contains the on-demand profiling of a running node: a sampling
+profiler over all the threads, and a dump of the stacks of the threads.
+The samples are read with sys._current_frames(), so nothing has to be
+installed in the threads and the node does not need a restart.
+Reference:
+[1] https://github.com/brendangregg/FlameGraph (collapsed stack format)
+'''
+import collections
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from . import constants as ct
+
+_running = threading.Lock()     # one profile at a time
+
+def profile(seconds, interval=None):
+    '''
+    Sample the stacks of all the other threads for the seconds.
+
+    Args:
+        seconds:    The duration of the profile, at most PROFILE_MAX_SECONDS.
+        interval:   The seconds between samples. If None, use PROFILE_INTERVAL.
+
+    Returns:
+        The stacks in the collapsed stack format, one line per stack,
+        'thread;outer frame;...;inner frame count', the most sampled first.
+        None if a profile is already running.
+
+    Raises:
+        N/A
+    '''
+    if not _running.acquire(False):
+        return None
+    try:
+        interval = ct.PROFILE_INTERVAL if interval is None else interval
+        deadline = time.time() + min(seconds, ct.PROFILE_MAX_SECONDS)
+        me = threading.get_ident()
+        counts = collections.Counter()
+        while time.time() < deadline:
+            names = _thread_names()
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(_group(names.get(ident, 'unknown')))
+                counts[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in counts.most_common())
+    finally:
+        _running.release()
+
+def threads():
+    '''
+    Return the stacks of all the threads as text, like a traceback.
+    '''
+    names = _thread_names()
+    lines = []
+    for ident, frame in sorted(sys._current_frames().items()):
+        lines.append('Thread {} ({}):\n'.format(names.get(ident, 'unknown'), ident))
+        lines.extend(traceback.format_stack(frame))
+        lines.append('\n')
+    return ''.join(lines)
+
+def _thread_names():
+    return dict((t.ident, t.name) for t in threading.enumerate())
+
+def _group(name):
+    '''
+    Merge the threads of a kind, e.g. the request threads 'Thread-12 (...)'.
+    '''
+    return re.sub(r'\d+', 'N', name).replace(' ', '_')
@@ -5,24 +5,76 @@ import random
 import threading
 import time
 from . import node
+from . import constants as ct
+from . import metrics as metrics
 
 # shared values
 g_node = None
 
+def _store_keys():
+    '''
+    Return the keys stored on the node and the keys with a TTL, for /metrics.
+    '''
+    return { ('all',): g_node.display_memory()['keys'],
+            ('ttl',): g_node._ttl.stats()['keys'] }
+
+def _store_bytes():
+    '''
+    Return the bytes held in memory by the store, for /metrics.
+    '''
+    usage = g_node.display_memory()
+    return { (kind,): usage[kind + '_bytes'] for kind in ['key', 'value', 'index'] }
+
+metrics.REGISTRY.gauge('chord_store_keys', 'Keys stored on this node.', ['kind'], _store_keys)
+metrics.REGISTRY.gauge('chord_store_bytes', 'Bytes held in memory by the store.', ['kind'], _store_bytes)
+
 def period():
     '''
     Periodically call the stabilize and fix_finger_table
+    until the node leaves the ring. The anti-entropy and the
+    store compaction run once every ANTI_ENTROPY_ROUNDS rounds.
     '''
-    while True:
-        g_node.stabilize()
-        g_node.fix_fingers(True)        # TODO: change to random after docker test is passed
+    rounds = 0
+    timing = metrics.MAINTENANCE_SECONDS.time
+    while not g_node.has_left():
+        with timing('stabilize'):
+            g_node.stabilize()
+        with timing('fix_fingers'):
+            g_node.fix_fingers(True)        # TODO: change to random after docker test is passed
+        rounds += 1
+        if rounds % ct.ANTI_ENTROPY_ROUNDS == 0:
+            with timing('anti_entropy'):
+                g_node.anti_entropy()
+            with timing('drop_stale'):
+                g_node.drop_stale()
+            with timing('compact'):
+                g_node.compact()
         rand_t = random.randint(50, 100) / 10
         time.sleep(rand_t)
 
+def migrate():
+    '''
+    Move the queued key ranges until the node leaves the ring,
+    so the throttled transfer does not delay stabilize.
+    '''
+    while not g_node.has_left():
+        g_node.migrate(ct.MIGRATION_WAIT)
+
+def expiry():
+    '''
+    Delete the expired keys every TTL_TICK seconds
+    until the node leaves the ring.
+    '''
+    while not g_node.has_left():
+        with metrics.MAINTENANCE_SECONDS.time('expire'):
+            g_node.expire()
+        time.sleep(ct.TTL_TICK)
+
 def init(self_id, remote_id=None):
     global g_node 
     g_node = node.Node(self_id)
     g_node.join(remote_id)
-    t = threading.Thread(target=period)
-    t.daemon = True
-    t.start()
+    for target in [period, migrate, expiry]:
+        t = threading.Thread(target=target)
+        t.daemon = True
+        t.start()
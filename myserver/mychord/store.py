@@ -0,0 +1,559 @@
+'''
+This file contains code for the key-value store of a node.
+'''
+import bisect
+import json
+import sys
+import threading
+from . import helper as helper
+
+class KeyStore(object):
+    '''
+    Key-value store ordered by the identity of keys on the ring.
+    The identity is hashed once when the key is written, so the keys
+    in a range (start, end] can be found in O(log n + k).
+    Each value has a version, a write with an older version is ignored.
+    The values are kept in memory. Subclasses can keep them elsewhere by
+    overriding _save(), _load() and _drop().
+    '''
+
+    def __init__(self):
+        '''
+        Initialize the store.
+
+        self._values:   A map from key to (identity, slot, version).
+                        The identity is an integer. The slot is what
+                        _save() returns, the value itself in memory.
+        self._index:    A sorted list of (identity, key).
+        self._changes:  The number of changes, used to tell whether the
+                        data has changed.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._values = {}
+        self._index = []
+        self._changes = 0
+        self._lock = threading.RLock()      # for writes
+
+    def put(self, key, value, version=0, expire_at=None):
+        '''
+        Store the key-value pair if the version is not older.
+
+        Args:
+            key:        The key of the key-value pair.
+            value:      The value of the key-value pair.
+            version:    The version of the value.
+            expire_at:  The time when the key expires, kept by stores which
+                        survive a restart, see expiries(). None for no expiry.
+
+        Returns:
+            True if stored. False if there is a newer version.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and version < entry[2]:
+                return False
+            slot = self._save(key, value, version, expire_at)
+            if entry is not None:
+                self._values[key] = (entry[0], slot, version)
+            else:
+                rid = int(helper._hash(key), 16)
+                self._values[key] = (rid, slot, version)
+                bisect.insort(self._index, (rid, key))
+            self._changes += 1
+        self._sync()
+        return True
+
+    def get(self, key, default=None):
+        '''
+        Get the value for the key.
+
+        Args:
+            key:        The key of the key-value pair.
+            default:    The value returned if there is no such key.
+
+        Returns:
+            The value of the key-value pair.
+
+        Raises:
+            N/A
+        '''
+        entry = self._values.get(key)
+        if entry is None:
+            return default
+        return self._load(entry[1])
+
+    def get_version(self, key):
+        '''
+        Get the value and its version for the key.
+
+        Args:
+            key:    The key of the key-value pair.
+
+        Returns:
+            A tuple (value, version). If there is no such key, (None, 0).
+
+        Raises:
+            N/A
+        '''
+        entry = self._values.get(key)
+        if entry is None:
+            return (None, 0)
+        return (self._load(entry[1]), entry[2])
+
+    def get_raw(self, key):
+        '''
+        Get the value for the key as bytes, without decoding it.
+        A string is encoded in utf-8, other values in json.
+
+        Args:
+            key:    The key of the key-value pair.
+
+        Returns:
+            A tuple (data, is_json, version). The data is a bytes-like object.
+            If there is no such key, (None, False, 0).
+
+        Raises:
+            N/A
+        '''
+        entry = self._values.get(key)
+        if entry is None:
+            return (None, False, 0)
+        value = self._load(entry[1])
+        if isinstance(value, str):
+            return (value.encode('utf-8'), False, entry[2])
+        return (json.dumps(value).encode('utf-8'), True, entry[2])
+
+    def delete(self, key):
+        '''
+        Delete the key if exists.
+
+        Args:
+            key:    The key of the key-value pair.
+
+        Returns:
+            True if deleted. False otherwise.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            entry = self._values.pop(key, None)
+            if entry is None:
+                return False
+            self._drop(key, entry)
+            pos = bisect.bisect_left(self._index, (entry[0], key))
+            del self._index[pos]
+            self._changes += 1
+        self._sync()
+        return True
+
+    def items(self):
+        '''
+        Return all the key-value pairs ordered by identity.
+
+        Args:
+            N/A
+
+        Returns:
+            A list of [key, value, version].
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            keys = [key for _, key in self._index]
+        return self._items(keys)
+
+    def to_dict(self):
+        '''
+        Return all the key-value pairs as a dict.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict representing key-value pairs.
+
+        Raises:
+            N/A
+        '''
+        return { key: self._load(entry[1]) for key, entry in list(self._values.items()) }
+
+    def clear(self):
+        '''
+        Remove all the key-value pairs.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            for key, entry in self._values.items():
+                self._drop(key, entry)
+            self._values = {}
+            self._index = []
+            self._changes += 1
+        self._sync()
+
+    def expiries(self):
+        '''
+        Return the expiry times saved with the values, so the timer wheel
+        can be rebuilt when the node starts again.
+        Values in memory do not survive a restart, so nothing is saved.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict from key to the time it expires, for the keys with a TTL.
+
+        Raises:
+            N/A
+        '''
+        return {}
+
+    def compact(self):
+        '''
+        Reclaim the space of overwritten and deleted values.
+        Nothing to do for values in memory.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        pass
+
+    def close(self):
+        '''
+        Release the resources of the store.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        pass
+
+    def memory_usage(self):
+        '''
+        Return the memory used by the store. The sizes of Python objects
+        are estimated by sys.getsizeof().
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the number of keys, and the bytes of keys,
+            values and the index in memory.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            return {
+                    'keys': len(self._values),
+                    'key_bytes': sum(sys.getsizeof(key) for key in self._values),
+                    'value_bytes': sum(self._slot_bytes(entry[1])
+                        for entry in self._values.values()),
+                    'index_bytes': sys.getsizeof(self._values) + sys.getsizeof(self._index)
+                        + sum(sys.getsizeof(entry) for entry in self._values.values())
+                        + sum(sys.getsizeof(pair) for pair in self._index)
+                    }
+
+    def changes(self):
+        '''
+        Return the number of changes so far.
+
+        Args:
+            N/A
+
+        Returns:
+            An integer which increases on every change.
+
+        Raises:
+            N/A
+        '''
+        return self._changes
+
+    def range_items(self, start, end):
+        '''
+        Return the key-value pairs whose key identity is in (start, end].
+
+        Args:
+            start:  The range start in hex, excluded.
+            end:    The range end in hex, included.
+
+        Returns:
+            A list of [key, value, version] ordered from start to end.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            keys = [key for lo, hi in self._slices(start, end)
+                    for _, key in self._index[lo:hi]]
+        return self._items(keys)
+
+    def range_versions(self, start, end):
+        '''
+        Return the identities and versions of the keys in (start, end].
+
+        Args:
+            start:  The range start in hex, excluded.
+            end:    The range end in hex, included.
+
+        Returns:
+            A list of (identity, key, version) ordered from start to end.
+            The identity is an integer.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            return [(rid, key, self._values[key][2])
+                    for lo, hi in self._slices(start, end)
+                    for rid, key in self._index[lo:hi]]
+
+    def count_range(self, start, end):
+        '''
+        Count the keys whose identity is in (start, end].
+
+        Args:
+            start:  The range start in hex, excluded.
+            end:    The range end in hex, included.
+
+        Returns:
+            The number of keys.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            return sum(hi - lo for lo, hi in self._slices(start, end))
+
+    def delete_range(self, start, end):
+        '''
+        Delete the keys whose identity is in (start, end].
+
+        Args:
+            start:  The range start in hex, excluded.
+            end:    The range end in hex, included.
+
+        Returns:
+            The number of deleted keys.
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            count = 0
+            # delete from the back so the front slice is not shifted
+            for lo, hi in sorted(self._slices(start, end), reverse=True):
+                for _, key in self._index[lo:hi]:
+                    self._drop(key, self._values.pop(key))
+                del self._index[lo:hi]
+                count += hi - lo
+            self._changes += 1
+        self._sync()
+        return count
+
+    def scan(self, start, end, cursor=None, limit=100):
+        '''
+        Scan the key-value pairs in (start, end] page by page.
+
+        Args:
+            start:  The range start in hex, excluded.
+            end:    The range end in hex, included.
+            cursor: The cursor returned by the last scan.
+                    If None, scan from the start.
+            limit:  The max number of pairs returned, at least 1.
+
+        Returns:
+            A tuple (items, cursor). The items is a list of [key, value, version].
+            The cursor is used for the next scan, None if the scan is done.
+
+        Raises:
+            ValueError if the limit is less than 1.
+        '''
+        if limit < 1:
+            raise ValueError('the scan limit must be at least 1, not {}'.format(limit))
+        with self._lock:
+            slices = self._slices(start, end)
+            if cursor:
+                # resume right after the last returned (identity, key)
+                c_int = int(cursor[0], 16)
+                pos = bisect.bisect_right(self._index, (c_int, cursor[1]))
+                if len(slices) == 2 and c_int > int(end, 16):
+                    # wrapped range and the cursor is still in the first slice
+                    slices = [(max(pos, slices[0][0]), slices[0][1]), slices[1]]
+                else:
+                    lo, hi = slices[-1]
+                    slices = [(max(pos, lo), hi)]
+            # one more than the limit tells whether the scan is done
+            rows = []
+            for lo, hi in slices:
+                rows.extend(self._index[lo:min(hi, lo + limit + 1 - len(rows))])
+        result = self._items([key for _, key in rows[:limit]])
+        if len(rows) > limit:
+            rid, key = rows[limit - 1]
+            return (result, [helper._format(rid), key])
+        return (result, None)
+
+    def _item(self, key):
+        '''
+        Return the [key, value, version] of the key, None if deleted.
+        The lock keeps compaction from moving the value meanwhile.
+        '''
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            return [key, self._load(entry[1]), entry[2]]
+
+    def _items(self, keys):
+        '''
+        Return the [key, value, version] of the keys still present.
+        The index is copied under the lock by the caller, and each value
+        is loaded under the lock, so writers are not blocked by a long scan.
+        '''
+        items = (self._item(key) for key in keys)
+        return [item for item in items if item is not None]
+
+    def _save(self, key, value, version, expire_at=None):
+        '''
+        Save the value. It is called with the write lock held.
+
+        Args:
+            key:        The key of the key-value pair.
+            value:      The value of the key-value pair.
+            version:    The version of the value.
+            expire_at:  The time when the key expires. None for no expiry.
+
+        Returns:
+            The slot kept in self._values, used by _load() to get the value.
+
+        Raises:
+            N/A
+        '''
+        return value
+
+    def _slot_bytes(self, slot):
+        '''
+        Return the bytes of memory used by the slot returned by _save().
+
+        Args:
+            slot:   The slot returned by _save().
+
+        Returns:
+            The number of bytes.
+
+        Raises:
+            N/A
+        '''
+        return sys.getsizeof(slot)
+
+    def _sync(self):
+        '''
+        Make the writes durable. It is called after the write lock
+        is released, so the writes of many threads can be synced together.
+        Nothing to do for values in memory.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        pass
+
+    def _load(self, slot):
+        '''
+        Load the value saved by _save().
+
+        Args:
+            slot:   The slot returned by _save().
+
+        Returns:
+            The value.
+
+        Raises:
+            N/A
+        '''
+        return slot
+
+    def _drop(self, key, entry):
+        '''
+        Drop the value of a deleted key. It is called with the write lock held.
+
+        Args:
+            key:    The key of the key-value pair.
+            entry:  The (identity, slot, version) of the key.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        pass
+
+    def _slices(self, start, end):
+        '''
+        Find the slices of self._index in (start, end].
+        It will handle the wrap around problem.
+
+        Args:
+            start:  The range start in hex, excluded.
+            end:    The range end in hex, included.
+
+        Returns:
+            A list of (lo, hi) slices.
+
+        Raises:
+            N/A
+        '''
+        s_int = int(start, 16)
+        e_int = int(end, 16)
+        # (x,) is less than any (x, key), so it finds the first identity >= x
+        lo = bisect.bisect_left(self._index, (s_int + 1,))
+        hi = bisect.bisect_left(self._index, (e_int + 1,))
+        if s_int < e_int:
+            return [(lo, hi)]
+        elif s_int == e_int:      # empty set
+            return []
+        else:       # wrap around
+            return [(lo, len(self._index)), (0, hi)]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
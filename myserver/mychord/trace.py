@@ -0,0 +1,95 @@
+'''
+This file contains the lookup tracing. A lookup is only traced when the
+caller of /find_successor passes a trace id, e.g. made by new_id() in
+ChordClient.trace_find_successor(). The id is passed with the hop index in
+the payload of each request of the lookup, and untraced lookups record
+nothing. Each node keeps the spans of the traced requests it sent or
+served in a bounded buffer, returned by /trace/<id>, so the path of a
+lookup can be reassembled from the nodes it went through.
+'''
+import binascii
+import collections
+import os
+import threading
+import time
+from . import constants as ct
+
+class TraceBuffer(object):
+    '''
+    A bounded buffer of spans, the oldest dropped first.
+    A span is a dict with
+        'trace':    The trace id.
+        'hop':      The hop index of the request in the lookup.
+        'node':     The node which recorded the span.
+        'peer':     The node the request was sent to, None if it was served.
+        'op':       The operation, e.g. 'closest_preceding_finger'.
+        'id':       The identity looked up.
+        'start':    The time the request started.
+        'ms':       The milliseconds it took.
+        'outcome':  'ok' or the name of the exception.
+        'result':   The identity returned, None on errors.
+    '''
+
+    def __init__(self, size=None):
+        '''
+        Initialize the buffer.
+
+        Args:
+            size:   The max number of spans. If None, use TRACE_BUFFER_SIZE.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._spans = collections.deque(maxlen=ct.TRACE_BUFFER_SIZE if size is None else size)
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def get(self, trace_id):
+        '''
+        Return the spans of the trace, the oldest first.
+        '''
+        with self._lock:
+            return [span for span in self._spans if span['trace'] == trace_id]
+
+    def record(self, trace_id, hop, node, peer, op, identity, func, *args):
+        '''
+        Call the function and record its span.
+
+        Args:
+            trace_id:   The trace id.
+            hop:        The hop index.
+            node:       The node recording the span.
+            peer:       The node the request is sent to, None if served.
+            op:         The operation.
+            identity:   The identity looked up.
+            func:       The function of the request.
+            args:       The arguments of the function.
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            Re-raises the exceptions of the function.
+        '''
+        start = time.time()
+        outcome = 'ok'
+        result = None
+        try:
+            result = func(*args)
+            return result
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self.add({ 'trace': trace_id, 'hop': hop, 'node': node, 'peer': peer,
+                'op': op, 'id': identity, 'start': start,
+                'ms': (time.time() - start) * 1000, 'outcome': outcome, 'result': result })
+
+def new_id():
+    return binascii.hexlify(os.urandom(8)).decode()
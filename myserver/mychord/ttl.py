@@ -0,0 +1,215 @@
+'''
+This file contains code for the expiry of keys with a TTL.
+Reference:
+[1] Hashed and Hierarchical Timing Wheels, by George Varghese and Tony Lauck
+'''
+import math
+import threading
+import time
+from . import constants as ct
+
+def expire_at(ttl):
+    '''
+    Convert a TTL to the absolute expiry time. The absolute time is
+    what is sent to the replicas, so they expire the key together.
+
+    Args:
+        ttl:    The seconds to live. None or 0 for no expiry.
+
+    Returns:
+        The expiry time in seconds since the epoch, or None.
+
+    Raises:
+        N/A
+    '''
+    if not ttl:
+        return None
+    return time.time() + ttl
+
+class TimerWheel(object):
+    '''
+    Hierarchical timer wheel of key expiry times.
+    The level 0 wheel has TTL_WHEEL_SLOTS slots of TTL_TICK seconds, each
+    upper level has the same number of slots, each as long as a whole
+    turn of the level below. A key is put in the lowest level covering its
+    expiry, and moved down when the upper slot comes round, so adding a key
+    and each tick cost O(1) instead of a scan of all the keys.
+    Removing a key only forgets its expiry time, the stale entry in the
+    wheel is skipped when its slot comes round.
+    '''
+
+    def __init__(self, now=None):
+        '''
+        Initialize the wheel.
+
+        self._expires:  A map from key to its expiry time.
+        self._wheels:   A list of levels, each a list of slots,
+                        each slot a set of keys.
+        self._current:  The last tick processed.
+
+        Args:
+            now:    The current time. If None, use time.time().
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        self._tick = ct.TTL_TICK
+        self._slots = ct.TTL_WHEEL_SLOTS
+        self._levels = ct.TTL_WHEEL_LEVELS
+        self._expires = {}
+        self._wheels = [[set() for i in range(0, self._slots)]
+                for level in range(0, self._levels)]
+        self._current = int((time.time() if now is None else now) / self._tick)
+        self._lock = threading.Lock()
+        self._expired = 0
+
+    def add(self, key, expire_at):
+        '''
+        Set the expiry time of the key.
+
+        Args:
+            key:        The key.
+            expire_at:  The expiry time in seconds since the epoch.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            self._expires[key] = expire_at
+            self._place(key, expire_at)
+
+    def remove(self, key):
+        '''
+        Forget the expiry time of the key.
+
+        Args:
+            key:    The key.
+
+        Returns:
+            N/A
+
+        Raises:
+            N/A
+        '''
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def get(self, key):
+        '''
+        Get the expiry time of the key.
+
+        Args:
+            key:    The key.
+
+        Returns:
+            The expiry time, None if the key does not expire.
+
+        Raises:
+            N/A
+        '''
+        return self._expires.get(key)
+
+    def expired(self, key, now=None):
+        '''
+        Check whether the key has expired.
+
+        Args:
+            key:    The key.
+            now:    The current time. If None, use time.time().
+
+        Returns:
+            True if expired. False otherwise.
+
+        Raises:
+            N/A
+        '''
+        at = self._expires.get(key)
+        return at is not None and at <= (time.time() if now is None else now)
+
+    def advance(self, now=None):
+        '''
+        Move the wheel to the current time, and take the expired keys.
+
+        Args:
+            now:    The current time. If None, use time.time().
+
+        Returns:
+            A list of (key, expiry time) expired since the last call.
+
+        Raises:
+            N/A
+        '''
+        target = int(round((time.time() if now is None else now) / self._tick, 6))
+        result = []
+        with self._lock:
+            if not self._expires:       # nothing to expire, skip the ticks
+                self._current = max(self._current, target)
+            while self._current < target:
+                self._current += 1
+                # move the keys of the upper slots down, the highest first
+                for level in range(self._levels - 1, 0, -1):
+                    span = self._slots ** level
+                    if self._current % span == 0:
+                        slot = self._wheels[level][(self._current // span) % self._slots]
+                        keys = list(slot)
+                        slot.clear()
+                        for key in keys:
+                            at = self._expires.get(key)
+                            if at is None:
+                                continue
+                            if self._due(at) <= self._current:     # due at this tick
+                                self._wheels[0][self._current % self._slots].add(key)
+                            else:
+                                self._place(key, at)
+                slot = self._wheels[0][self._current % self._slots]
+                for key in slot:
+                    at = self._expires.get(key)
+                    if at is not None and self._due(at) <= self._current:
+                        del self._expires[key]
+                        result.append((key, at))
+                slot.clear()
+            self._expired += len(result)
+        return result
+
+    def stats(self):
+        '''
+        Return the statistics of the wheel.
+
+        Args:
+            N/A
+
+        Returns:
+            A dict with the number of keys with a TTL and the keys expired.
+
+        Raises:
+            N/A
+        '''
+        return { 'keys': len(self._expires), 'expired': self._expired }
+
+    def _due(self, at):
+        '''
+        Return the tick when the expiry time is due.
+        '''
+        # round off the float error, e.g. 0.3 / 0.1 is 2.9999999999999996
+        return int(math.ceil(round(at / self._tick, 6)))
+
+    def _place(self, key, at):
+        '''
+        Put the key in the lowest level covering its expiry time.
+        It is called with the lock held.
+        '''
+        due = max(self._due(at), self._current + 1)
+        # a key beyond the highest level waits in its last slot
+        due = min(due, self._current + self._slots ** self._levels - 1)
+        delta = due - self._current
+        for level in range(0, self._levels):
+            if delta < self._slots ** (level + 1):
+                span = self._slots ** level
+                self._wheels[level][(due // span) % self._slots].add(key)
+                return
@@ -1,3 +1,5 @@
+import requests
+
 class MockServer(object):
     
     def __init__(self):
@@ -6,6 +8,9 @@ class MockServer(object):
     def add_node(self, identity, node):
         self._nodes[identity] = node
 
+    def remove_node(self, identity):
+        del self._nodes[identity]
+
     def post(self, url, json):
         '''
         Mock the post function.
@@ -18,11 +23,14 @@ class MockServer(object):
             Return results according to corresponding functions.
 
         Raises:
+            requests.ConnectionError if the node is not on the server.
             Raises exceptions/errors according to corresponding functions.
         '''
         # parse url
         pos = url.find(':', 5)
         node_id = url[10:pos]
+        if node_id not in self._nodes:      # imitate a stopped node
+            raise requests.ConnectionError()
         pos = url.rfind('/')
         path = url[pos:]
         # dispatch
@@ -36,15 +44,22 @@ class MockServer(object):
         elif path == '/set_predecessor':
             self._nodes[node_id].set_predecessor(json['id'])
         elif path == '/find_successor':
-            succ = self._nodes[node_id].find_successor(json['id'])
-            rsp = MockResponse(200, {'id': succ})
+            lookup = _trace(json)
+            succ = self._nodes[node_id].find_successor(json['id'], lookup)
+            if lookup is None:
+                rsp = MockResponse(200, {'id': succ})
+            else:
+                rsp = MockResponse(200, {'id': succ, 'trace': lookup[0]})
+        elif path == '/find_successor_batch':
+            result = self._nodes[node_id].find_successor_batch(json['ids'])
+            rsp = MockResponse(200, {'result': result})
         elif path == '/get_successor':
-            succ = self._nodes[node_id].get_successor()
+            succ = self._nodes[node_id].get_successor(_trace(json))
             rsp = MockResponse(200, {'id': succ})
         elif path == '/set_successor':
             self._nodes[node_id].set_successor(json['id'])
         elif path == '/closest_preceding_finger':
-            cpf = self._nodes[node_id].closest_preceding_finger(json['id'])
+            cpf = self._nodes[node_id].closest_preceding_finger(json['id'], _trace(json))
             rsp = MockResponse(200, {'id': cpf})
         elif path == '/notify':
             self._nodes[node_id].notify(json['id'])
@@ -53,19 +68,91 @@ class MockServer(object):
             ft = self._nodes[node_id].display_finger_table()
             rsp = MockResponse(200, {'result': ft})
         elif path == '/put':
-            self._nodes[node_id].put(json['key'], json['value'])
-            rsp = MockResponse(200, {})
+            acks = self._nodes[node_id].put(json['key'], json['value'],
+                    json.get('w'), json.get('forwarded', False), json.get('expire_at'))
+            rsp = MockResponse(200, {'acks': acks})
         elif path == '/get':
-            value = self._nodes[node_id].get(json['key'])
+            value = self._nodes[node_id].get(json['key'], json.get('r'),
+                    json.get('forwarded', False))
             rsp = MockResponse(200, {'value': value})
+        elif path == '/local_put':
+            self._nodes[node_id].local_put(json['key'], json['value'],
+                    json.get('version'), json.get('expire_at'))
+        elif path == '/local_get':
+            value, version, expire_at = self._nodes[node_id].local_get_version(json['key'])
+            rsp = MockResponse(200, {'value': value, 'version': version,
+                'expire_at': expire_at})
+        elif path == '/mput':
+            result = self._nodes[node_id].mput(json['items'], json.get('w'),
+                    json.get('forwarded', False))
+            rsp = MockResponse(200, {'result': result})
+        elif path == '/mget':
+            result = self._nodes[node_id].mget(json['keys'], json.get('r'),
+                    json.get('forwarded', False))
+            rsp = MockResponse(200, {'result': result})
+        elif path == '/local_mget':
+            result = self._nodes[node_id].local_mget(json['keys'])
+            rsp = MockResponse(200, {'result': result})
+        elif path == '/local_put_batch':
+            self._nodes[node_id].local_put_batch(json['items'])
+        elif path == '/splice_out':
+            self._nodes[node_id].splice_out(
+                    json['id'], json['predecessor'], json['successor'])
+        elif path == '/range_scan':
+            limit = json.get('limit', 100)
+            if not isinstance(limit, int) or limit < 1:
+                rsp = MockResponse(400, {})
+            else:
+                items, cursor = self._nodes[node_id].range_scan(json['start'],
+                        json['end'], json.get('cursor'), limit)
+                rsp = MockResponse(200, {'result': items, 'cursor': cursor})
+        elif path == '/merkle':
+            hashes = self._nodes[node_id].merkle_hashes(json['start'],
+                    json['end'], json['level'], json['indices'])
+            rsp = MockResponse(200, {'result': hashes})
+        elif path == '/display_memory':
+            usage = self._nodes[node_id].display_memory()
+            rsp = MockResponse(200, {'result': usage})
+        elif path == '/display_migration':
+            stats = self._nodes[node_id].display_migration()
+            rsp = MockResponse(200, {'result': stats})
+        elif path == '/display_hints':
+            stats = self._nodes[node_id].display_hints()
+            rsp = MockResponse(200, {'result': stats})
         elif path == '/display_data':
             data = self._nodes[node_id].display_data()
             rsp = MockResponse(200, {'result': data})
+        elif path == '/node_info':
+            info = self._nodes[node_id].node_info()
+            rsp = MockResponse(200, {'result': info})
         else:
             rsp = MockResponse(400, {})
 
         return rsp
 
+    def get(self, url):
+        '''
+        Mock the get function, only /trace/<id> is served.
+
+        Args:
+            url:    A string like 'http://node_id:8000/trace/xxxx'.
+
+        Returns:
+            The spans of the trace.
+
+        Raises:
+            requests.ConnectionError if the node is not on the server.
+        '''
+        pos = url.find(':', 5)
+        node_id = url[10:pos]
+        if node_id not in self._nodes:      # imitate a stopped node
+            raise requests.ConnectionError()
+        path = url[url.find('/', pos):]
+        if not path.startswith('/trace/'):
+            return MockResponse(400, {})
+        spans = self._nodes[node_id].get_trace(path[len('/trace/'):])
+        return MockResponse(200, {'result': spans})
+
     def period(self):
         '''
         Imitate the periodic operations on each node.
@@ -81,6 +168,7 @@ class MockServer(object):
         '''
         for node in self._nodes.values():
             node.stabilize()
+            node.migrate()
             node.fix_fingers(True)      # use loop for testing purpose
 
 class MockResponse(object):
@@ -92,3 +180,7 @@ class MockResponse(object):
     def json(self):
         return self._json_dict
 
+def _trace(json):
+    if 'trace' not in json:
+        return None
+    return (json['trace'], json.get('hop', 0))
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+import myserver.mychord.constants as ct
+from myserver.mychord.arena_store import ArenaStore
+
+class TestArenaStore(unittest.TestCase):
+
+    _default_size = 0
+    _default_arena = 0
+
+    @classmethod
+    def setUpClass(cls):
+        '''
+        Change to smaller ring and arenas.
+        hash: a->0, k3->1, k2->2, g->3, c->4, hello->5, e->7
+        '''
+        cls._default_size = ct.RING_SIZE_BIT
+        cls._default_arena = ct.ARENA_SIZE
+        ct.RING_SIZE_BIT = 3
+        ct.ARENA_SIZE = 100
+        ct.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        '''
+        Restore chord ring default size.
+        '''
+        ct.RING_SIZE_BIT = cls._default_size
+        ct.ARENA_SIZE = cls._default_arena
+        ct.init()
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, '0.spill')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_put_get_delete(self):
+        s = ArenaStore(self._path)
+        s.put('g', 'G', 1)
+        s.put('c', {'x': [1, 2]}, 1)
+        self.assertEqual(s.get('g'), 'G')
+        self.assertEqual(s.get('c'), {'x': [1, 2]})
+        s.put('g', 'gg', 2)
+        self.assertEqual(s.get_version('g'), ('gg', 2))
+        self.assertEqual([item[0] for item in s.range_items('02', '04')], ['g', 'c'])
+        self.assertTrue(s.delete('c'))
+        self.assertEqual(s.get('c'), None)
+        usage = s.memory_usage()
+        self.assertEqual(usage['keys'], 1)
+        self.assertEqual(usage['value_bytes'], 2)
+        s.close()
+
+    def test_spill(self):
+        s = ArenaStore(self._path, cap=100)
+        for key in ['hello', 'e', 'a', 'k3', 'c']:
+            s.put(key, key * 30, 1)
+        usage = s.memory_usage()
+        self.assertTrue(usage['value_bytes'] <= 100)
+        self.assertEqual(usage['spilled_keys'], 3)
+        self.assertEqual(usage['spilled_bytes'], 30 * len('hello') + 30 + 30)
+        # the least recently used are spilled, and brought back when read
+        self.assertEqual(s.get('hello'), 'hello' * 30)
+        self.assertEqual(s.get('e'), 'e' * 30)
+        self.assertEqual(s.memory_usage()['spilled_keys'], 4)
+        self.assertEqual(s.to_dict(), { key: key * 30 for key in ['hello', 'e', 'a', 'k3', 'c'] })
+        s.close()
+        self.assertFalse(os.path.exists(self._path))
+
+    def test_compact(self):
+        s = ArenaStore(self._path, cap=10)
+        for i in range(0, 10):
+            s.put('g', 'G' * 20, i)
+        s.put('c', 'C' * 20, 1)
+        for key in ['g', 'c', 'g']:     # swap them in and out
+            s.get(key)
+        before = s.memory_usage()
+        s.compact()
+        after = s.memory_usage()
+        self.assertTrue(after['arena_bytes'] < before['arena_bytes'])
+        self.assertTrue(after['spill_file_bytes'] < before['spill_file_bytes'])
+        self.assertEqual(s.to_dict(), {'g': 'G' * 20, 'c': 'C' * 20})
+        s.close()
+
+if __name__ == '__main__':
+    unittest.main()
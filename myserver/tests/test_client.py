@@ -0,0 +1,120 @@
+'''
+This file tests ChordClient on a ring of 2^5=32 nodes.
+'''
+import asyncio
+import unittest
+import logging
+import requests
+from unittest.mock import patch
+import myserver.mychord.constants as ct
+from myserver.mychord.node import Node
+from myserver.mychord.client import ChordClient, AsyncChordClient
+from . import mock_server
+
+MockServer = mock_server.MockServer
+
+class TestClient(unittest.TestCase):
+    '''
+    Test class for client.py
+    hash: c->14, f->15, i->02, k->0c
+    '''
+
+    _default_size = 0
+
+    @classmethod
+    def setUpClass(cls):
+        '''
+        Change to smaller ring.
+        '''
+        cls._default_size = ct.RING_SIZE_BIT
+        ct.RING_SIZE_BIT = 5
+        ct.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        '''
+        Restore longer ring.
+        '''
+        ct.RING_SIZE_BIT = cls._default_size
+        ct.init()
+
+    def _ring(self, ms):
+        '''
+        Set up the ring 00, 01, 03, 11, 15, 1c.
+        '''
+        logging.disable(logging.DEBUG)      # disable logging
+        nodes = []
+        for identity in ['00', '01', '03', '11', '15', '1c']:
+            node = Node(identity)
+            ms.add_node(node._id, node)
+            node.join(nodes[-1]._id if nodes else None)
+            nodes.append(node)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        return nodes
+
+    @patch.object(requests.Session, 'post')
+    @patch('requests.post')
+    def test_put_get(self, post_mock, session_mock):
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        session_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        self._ring(ms)
+        client = ChordClient('00')
+        self.assertTrue(client.put('c', 'C') > 0)
+        self.assertEqual(client.owner('c'), '15')
+        # the range (11, 15] is cached, so 'f' goes straight to its owner
+        session_mock.reset_mock()
+        self.assertTrue(client.put('f', 'F') > 0)
+        self.assertEqual([c[0][0] for c in session_mock.call_args_list],
+                ['http://cr_15:8000/put'])
+        self.assertEqual(client.get('c'), 'C')
+        self.assertEqual(client.local_get('15', 'f')[0], 'F')
+        self.assertEqual(set(client.mput([['i', 'I'], ['k', 'K']])), {'i', 'k'})
+        self.assertEqual(client.mget(['c', 'i', 'k', 'x']),
+                {'c': 'C', 'i': 'I', 'k': 'K', 'x': None})
+        self.assertEqual(client.find_successor('12'), '15')
+        self.assertEqual(client.find_successor_batch(['02', '0c']),
+                {'02': '03', '0c': '11'})
+        client.close()
+
+    @patch.object(requests.Session, 'post')
+    @patch('requests.post')
+    def test_dead_owner(self, post_mock, session_mock):
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        session_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        self._ring(ms)
+        client = ChordClient('00')
+        client.put('c', 'C')
+        self.assertEqual(client.owner('c'), '15')
+        # the cached owner is gone, the request is routed by the seed
+        ms.remove_node('15')
+        logging.disable(logging.DEBUG)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)
+        self.assertEqual(client.get('c'), 'C')
+        self.assertEqual(client.owner('c'), '1c')
+
+    @patch.object(requests.Session, 'post')
+    @patch('requests.post')
+    def test_async(self, post_mock, session_mock):
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        session_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        self._ring(ms)
+        client = AsyncChordClient('00')
+        async def run():
+            await asyncio.gather(client.put('c', 'C'), client.put('k', 'K'))
+            return await asyncio.gather(client.get('c'), client.get('k'))
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(run()), ['C', 'K'])
+        finally:
+            loop.close()
+            client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+'''
+This file tests the ring crawl on a ring of 2^5=32 nodes.
+'''
+import unittest
+import logging
+import requests
+from unittest.mock import patch
+import myserver.mychord.constants as ct
+from myserver.mychord.node import Node
+from myserver.mychord.client import ChordClient
+from myserver.mychord import crawl
+from . import mock_server
+
+MockServer = mock_server.MockServer
+
+class TestCrawl(unittest.TestCase):
+    '''
+    Test class for crawl.py
+    '''
+
+    _default_size = 0
+
+    @classmethod
+    def setUpClass(cls):
+        '''
+        Change to smaller ring.
+        '''
+        cls._default_size = ct.RING_SIZE_BIT
+        ct.RING_SIZE_BIT = 5
+        ct.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        '''
+        Restore longer ring.
+        '''
+        ct.RING_SIZE_BIT = cls._default_size
+        ct.init()
+
+    @patch.object(requests.Session, 'post')
+    @patch('requests.post')
+    def test_crawl(self, post_mock, session_mock):
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        session_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        nodes = []
+        for identity in ['00', '01', '03', '11', '15', '1c']:
+            node = Node(identity)
+            ms.add_node(node._id, node)
+            node.join(nodes[-1]._id if nodes else None)
+            nodes.append(node)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        client = ChordClient('03')
+        client.put('c', 'C')
+        report = crawl.crawl(client, '03')
+        self.assertEqual([n['id'] for n in report['nodes']], ['00', '01', '03', '11', '15', '1c'])
+        self.assertEqual(report['issues'], [])
+        self.assertEqual(report['unreachable'], [])
+        self.assertEqual(report['keys'], 1 + ct.BACKUP_SUCC_NUM)      # with replicas
+        # a stopped node and a wrong successor are reported
+        ms.remove_node('15')
+        nodes[0].set_successor('03')
+        report = crawl.crawl(client, '03')
+        self.assertEqual(report['unreachable'], ['15'])
+        issues = '\n'.join(report['issues'])
+        self.assertIn('00: successor is 03, expected 01', issues)
+        self.assertIn('11: successor is 15 (unreachable), expected 1c', issues)
+        self.assertIn('1c: predecessor is 15 (unreachable), expected 11, range (11, 15] has no owner', issues)
+        self.assertIn('the successor walk from 03 breaks at 15 after 2 nodes', issues)
+
+    @patch.object(requests.Session, 'get')
+    @patch.object(requests.Session, 'post')
+    @patch('requests.post')
+    def test_trace(self, post_mock, session_mock, get_mock):
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        session_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        get_mock.side_effect = lambda url, timeout : ms.get(url)
+        logging.disable(logging.DEBUG)      # disable logging
+        nodes = []
+        for identity in ['00', '01', '03', '11', '15', '1c']:
+            node = Node(identity)
+            ms.add_node(node._id, node)
+            node.join(nodes[-1]._id if nodes else None)
+            nodes.append(node)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        client = ChordClient('03')
+        succ, trace_id = client.trace_find_successor('1a')
+        self.assertEqual(succ, '1c')
+        path = crawl.trace(client, '03', trace_id)
+        self.assertEqual([(h['hop'], h['node'], h['peer'], h['op'], h['result']) for h in path['hops']],
+                [(1, '03', '03', 'closest_preceding_finger', '15'),
+                    (2, '03', '15', 'get_successor', '1c'),
+                    (3, '03', '15', 'get_successor', '1c')])
+        self.assertIsNone(path['hops'][0]['server_ms'])     # called itself
+        self.assertIsNotNone(path['hops'][1]['server_ms'])
+        self.assertIsNotNone(path['ms'])
+        # an untraced lookup records nothing and returns no trace id
+        spans = [len(node._traces._spans) for node in nodes]
+        rsp = ms.post('http://cr_03:8000/find_successor', {'id': '1a'})
+        self.assertEqual(rsp.json(), {'id': '1c'})
+        self.assertEqual([len(node._traces._spans) for node in nodes], spans)
+        # a lookup forwarded to another node is followed there
+        self.assertEqual(nodes[0].remote_find_successor('03', '1a', ('t2', 0)), '1c')
+        path = crawl.trace(client, '00', 't2')
+        self.assertEqual([(h['hop'], h['node'], h['peer']) for h in path['hops']],
+                [(0, '00', '03'), (1, '03', '03'), (2, '03', '15'), (3, '03', '15')])
+        self.assertEqual([l['node'] for l in path['lookups']], ['03'])
+        self.assertEqual(crawl.trace(client, '00', 'unknown')['hops'], [])
+
+if __name__ == '__main__':
+    unittest.main()
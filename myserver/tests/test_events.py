@@ -0,0 +1,80 @@
+import logging
+import unittest
+import myserver.mychord.constants as ct
+import myserver.mychord.events as events
+import myserver.mychord.migration as mg
+from myserver.mychord.events import EventLog
+
+class Counted(object):
+    '''
+    A field counting how many times it is formatted.
+    '''
+    formatted = 0
+
+    def __format__(self, spec):
+        Counted.formatted += 1
+        return 'counted'
+
+class FakeNode(object):
+    '''
+    A node with two keys to migrate, whose target accepts every batch.
+    '''
+    _id = '0a'
+
+    def _items_in_range(self, start, end):
+        return [['g', 'G', 1, None], ['c', 'C', 1, None]]
+
+    def remote_local_put_batch(self, target, batch):
+        pass
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        events._buffer.clear()
+        events.set_level('DEBUG')
+
+    def tearDown(self):
+        events._buffer.clear()
+        events.set_level(ct.EVENT_LEVEL)
+
+    def test_lazy(self):
+        log = EventLog('test_events', '0a')
+        Counted.formatted = 0
+        logging.disable(logging.DEBUG)      # not printed, only kept
+        log.debug('found {what} in {node}', what=Counted(), node='0b')
+        logging.disable(logging.NOTSET)
+        self.assertEqual(Counted.formatted, 0)
+        result = events.recent()
+        self.assertEqual(Counted.formatted, 1)
+        self.assertEqual(result[0]['node'], '0a')
+        self.assertEqual(result[0]['event'], 'found {what} in {node}')
+        self.assertEqual(result[0]['message'], 'found counted in 0b')
+        self.assertEqual(result[0]['fields']['node'], '0b')
+        events.set_level('INFO')        # debug events off
+        log.debug('dropped')
+        log.hot('dropped')
+        self.assertEqual(len(events.recent()), 1)
+
+    def test_sample(self):
+        a = EventLog('test_events', '0a')
+        b = EventLog('test_events', '0b')
+        for i in range(0, ct.EVENT_SAMPLE_EVERY * 3):
+            a.hot('lookup {i}', i=i)
+        b.debug('stabilizing')
+        self.assertEqual([e['message'] for e in events.recent(node='0a')],
+                ['lookup 0', 'lookup {}'.format(ct.EVENT_SAMPLE_EVERY),
+                    'lookup {}'.format(ct.EVENT_SAMPLE_EVERY * 2)])
+        self.assertEqual([e['node'] for e in events.recent(limit=2)], ['0a', '0b'])
+        self.assertEqual(events.recent(limit=0), [])
+
+    def test_migration(self):
+        migrator = mg.Migrator(FakeNode())
+        migrator.add_task('0b', '00', '05')
+        migrator.run()
+        self.assertEqual([e['message'] for e in events.recent(node='0a')],
+                ['queue migration of (00, 05] to 0b',
+                    'migration of 2 keys in (00, 05] to 0b',
+                    'sent 2 keys (42 bytes) of migration to 0b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,6 @@
+import json
+import os
+import tempfile
 import unittest
 import myserver.mychord.helper as helper
 import myserver.mychord.constants as ct
@@ -36,5 +39,23 @@ class TestHelper(unittest.TestCase):
         net_id = helper._gen_net_id(test_id)
         self.assertEqual(net_id, ct.CONTAINER_PREFIX + test_id)
 
+    def test_gen_address(self):
+        test_id = 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'
+        self.assertEqual(helper._gen_address(test_id),
+                '{}{}:{}'.format(ct.CONTAINER_PREFIX, test_id, ct.NODE_PORT))
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'a': '127.0.0.1:9000'}, f)
+            helper.load_addresses(path)
+            self.assertEqual(helper._gen_address('0a'), '127.0.0.1:9000')
+            helper.set_resolver(lambda node_id: 'h:' + node_id)
+            self.assertEqual(helper._gen_address('0a'), 'h:0a')
+        finally:
+            helper.set_resolver(None)
+            helper._addresses = {}
+            helper._address_file = None
+            os.remove(path)
+
 if __name__ == '__main__':
     unittest.main()
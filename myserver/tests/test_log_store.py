@@ -0,0 +1,223 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import myserver.mychord.constants as ct
+from myserver.mychord.log_store import LogStore
+from myserver.mychord.node import Node
+
+class TestLogStore(unittest.TestCase):
+
+    _default_size = 0
+    _default_segment = 0
+
+    @classmethod
+    def setUpClass(cls):
+        '''
+        Change to smaller ring and segments.
+        hash: a->0, k3->1, k2->2, g->3, c->4, hello->5, e->7
+        '''
+        cls._default_size = ct.RING_SIZE_BIT
+        cls._default_segment = ct.LOG_SEGMENT_SIZE
+        ct.RING_SIZE_BIT = 3
+        ct.LOG_SEGMENT_SIZE = 100
+        ct.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        '''
+        Restore chord ring default size.
+        '''
+        ct.RING_SIZE_BIT = cls._default_size
+        ct.LOG_SEGMENT_SIZE = cls._default_segment
+        ct.init()
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._stores = []
+
+    def tearDown(self):
+        for s in self._stores:
+            s.close()
+        shutil.rmtree(self._dir)
+
+    def _open(self):
+        s = LogStore(self._dir)
+        self._stores.append(s)
+        return s
+
+    def _reopen(self, s):
+        s.close()
+        self._stores.remove(s)
+        return self._open()
+
+    def test_put_get_delete(self):
+        s = self._open()
+        s.put('g', 'G', 1)
+        s.put('c', {'x': [1, 2]}, 1)
+        self.assertEqual(s.get('g'), 'G')
+        self.assertEqual(s.get('c'), {'x': [1, 2]})
+        self.assertFalse(s.put('g', 'old', 0))
+        s.put('g', 'gg', 2)
+        self.assertEqual(s.get_version('g'), ('gg', 2))
+        self.assertTrue(s.delete('c'))
+        self.assertEqual(s.get('c'), None)
+        self.assertEqual(len(s), 1)
+
+    def test_get_raw(self):
+        s = self._open()
+        big = 'x' * ct.LOG_MMAP_THRESHOLD
+        s.put('g', big, 1)
+        s.put('c', 'C', 1)
+        s.put('e', [1, 2], 1)
+        raw, is_json, version = s.get_raw('g')
+        self.assertTrue(isinstance(raw, memoryview))
+        self.assertEqual(bytes(raw), big.encode('utf-8'))
+        self.assertEqual((is_json, version), (False, 1))
+        raw = None
+        self.assertEqual(s.get('g'), big)
+        self.assertEqual(s.get_raw('c'), (b'C', False, 1))
+        self.assertEqual(s.get_raw('e'), (b'[1, 2]', True, 1))
+        self.assertEqual(s.get_raw('a'), (None, False, 0))
+
+    def test_reopen(self):
+        s = self._open()
+        for key in ['hello', 'e', 'a', 'k3', 'c', 'k2', 'g']:
+            s.put(key, key.upper() * 10, 1)
+        s.put('e', 'ee', 2)
+        s.delete('a')
+        self.assertTrue(s.stats()['segments'] > 1)        # sealed segments have hints
+        expected = s.to_dict()
+        s = self._reopen(s)
+        self.assertEqual(s.to_dict(), expected)
+        self.assertEqual(s.get_version('e'), ('ee', 2))
+        self.assertEqual([item[0] for item in s.range_items('07', '03')],
+                ['k3', 'k2', 'g'])
+
+    def test_torn_tail(self):
+        s = self._open()
+        s.put('g', 'G', 1)
+        s.put('c', 'C', 1)
+        name = os.path.join(self._dir, '{:08d}.log'.format(s._active))
+        s = self._reopen(s)
+        s.close()
+        self._stores.remove(s)
+        size = os.path.getsize(name)
+        with open(name, 'r+b') as f:
+            f.truncate(size - 1)
+        s = self._open()
+        self.assertEqual(s.get('g'), 'G')
+        self.assertEqual(s.get('c'), None)
+        s.put('c', 'C2', 2)
+        s = self._reopen(s)
+        self.assertEqual(s.to_dict(), {'g': 'G', 'c': 'C2'})
+
+    def test_compact(self):
+        s = self._open()
+        for i in range(0, 20):
+            s.put('g', 'G' * 20, i)
+        s.put('c', 'C', 1)
+        before = s.stats()
+        s.compact()
+        after = s.stats()
+        self.assertTrue(after['segments'] < before['segments'])
+        self.assertTrue(after['dead_bytes'] < before['dead_bytes'])
+        self.assertEqual(s.get('g'), 'G' * 20)
+        s = self._reopen(s)
+        self.assertEqual(s.to_dict(), {'g': 'G' * 20, 'c': 'C'})
+        self.assertEqual(s.get_version('g'), ('G' * 20, 19))
+
+    def test_read_while_compact(self):
+        class RacyStore(LogStore):
+            '''
+            Compact from another thread while the first value is read.
+            '''
+            compactor = None
+            def _read(self, slot):
+                if self.compactor is None:
+                    self.compactor = threading.Thread(target=self.compact)
+                    self.compactor.start()
+                    self.compactor.join(0.1)
+                return super(RacyStore, self)._read(slot)
+        default = ct.LOG_MMAP_THRESHOLD
+        for threshold in [default, 10]:     # pread, then mmap
+            ct.LOG_MMAP_THRESHOLD = threshold
+            try:
+                s = RacyStore(os.path.join(self._dir, str(threshold)))
+                self._stores.append(s)
+                s.put('g', 'G' * 20, 1)
+                for version in range(1, 5):     # most of the first segment is dead
+                    s.put('c', 'C' * 20, version)
+                first = s._values['g'][1][0]
+                self.assertEqual(bytes(s.get_raw('g')[0]), b'G' * 20)
+                s.compactor.join()
+                self.assertNotEqual(s._values['g'][1][0], first)
+                self.assertEqual(s.get('g'), 'G' * 20)
+            finally:
+                ct.LOG_MMAP_THRESHOLD = default
+
+    def test_compact_while_writing(self):
+        s = self._open()
+        s.put('g', 'G' * 20, 0)
+        errors = []
+        def write():
+            try:
+                for i in range(1, 100):
+                    s.put('c', 'C' * 20, i)     # seals a segment every few writes
+            except Exception as e:
+                errors.append(e)
+        t = threading.Thread(target=write)
+        t.start()
+        while t.is_alive():
+            s.compact()
+        t.join()
+        s.compact()
+        self.assertEqual(errors, [])
+        self.assertTrue(s.stats()['segments'] <= 3)
+        s = self._reopen(s)
+        self.assertEqual(s.to_dict(), {'g': 'G' * 20, 'c': 'C' * 20})
+
+    def test_ttl_reopen(self):
+        s = self._open()
+        s.put('g', 'G' * 20, 1, 2000000000.5)
+        s.put('c', 'C' * 20, 1, 1000.0)
+        s.put('e', 'E' * 20, 1)
+        s.put('k2', 'K' * 20, 1, 3000.0)
+        s.put('k2', 'K' * 20, 2)        # the ttl is removed
+        self.assertTrue(s.stats()['segments'] > 1)        # sealed segments have hints
+        expected = {'g': 2000000000.5, 'c': 1000.0}
+        self.assertEqual(s.expiries(), expected)
+        s = self._reopen(s)
+        self.assertEqual(s.expiries(), expected)
+        self.assertEqual(s.get('g'), 'G' * 20)
+        for i in range(0, 10):      # kill the old segments
+            s.put('e', 'E' * 20, i + 2)
+        s.delete('c')
+        first = s._values['g'][1][0]
+        s.compact()
+        self.assertNotEqual(s._values['g'][1][0], first)      # moved with its ttl
+        s = self._reopen(s)
+        self.assertEqual(s.expiries(), {'g': 2000000000.5})
+        self.assertEqual(s.to_dict(), {'g': 'G' * 20, 'e': 'E' * 20, 'k2': 'K' * 20})
+
+    def test_node_ttl_restart(self):
+        default_backend, default_dir = ct.STORAGE_BACKEND, ct.DATA_DIR
+        ct.STORAGE_BACKEND, ct.DATA_DIR = 'log', self._dir
+        try:
+            node = Node('3')
+            node.local_put('g', 'G', 1, time.time() + 0.2)
+            node.local_put('c', 'C', 1, time.time() + 100)
+            node._data.close()
+            time.sleep(0.3)
+            node = Node('3')        # restart, g expired meanwhile
+            self._stores.append(node._data)
+            self.assertEqual(node._data.to_dict(), {'c': 'C'})
+            self.assertEqual(node._ttl.stats()['keys'], 1)
+            self.assertIsNotNone(node.local_get_version('c')[2])
+        finally:
+            ct.STORAGE_BACKEND, ct.DATA_DIR = default_backend, default_dir
+
+if __name__ == '__main__':
+    unittest.main()
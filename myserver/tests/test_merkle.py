@@ -0,0 +1,63 @@
+import unittest
+import myserver.mychord.constants as ct
+import myserver.mychord.helper as helper
+from myserver.mychord.merkle import MerkleTree
+
+class TestMerkleTree(unittest.TestCase):
+
+    _default_size = 0
+
+    @classmethod
+    def setUpClass(cls):
+        '''
+        Change to smaller ring.
+        '''
+        cls._default_size = ct.RING_SIZE_BIT
+        ct.RING_SIZE_BIT = 5
+        ct.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        '''
+        Restore chord ring default size.
+        '''
+        ct.RING_SIZE_BIT = cls._default_size
+        ct.init()
+
+    def _entries(self):
+        return [(rid, 'k{}'.format(rid), 1) for rid in [0x11, 0x15, 0x1c, 0x01, 0x03]]
+
+    def test_same(self):
+        t1 = MerkleTree('10', '08', self._entries(), 3)
+        t2 = MerkleTree('10', '08', self._entries(), 3)
+        self.assertEqual(t1.depth(), 3)
+        self.assertEqual(t1.get(0, 0), t2.get(0, 0))
+
+    def test_diff(self):
+        entries = self._entries()
+        t1 = MerkleTree('10', '08', entries, 3)
+        entries[2] = (0x1c, 'k28', 2)        # newer version
+        t2 = MerkleTree('10', '08', entries, 3)
+        self.assertNotEqual(t1.get(0, 0), t2.get(0, 0))
+        diff = [i for i in range(0, 8) if t1.get(3, i) != t2.get(3, i)]
+        self.assertEqual(len(diff), 1)
+        start, end = t1.leaf_range(diff[0])
+        self.assertTrue(int(start, 16) < 0x1c <= int(end, 16))
+
+    def test_leaf_range(self):
+        # (10, 08] wraps around and has 24 identities
+        tree = MerkleTree('10', '08', [], 3)
+        self.assertEqual(tree.leaf_range(0), ('10', '13'))
+        self.assertEqual(tree.leaf_range(7), ('05', '08'))
+        # the leaves cover the range without overlaps
+        for i in range(0, 7):
+            self.assertEqual(tree.leaf_range(i)[1], tree.leaf_range(i + 1)[0])
+        # more leaves than identities, some leaves are empty
+        tree = MerkleTree('00', '02', [(1, 'a', 1), (2, 'b', 1)], 3)
+        self.assertEqual(tree.leaf_range(0), ('00', '01'))
+        self.assertEqual(tree.leaf_range(1), ('01', '01'))
+        self.assertEqual(tree.leaf_range(4), ('01', '02'))
+        self.assertEqual(tree.leaf_range(7), ('02', '02'))
+
+if __name__ == '__main__':
+    unittest.main()
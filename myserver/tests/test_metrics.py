@@ -0,0 +1,46 @@
+import threading
+import unittest
+from myserver.mychord.metrics import Registry
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter('requests_total', 'Requests.', ['path', 'code'])
+        def work():
+            for i in range(0, 1000):
+                counter.inc('/get', 200)
+        threads = [threading.Thread(target=work) for i in range(0, 8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        counter.inc('/put', 200, amount=5)
+        self.assertEqual(counter.collect(), {('/get', 200): 8000, ('/put', 200): 5})
+        self.assertIn('requests_total{path="/get",code="200"} 8000', registry.render())
+        # the threads are spread over the stripes
+        used = [data for data, _ in counter._shards if data]
+        self.assertTrue(len(used) > 1)
+
+    def test_histogram(self):
+        registry = Registry()
+        hist = registry.histogram('hops', 'Hops.', (), (1, 2, 4))
+        for value in [0, 1, 2, 3, 10]:
+            hist.observe(value)
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[2:], ['hops_bucket{le="1"} 2', 'hops_bucket{le="2"} 3',
+            'hops_bucket{le="4"} 4', 'hops_bucket{le="+Inf"} 5', 'hops_sum 16.0', 'hops_count 5'])
+        with hist.time():
+            pass
+        self.assertEqual(hist.collect()[()][0][0], 3)
+
+    def test_gauge(self):
+        registry = Registry()
+        registry.gauge('keys', 'Keys.', ['kind'], lambda: {('all',): 3})
+        registry.gauge('broken', 'No node yet.', [], lambda: 1 / 0)
+        self.assertEqual(registry.render().splitlines(), ['# HELP keys Keys.',
+            '# TYPE keys gauge', 'keys{kind="all"} 3',
+            '# HELP broken No node yet.', '# TYPE broken gauge'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ This file tests the core functionality of Node on a ring of 2^3=8 nodes.
 '''
 import unittest
 import logging
+import time
 from unittest.mock import patch
 import myserver.mychord.constants as ct
 from myserver.mychord.node import Node
@@ -244,5 +245,437 @@ class TestNodeCore(unittest.TestCase):
         self.assertEqual(node_3.local_get('hello'), None)
         self.assertEqual(node_1.local_get('hello'), None)
 
+    @patch('requests.post')
+    def test_leave(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        # create nodes
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        node_1 = Node('1')
+        ms.add_node(node_1._id, node_1)
+        node_1.join(node_3._id)
+        for i in range(0, 10):
+            ms.period()
+        # node 1 leaves, its keys go to node 3
+        node_1.local_put('hello', 'world')
+        node_1.leave()
+        ms.remove_node(node_1._id)
+        self.assertTrue(node_1.has_left())
+        self.assertEqual(node_1.local_get('hello'), None)
+        self.assertEqual(node_3.local_get('hello'), 'world')
+        self.assertEqual(node_0.get_successor(), node_3._id)
+        self.assertEqual(node_3.get_predecessor(), node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        self.assertEqual(node_0.display_finger_table(), ['3', '3', '3', '0'])
+        self.assertEqual(node_3.display_finger_table(), ['0', '0', '0', '0'])
+        # node 3 leaves, node 0 is alone
+        node_3.leave()
+        ms.remove_node(node_3._id)
+        self.assertEqual(node_0.get_predecessor(), None)
+        self.assertEqual(node_0.get_successor(), node_0._id)
+        self.assertEqual(node_0.local_get('hello'), 'world')
+
+    @patch('requests.post')
+    def test_migration(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        # hash: a->0, k3->1, k2->2, g->3, c->4
+        for key in ['a', 'k3', 'k2', 'g', 'c']:
+            node_0.local_put(key, key)
+        # node 3 takes (0, 3]
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        self.assertEqual(node_3.local_get('k3'), 'k3')
+        self.assertEqual(node_3.local_get('k2'), 'k2')
+        self.assertEqual(node_3.local_get('g'), 'g')
+        self.assertEqual(node_0.display_migration()['keys_by_kind']['migration'], 3)
+        self.assertEqual(node_0.display_migration()['pending'], 0)
+        # node 1 takes (0, 1] from node 3
+        node_1 = Node('1')
+        ms.add_node(node_1._id, node_1)
+        node_1.join(node_3._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        self.assertEqual(node_1.local_get('k3'), 'k3')
+        self.assertEqual(node_3.display_migration()['keys_by_kind']['migration'], 1)
+
+    @patch('requests.post')
+    def test_drop_stale(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        # hash: a->0, k3->1, k2->2, g->3, c->4
+        for key in ['a', 'k3', 'k2', 'g', 'c']:
+            node_0.local_put(key, key)
+        # stabilize only queues the transfer to node 4
+        node_4 = Node('4')
+        ms.add_node(node_4._id, node_4)
+        node_4.join(node_0._id)
+        node_4.stabilize()
+        self.assertEqual(node_0.display_migration()['pending'], 1)
+        self.assertEqual(node_4.local_get('k3'), None)
+        node_0.migrate()
+        self.assertEqual(node_0.display_migration()['pending'], 0)
+        self.assertEqual(node_4.local_get('k3'), 'k3')
+        # too few nodes, node 0 keeps all the copies
+        for i in range(0, 10):
+            ms.period()
+        self.assertEqual(node_0.drop_stale(), 0)
+        # node 0 keeps the keys of 3 and 4, and drops the keys of 1 and 2
+        nodes = {}
+        for identity in ['1', '2', '3']:
+            nodes[identity] = Node(identity)
+            ms.add_node(identity, nodes[identity])
+            nodes[identity].join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        self.assertEqual(node_0.drop_stale(), 2)
+        self.assertEqual(node_0.local_get('k3'), None)
+        self.assertEqual(node_0.local_get('k2'), None)
+        self.assertEqual(node_0.local_get('g'), 'g')
+        self.assertEqual(node_0.local_get('a'), 'a')
+        self.assertEqual(nodes['1'].local_get('k3'), 'k3')
+        self.assertEqual(node_0.drop_stale(), 0)
+
+    @patch('requests.post')
+    def test_ring_put_get(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        node_1 = Node('1')
+        ms.add_node(node_1._id, node_1)
+        node_1.join(node_3._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        # hash(hello) -> 5, owned by node 0 and replicated on 1 and 3
+        self.assertEqual(node_1.put('hello', 'world', 3), 3)
+        self.assertEqual(node_0.local_get('hello'), 'world')
+        self.assertEqual(node_1.local_get('hello'), 'world')
+        self.assertEqual(node_3.local_get('hello'), 'world')
+        # hash(k3) -> 1, owned by node 1
+        self.assertEqual(node_3.put('k3', 'v3', 1), 1)
+        self.assertEqual(node_1.local_get('k3'), 'v3')
+        self.assertEqual(node_0.get('k3'), 'v3')
+        self.assertEqual(node_3.get('hello'), 'world')
+        self.assertEqual(node_3.get('nothing'), None)
+
+    @patch('requests.post')
+    def test_mput_mget(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        node_1 = Node('1')
+        ms.add_node(node_1._id, node_1)
+        node_1.join(node_3._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        keys = ['a', 'k3', 'k2', 'g', 'c', 'hello', 'e']
+        # one batch lookup for all the keys, one request per next hop
+        post_mock.reset_mock()
+        with patch.object(node_3, 'find_successor', wraps=node_3.find_successor) as fs, \
+                patch.object(node_3, 'find_successor_batch',
+                        wraps=node_3.find_successor_batch) as fsb:
+            groups = node_3._group_by_owner(keys)
+        self.assertEqual(dict(groups), {'1': ['k3'], '3': ['k2', 'g'],
+                '0': ['c', 'hello', 'e', 'a']})
+        self.assertEqual(list(groups), ['0', '1', '3'])
+        self.assertEqual(fs.call_count, 0)
+        self.assertEqual(fsb.call_count, 1)
+        lookups = [c for c in post_mock.call_args_list if '/find_successor' in c[0][0]]
+        self.assertEqual(len(lookups), 1)
+        result = node_3.mput([[key, key.upper()] for key in keys], 3)
+        self.assertEqual(result, { key: 3 for key in keys })
+        for node in [node_0, node_1, node_3]:
+            self.assertEqual(node.local_get('hello'), 'HELLO')
+            self.assertEqual(node.local_get('k2'), 'K2')
+        self.assertEqual(node_1.mget(keys + ['nothing']),
+                dict({ key: key.upper() for key in keys }, nothing=None))
+        # the keys of an unreachable owner fail alone
+        ms.remove_node(node_1._id)
+        result = node_3.mput([['k3', 'x'], ['g', 'y']])
+        self.assertEqual(result['k3'], 0)
+        self.assertEqual(result['g'], 2)
+        self.assertEqual(node_3.mget(['k3', 'g']), {'k3': None, 'g': 'y'})
+
+    @patch('requests.post')
+    def test_quorum_get(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        node_1 = Node('1')
+        ms.add_node(node_1._id, node_1)
+        node_1.join(node_3._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        # hash(hello) -> 5, owned by node 0 and replicated on 1 and 3
+        node_1.put('hello', 'world', 3)
+        # node 3 missed the write, node 1 has a newer one
+        node_3._data.delete('hello')
+        _, version, _ = node_0.local_get_version('hello')
+        node_1.local_put('hello', 'newer', version + 1)
+        self.assertEqual(node_3.get('hello', 3), 'newer')
+        # lagging replicas are repaired in background
+        for i in range(0, 100):
+            if node_0.local_get('hello') == node_3.local_get('hello') == 'newer':
+                break
+            time.sleep(0.01)
+        self.assertEqual(node_0.local_get_version('hello'), ('newer', version + 1, None))
+        self.assertEqual(node_3.local_get_version('hello'), ('newer', version + 1, None))
+
+    @patch('requests.post')
+    def test_anti_entropy(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        node_1 = Node('1')
+        ms.add_node(node_1._id, node_1)
+        node_1.join(node_3._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        # hash: c->4, hello->5, e->7, all owned by node 0
+        for key in ['c', 'hello', 'e']:
+            node_0.put(key, key, 3)
+        self.assertEqual(node_0.anti_entropy(), 0)
+        # node 1 lost a key, node 3 has a newer value
+        node_1._data.delete('c')
+        _, version, _ = node_3.local_get_version('e')
+        node_3.local_put('e', 'newer', version + 1)
+        # push c to node 1, pull e from node 3
+        self.assertEqual(node_0.anti_entropy(), 2)
+        # push e to node 1
+        self.assertEqual(node_0.anti_entropy(), 1)
+        for node in [node_0, node_1, node_3]:
+            self.assertEqual(node.local_get('c'), 'c')
+            self.assertEqual(node.local_get('e'), 'newer')
+        self.assertEqual(node_0.anti_entropy(), 0)
+
+    @patch('requests.post')
+    def test_re_replication(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        nodes = [node_0]
+        for identity in ['3', '1', '6']:
+            node = Node(identity)
+            ms.add_node(node._id, node)
+            node.join(node_0._id)
+            nodes.append(node)
+            for i in range(0, 10):
+                ms.period()
+        node_3, node_1, node_6 = nodes[1:]
+        # hash(e) -> 7, owned by node 0 and replicated on 1 and 3
+        node_0.put('e', 'e', 3)
+        self.assertEqual(node_6.local_get('e'), None)
+        # node 1 dies, node 6 becomes a replica of node 0
+        ms.remove_node(node_1._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        self.assertEqual(node_0._replicas(), [node_3._id, node_6._id])
+        self.assertEqual(node_6.local_get('e'), 'e')
+        stats = node_0.display_migration()
+        self.assertTrue(stats['keys_by_kind']['replication'] >= 1)
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['current'], None)
+
+    @patch('requests.post')
+    def test_restart_no_re_replication(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_6 = Node('6')
+        ms.add_node(node_6._id, node_6)
+        node_6.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        # hash: k2->2, g->3, on node 6 and 0
+        node_0.put('k2', 'k2', 2)
+        node_0.put('g', 'g', 2)
+        # node 3 starts with the keys it kept on disk, as with the log store
+        node_3 = Node('3')
+        node_3.local_put('k2', 'k2')
+        node_3.local_put('g', 'g')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        self.assertEqual(node_3._replicas(), ['6', '0'])
+        self.assertEqual(node_3.display_migration()['keys_by_kind']['replication'], 0)
+        # a later change of the replicas is still copied
+        node_4 = Node('4')
+        ms.add_node(node_4._id, node_4)
+        node_4.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        self.assertEqual(node_3._replicas(), ['4', '6'])
+        self.assertEqual(node_3.display_migration()['keys_by_kind']['replication'], 2)
+        self.assertEqual(node_4.local_get('g'), 'g')
+
+    @patch('requests.post')
+    def test_hinted_handoff(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        node_1 = Node('1')
+        ms.add_node(node_1._id, node_1)
+        node_1.join(node_3._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        # node 1 is unreachable for a while
+        ms.remove_node(node_1._id)
+        self.assertEqual(node_0.put('hello', 'world', 3), 2)       # the hint is not an ack
+        self.assertEqual(node_0.display_hints()['pending'], 1)
+        self.assertEqual(node_3.local_get('hello'), 'world')
+        # node 1 is back, the hint is replayed
+        ms.add_node(node_1._id, node_1)
+        node_0.stabilize()
+        self.assertEqual(node_1.local_get('hello'), 'world')
+        stats = node_0.display_hints()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['replayed'], 1)
+
+    @patch('requests.post')
+    def test_write_quorum_not_met(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        nodes = []
+        for identity in ['0', '1', '3']:
+            node = Node(identity)
+            ms.add_node(node._id, node)
+            node.join(nodes[-1]._id if nodes else None)
+            nodes.append(node)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        # both replicas of node 0 are down, only hints are written
+        ms.remove_node('1')
+        ms.remove_node('3')
+        self.assertEqual(nodes[0].put('hello', 'world', 2, True), 1)
+        self.assertEqual(nodes[0].mput([['a', 'A'], ['b', 'B']], 2, True), {'a': 1, 'b': 1})
+        self.assertEqual(nodes[0].display_hints()['pending'], 6)
+
+    @patch('requests.post')
+    def test_ttl(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        node_0 = Node('0')
+        ms.add_node(node_0._id, node_0)
+        node_0.join()
+        node_3 = Node('3')
+        ms.add_node(node_3._id, node_3)
+        node_3.join(node_0._id)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        # hash(hello) -> 5, owned by node 0 and replicated on 3
+        at = time.time() + 1000
+        node_3.put('hello', 'world', 2, expire_at=at)
+        self.assertEqual(node_3.local_get_version('hello')[2], at)
+        self.assertEqual(node_0.get('hello'), 'world')
+        # the timer wheel deletes it on every replica
+        self.assertEqual(node_0.expire(at - 1), 0)
+        self.assertEqual(node_0.expire(at + 1), 1)
+        self.assertEqual(node_3.expire(at + 1), 1)
+        self.assertEqual(node_0.local_get('hello'), None)
+        self.assertEqual(node_3.local_get('hello'), None)
+        # a later write without TTL does not expire
+        node_0.put('hello', 'short', expire_at=time.time() + 1000)
+        node_0.put('hello', 'forever')
+        self.assertEqual(node_0.expire(at + 1), 0)
+        self.assertEqual(node_0.get('hello'), 'forever')
+        # lazy expiry on local_get, before the wheel comes round
+        node_0.put('hello', 'short', expire_at=time.time() + 0.05)
+        time.sleep(0.1)
+        self.assertEqual(node_0.local_get('hello'), None)
+        self.assertEqual(node_0.get('hello'), None)
+
 if __name__ == '__main__':
     unittest.main()
@@ -112,5 +112,34 @@ class TestNodeCore(unittest.TestCase):
         self.assertEqual(node_1c._table.get_node(4), node_11._id)
         self.assertEqual(node_1c._table.get_node(5), node_11._id)
 
+    @patch('requests.post')
+    def test_find_successor_batch(self, post_mock):
+        # set up mock server
+        ms = MockServer()
+        post_mock.side_effect = lambda url, json, timeout : ms.post(url, json)
+        logging.disable(logging.DEBUG)      # disable logging
+        nodes = []
+        for identity in ['00', '01', '03', '11', '15', '1c']:
+            node = Node(identity)
+            ms.add_node(node._id, node)
+            node.join(nodes[-1]._id if nodes else None)
+            nodes.append(node)
+        for i in range(0, 10):
+            ms.period()
+        logging.disable(logging.NOTSET)      # enable logging
+        ids = ['{:02x}'.format(i) for i in range(0, 32)]
+        # the first node at or after the identity
+        expected = { identity: next((n._id for n in nodes if n._id >= identity), '00')
+                for identity in ids }
+        post_mock.reset_mock()
+        self.assertEqual(nodes[0].find_successor_batch(ids), expected)
+        # one request per next hop, far fewer than one lookup per id
+        batch_calls = [c for c in post_mock.call_args_list
+                if c[0][0].endswith('/find_successor_batch')]
+        self.assertEqual(len(post_mock.call_args_list), len(batch_calls))
+        self.assertTrue(len(batch_calls) <= len(nodes))
+        self.assertEqual(nodes[3].find_successor_batch(['12', '15', '16']),
+                {'12': '15', '15': '15', '16': '1c'})
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,7 @@
 import unittest
 import logging
+import requests
+from unittest.mock import patch
 import myserver.mychord.constants as ct
 import myserver.mychord.helper as helper
 from myserver.mychord.node import Node
@@ -148,5 +150,44 @@ class TestNode(unittest.TestCase):
         end = helper._format(int(h, 16)//2)
         self.assertTrue(node._in_range_ee(test, start, end))
 
+    @patch('myserver.mychord.node.time.sleep')
+    @patch('requests.post')
+    def test_requests_post_retry(self, post_mock, sleep_mock):
+        '''
+        test a timed out request is retried after a random backoff
+        '''
+        node = Node('b444ac06613fc8d63795be9ad0beaf55011936ac')
+        post_mock.side_effect = requests.exceptions.Timeout()
+        with self.assertRaises(requests.ConnectionError):
+            node._requests_post('http://cr_0a:8000/get_successor', {}, retry=2)
+        self.assertEqual(post_mock.call_count, 3)
+        self.assertEqual(sleep_mock.call_count, 2)      # between the 3 tries
+        for call in sleep_mock.call_args_list:
+            self.assertTrue(1 <= call[0][0] <= 3)
+        # a refused connection is not retried
+        post_mock.reset_mock()
+        sleep_mock.reset_mock()
+        post_mock.side_effect = requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            node._requests_post('http://cr_0a:8000/get_successor', {}, retry=2)
+        self.assertEqual(post_mock.call_count, 1)
+        self.assertEqual(sleep_mock.call_count, 0)
+
+    @patch('myserver.mychord.node.time.sleep')
+    @patch('requests.post')
+    def test_replica_put_no_retry(self, post_mock, sleep_mock):
+        '''
+        test a replica write times out once, then is hinted without retry
+        '''
+        node = Node('b444ac06613fc8d63795be9ad0beaf55011936ac')
+        post_mock.side_effect = requests.exceptions.Timeout()
+        self.assertFalse(node._replica_put_batch('0a', [['a', 'A', 1, None], ['b', 'B', 1, None]]))
+        self.assertFalse(node._replica_put('0a', 'c', 'C', 1))
+        self.assertEqual(post_mock.call_count, 2)
+        for call in post_mock.call_args_list:
+            self.assertEqual(call[1]['timeout'], ct.REPLICA_TIMEOUT)
+        self.assertEqual(sleep_mock.call_count, 0)
+        self.assertEqual(node.display_hints()['pending'], 3)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,38 @@
+import threading
+import unittest
+import myserver.mychord.profiler as profiler
+
+def wait_for_stop(event):
+    event.wait()
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=wait_for_stop, args=(self._stop,),
+                name='Thread-7 (worker)')
+        self._thread.start()
+
+    def tearDown(self):
+        self._stop.set()
+        self._thread.join()
+
+    def test_profile(self):
+        stacks = profiler.profile(0.1, 0.01)
+        lines = [line for line in stacks.splitlines() if 'test_profiler.py:wait_for_stop' in line]
+        self.assertEqual(len(lines), 1)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertTrue(stack.startswith('Thread-N_(worker);'))
+        self.assertTrue(stack.endswith('test_profiler.py:wait_for_stop;threading.py:wait;threading.py:wait'))
+        self.assertGreater(int(count), 0)
+        self.assertNotIn('profiler.py:profile', stacks)     # the profiling thread is skipped
+        with profiler._running:     # one profile at a time
+            self.assertIsNone(profiler.profile(0.1))
+
+    def test_threads(self):
+        text = profiler.threads()
+        self.assertIn('Thread Thread-7 (worker)', text)
+        self.assertIn('in wait_for_stop', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import threading
+import myserver.mychord.constants as ct
+import myserver.mychord.helper as helper
+from myserver.mychord.store import KeyStore
+
+class TestKeyStore(unittest.TestCase):
+
+    _default_size = 0
+
+    @classmethod
+    def setUpClass(cls):
+        '''
+        Change to smaller ring.
+        hash: a->0, k3->1, k2->2, g->3, c->4, hello->5, e->7
+        '''
+        cls._default_size = ct.RING_SIZE_BIT
+        ct.RING_SIZE_BIT = 3
+        ct.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        '''
+        Restore chord ring default size.
+        '''
+        ct.RING_SIZE_BIT = cls._default_size
+        ct.init()
+
+    def _new_store(self):
+        s = KeyStore()
+        for key in ['hello', 'e', 'a', 'k3', 'c', 'k2', 'g']:
+            s.put(key, key.upper())
+        return s
+
+    def test_put_get_delete(self):
+        s = self._new_store()
+        self.assertEqual(len(s), 7)
+        self.assertEqual(s.get('g'), 'G')
+        s.put('g', 'gg')
+        self.assertEqual(s.get('g'), 'gg')
+        self.assertEqual(len(s), 7)
+        self.assertTrue(s.delete('g'))
+        self.assertFalse(s.delete('g'))
+        self.assertEqual(s.get('g'), None)
+        self.assertFalse('g' in s)
+        self.assertEqual([item[0] for item in s.items()],
+                ['a', 'k3', 'k2', 'c', 'hello', 'e'])
+
+    def test_range(self):
+        s = self._new_store()
+        self.assertEqual([item[0] for item in s.range_items('0', '3')],
+                ['k3', 'k2', 'g'])
+        self.assertEqual(s.count_range('0', '3'), 3)
+        # wrap around
+        self.assertEqual([item[0] for item in s.range_items('4', '1')],
+                ['hello', 'e', 'a', 'k3'])
+        self.assertEqual(s.count_range('4', '1'), 4)
+        # empty set
+        self.assertEqual(s.range_items('2', '2'), [])
+        self.assertEqual(s.delete_range('4', '1'), 4)
+        self.assertEqual([item[0] for item in s.items()], ['k2', 'g', 'c'])
+        self.assertEqual(s.get('hello'), None)
+
+    def test_scan(self):
+        s = self._new_store()
+        keys = []
+        cursor = None
+        while True:
+            items, cursor = s.scan('2', '1', cursor, 2)
+            keys += [item[0] for item in items]
+            if not cursor:
+                break
+        self.assertEqual(keys, ['g', 'c', 'hello', 'e', 'a', 'k3'])
+        items, cursor = s.scan('0', '3', None, 3)
+        self.assertEqual(len(items), 3)
+        self.assertEqual(cursor, None)
+        items, cursor = s.scan('0', '3', [helper._format(2), 'k2'], 3)
+        self.assertEqual(items, [['g', 'G', 0]])
+        for limit in [0, -1]:
+            with self.assertRaises(ValueError):
+                s.scan('0', '3', None, limit)
+        items, cursor = s.scan('0', '3', None, 1)
+        self.assertEqual((items, cursor), ([['k3', 'K3', 0]], [helper._format(1), 'k3']))
+
+    def test_delete_while_reading(self):
+        class SlowStore(KeyStore):
+            '''
+            Delete g from another thread while the first value is loaded.
+            '''
+            deleter = None
+            def _load(self, slot):
+                if self.deleter is None:
+                    self.deleter = threading.Thread(target=self.delete, args=('g',))
+                    self.deleter.start()
+                    self.deleter.join(0.1)
+                return super(SlowStore, self)._load(slot)
+        for read in [lambda s: s.range_items('0', '3'),
+                lambda s: s.scan('0', '3')[0], lambda s: s.items()]:
+            s = SlowStore()
+            for key in ['k3', 'k2', 'g', 'c']:
+                s.put(key, key.upper())
+            keys = [item[0] for item in read(s)]
+            s.deleter.join()
+            self.assertEqual(keys[:2], ['k3', 'k2'])
+            self.assertEqual([item[1] for item in s.range_versions('0', '3')],
+                    ['k3', 'k2'])
+
+    def test_version(self):
+        s = KeyStore()
+        self.assertTrue(s.put('a', 'v2', 2))
+        self.assertFalse(s.put('a', 'v1', 1))
+        self.assertEqual(s.get_version('a'), ('v2', 2))
+        self.assertTrue(s.put('a', 'v3', 3))
+        self.assertEqual(s.get('a'), 'v3')
+        self.assertEqual(s.get_version('b'), (None, 0))
+
+if __name__ == '__main__':
+    unittest.main()
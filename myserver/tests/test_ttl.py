@@ -0,0 +1,45 @@
+import unittest
+import myserver.mychord.constants as ct
+from myserver.mychord.ttl import TimerWheel
+
+class TestTimerWheel(unittest.TestCase):
+
+    def test_expire(self):
+        wheel = TimerWheel(now=0)
+        wheel.add('a', 0.5)
+        wheel.add('b', 10)      # on the level 1 wheel
+        wheel.add('c', 1000)       # on the level 2 wheel
+        self.assertEqual(wheel.advance(0.4), [])
+        self.assertEqual(wheel.advance(0.5), [('a', 0.5)])
+        self.assertEqual(wheel.advance(9.9), [])
+        self.assertTrue(wheel.expired('b', 10))
+        self.assertEqual(wheel.advance(10), [('b', 10)])
+        self.assertEqual(wheel.advance(999.9), [])
+        self.assertEqual(wheel.advance(1000), [('c', 1000)])
+        self.assertEqual(wheel.stats(), {'keys': 0, 'expired': 3})
+
+    def test_update_remove(self):
+        wheel = TimerWheel(now=0)
+        wheel.add('a', 1)
+        wheel.add('b', 1)
+        wheel.add('a', 20)      # the old entry is skipped
+        wheel.remove('b')
+        self.assertEqual(wheel.get('b'), None)
+        self.assertEqual(wheel.advance(5), [])
+        self.assertEqual(wheel.get('a'), 20)
+        self.assertEqual(wheel.advance(20), [('a', 20)])
+
+    def test_beyond_wheels(self):
+        default_levels = ct.TTL_WHEEL_LEVELS
+        ct.TTL_WHEEL_LEVELS = 2     # to keep the test short
+        try:
+            wheel = TimerWheel(now=0)
+            far = ct.TTL_TICK * ct.TTL_WHEEL_SLOTS ** 2 * 3
+            wheel.add('a', far)
+            self.assertEqual(wheel.advance(far - 1), [])
+            self.assertEqual(wheel.advance(far), [('a', far)])
+        finally:
+            ct.TTL_WHEEL_LEVELS = default_levels
+
+if __name__ == '__main__':
+    unittest.main()
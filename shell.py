@@ -0,0 +1,167 @@
+'''
+This file contains the shell mode of helper.py. It runs many commands
+in one process, so the connections, the container addresses and the
+ownership caches of the clients are kept warm between them.
+'''
+import concurrent.futures
+import io
+import shlex
+import sys
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROMPT = 'chord> '
+WORKERS = 8         # the max number of background commands running together
+
+class _ThreadOutput(object):
+    '''
+    A stdout which buffers the output of background commands per thread,
+    so the output of each command is printed together when it is done.
+    '''
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+        self._local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        buf = getattr(self._local, 'buf', None)
+        if buf is None:
+            with self.lock:
+                return self._stdout.write(text)
+        return buf.write(text)
+
+    def flush(self):
+        self._stdout.flush()
+
+    def emit(self, text):
+        '''
+        Write the text to the real stdout at once.
+        '''
+        with self.lock:
+            self._stdout.write(text)
+            self._stdout.flush()
+
+    def capture(self):
+        '''
+        Buffer the output of the current thread.
+        '''
+        self._local.buf = io.StringIO()
+
+    def release(self):
+        '''
+        Stop buffering the current thread, and return what was buffered.
+        '''
+        buf = self._local.buf
+        self._local.buf = None
+        return buf.getvalue()
+
+    def __getattr__(self, name):
+        return getattr(self._stdout, name)
+
+def run(make_parser, dispatch, path='-'):
+    '''
+    Run the commands of a script or stdin, one per line, each with the
+    same arguments as helper.py, e.g. `-p 00 key value`.
+    A command ending with '&' runs in the background, and 'wait' waits
+    for all of them. Lines starting with '#' are ignored, and 'exit'
+    stops the shell. A failed command does not stop the others.
+
+    Args:
+        make_parser:    A function returning the argparse parser.
+        dispatch:       A function(parser, args) running the command.
+        path:           The script. '-' for stdin.
+
+    Returns:
+        N/A
+
+    Raises:
+        OSError
+    '''
+    real_stdout = sys.stdout
+    stdout = _ThreadOutput(real_stdout)
+    sys.stdout = stdout
+    source = sys.stdin if path == '-' else open(path)
+    interactive = path == '-' and sys.stdin.isatty()
+    pending = {}        # future -> its job number
+    count = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(WORKERS) as executor:
+            for line in _lines(source, interactive):
+                try:
+                    words = shlex.split(line, comments=True)
+                except ValueError as e:
+                    print('error: {}'.format(e))
+                    continue
+                if not words:
+                    continue
+                if words[0] in ('exit', 'quit'):
+                    break
+                if words == ['wait']:
+                    _wait(pending)
+                    continue
+                if words[-1] != '&':
+                    _execute(make_parser, dispatch, words)
+                    continue
+                count += 1
+                print('[{}] started'.format(count))
+                f = executor.submit(_background, stdout, make_parser, dispatch,
+                        words[:-1], count)
+                pending[f] = count
+            _wait(pending)
+    finally:
+        sys.stdout = real_stdout
+        if source is not sys.stdin:
+            source.close()
+
+def _lines(source, interactive):
+    '''
+    Yield the lines of the source, with a prompt if interactive.
+    '''
+    if not interactive:
+        for line in source:
+            yield line
+        return
+    while True:
+        try:
+            yield input(PROMPT)
+        except EOFError:
+            print()
+            return
+
+def _execute(make_parser, dispatch, words):
+    '''
+    Parse and run one command. The errors are printed, not raised.
+    '''
+    parser = make_parser()
+    try:
+        args = parser.parse_args(words)
+        if args.shell:
+            print('error: --shell cannot be nested')
+            return
+        dispatch(parser, args)
+    except SystemExit:      # argparse has printed the error
+        pass
+    except Exception as e:
+        logger.debug('command failed', exc_info=True)
+        print('error: {}: {}'.format(type(e).__name__, e))
+
+def _background(stdout, make_parser, dispatch, words, number):
+    '''
+    Run one command with its output buffered, then print it.
+    '''
+    stdout.capture()
+    try:
+        _execute(make_parser, dispatch, words)
+    finally:
+        output = stdout.release()
+        stdout.emit('[{}] done: {}\n{}'.format(number, ' '.join(words), output))
+
+def _wait(pending):
+    '''
+    Wait for the background commands.
+    '''
+    concurrent.futures.wait(list(pending))
+    pending.clear()